@@ -0,0 +1,6 @@
+import os
+
+# Import profiling has to start before the rest of the package is imported
+if os.getenv("KODA_PROFILE_IMPORTS", "").strip().lower() in ("1", "true", "yes", "on"):
+    from .startup import startup_profiler
+    startup_profiler.install_import_timer()
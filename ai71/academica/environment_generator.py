@@ -62,20 +62,22 @@ class Academica:
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
 
-    def _generate_content(self, system_message: str, user_prompt: str) -> Dict[str, Any]:
+    async def _generate_content(self, system_message: str, user_prompt: str, feature: str) -> Dict[str, Any]:
         try:
-            response = self.ai_api.chat_completion(
+            response = await self.ai_api.chat_completion(
                 messages=[
                     {"role": "system", "content": system_message},
                     {"role": "user", "content": user_prompt}
                 ],
-                model="gpt-4o-mini"
+                model="gpt-4o-mini",
+                feature=feature
             )
             return json.loads(response['choices'][0]['message']['content'])
         except json.JSONDecodeError as e:
@@ -85,7 +87,7 @@ class Academica:
             self.logger.error(f"Unexpected error in content generation: {str(e)}")
             raise
 
-    def generate_environment(self, topic: str, complexity: str) -> Environment:
+    async def generate_environment(self, topic: str, complexity: str) -> Environment:
         system_message = """
         You are an AI expert in creating immersive and engaging educational environments. Your task is to design a rich, interactive learning space that captivates students and facilitates deep understanding of the given topic. Focus on creating a multisensory experience that caters to various learning styles and encourages active participation.
         """
@@ -140,10 +142,10 @@ class Academica:
         Ensure each component is richly detailed and designed to maximize student engagement and learning outcomes.
         """
 
-        environment_data = self._generate_content(system_message, user_prompt)
+        environment_data = await self._generate_content(system_message, user_prompt, feature="academica.environment")
         return Environment(**environment_data)
 
-    def process_student_interaction(self, environment: Environment, interaction: str) -> StudentInteraction:
+    async def process_student_interaction(self, environment: Environment, interaction: str) -> StudentInteraction:
         system_message = """
         You are an AI-powered educational guide, expertly designed to facilitate student learning in interactive environments. Your responses should be encouraging, insightful, and tailored to the student's actions and the learning context. Aim to deepen understanding, promote critical thinking, and maintain high engagement.
         """
@@ -167,10 +169,10 @@ class Academica:
         Ensure your response is tailored to the specific elements and scenarios of the given environment.
         """
 
-        interaction_data = self._generate_content(system_message, user_prompt)
+        interaction_data = await self._generate_content(system_message, user_prompt, feature="academica.interaction")
         return StudentInteraction(**interaction_data)
 
-    def generate_challenge(self, environment: Environment, difficulty: str) -> Challenge:
+    async def generate_challenge(self, environment: Environment, difficulty: str) -> Challenge:
         system_message = """
         You are an AI specialist in crafting educational challenges that push the boundaries of student understanding. Your challenges should be thought-provoking, relevant to the learning environment, and calibrated to the specified difficulty level. Design challenges that require critical thinking, creativity, and application of knowledge.
         """
@@ -193,28 +195,29 @@ class Academica:
         Ensure the challenge is deeply integrated with the environment's theme and components, providing a seamless and immersive learning experience.
         """
 
-        challenge_data = self._generate_content(system_message, user_prompt)
+        challenge_data = await self._generate_content(system_message, user_prompt, feature="academica.challenge")
         return Challenge(**challenge_data)
 
 # Usage example:
-def main():
+async def main():
     academica = Academica()
     
     try:
         # Generate an environment
-        environment = academica.generate_environment("Quantum Computing", "Advanced")
+        environment = await academica.generate_environment("Quantum Computing", "Advanced")
         print("Generated Environment:", json.dumps(environment.dict(), indent=2))
         
         # Process a student interaction
         interaction = "I'm curious about how quantum entanglement affects computation speed."
-        interaction_result = academica.process_student_interaction(environment, interaction)
+        interaction_result = await academica.process_student_interaction(environment, interaction)
         print("Interaction Result:", json.dumps(interaction_result.dict(), indent=2))
         
         # Generate a challenge
-        challenge = academica.generate_challenge(environment, "Expert")
+        challenge = await academica.generate_challenge(environment, "Expert")
         print("Generated Challenge:", json.dumps(challenge.dict(), indent=2))
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
 if __name__ == "__main__":
-    main()
+    import asyncio
+    asyncio.run(main())
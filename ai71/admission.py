@@ -0,0 +1,257 @@
+# ai71/admission.py
+"""
+Admission control for upstream LLM calls.
+
+Every (provider, model) pair gets a limiter that tracks in-flight requests and a sliding one-minute
+window of requests and estimated tokens. Token estimates are the prompt tokens (tiktoken) plus the
+requested `max_tokens`. Requests that cannot start immediately wait in a FIFO queue, so bursts are
+served in arrival order; once the queue is at its bounded depth, or a request has waited too long,
+`AdmissionRejected` is raised and the endpoint answers 503 with Retry-After. The default `max_wait`
+is shorter than every deadline in `resilience.DEFAULT_DEADLINES`, so a request that cannot be admitted
+is rejected here rather than timed out as if the upstream were slow.
+
+A caller can learn whether a request got past admission by running it under `track_admission()`.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from .exceptions import UpstreamUnavailableError
+from .metrics import registry
+from .tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 60.0
+DEFAULT_COMPLETION_TOKENS = 1024
+
+DEFAULT_LIMITS = {
+    "max_concurrency": 16,
+    "rpm": 500,
+    "tpm": 200_000,
+    "max_queue": 100,
+    "max_wait": 15.0,
+}
+
+_queue_depth = registry.gauge("llm_admission_queue_depth", "Requests waiting for admission per provider and model")
+_in_flight = registry.gauge("llm_admission_in_flight", "Admitted upstream requests currently running")
+_wait_seconds = registry.histogram("llm_admission_wait_seconds", "Time requests spent waiting for admission")
+_rejections = registry.counter("llm_admission_rejections_total", "Requests rejected by admission control")
+
+
+class AdmissionRejected(UpstreamUnavailableError):
+    pass
+
+
+class AdmissionTicket:
+    """Set when a request tracked by `track_admission` is admitted and may go upstream."""
+
+    def __init__(self):
+        self.admitted = False
+
+
+_ticket: ContextVar[Optional[AdmissionTicket]] = ContextVar("llm_admission_ticket", default=None)
+
+
+@contextmanager
+def track_admission() -> Iterator[AdmissionTicket]:
+    # Tasks copy the context, so a slot acquired in a child task (e.g. under wait_for) still marks this ticket
+    ticket = AdmissionTicket()
+    token = _ticket.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _ticket.reset(token)
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], model: str, max_tokens: Optional[int] = None) -> int:
+    return count_message_tokens(messages, model) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class RateLimiter:
+    """Concurrency, requests-per-minute and tokens-per-minute limiter for one provider and model."""
+
+    def __init__(self, provider: str, model: str, max_concurrency: int, rpm: int, tpm: int, max_queue: int, max_wait: float):
+        self.provider = provider
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._waiters: Deque[Tuple["asyncio.Future[None]", int]] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return {"provider": self.provider, "model": self.model}
+
+    async def acquire(self, tokens: int) -> float:
+        # A single request larger than the whole budget could otherwise never be admitted
+        tokens = min(tokens, self.tpm)
+        if not self._waiters and self._can_admit(tokens):
+            self._admit(tokens)
+            _wait_seconds.observe(0.0, **self.labels)
+            return 0.0
+
+        if len(self._waiters) >= self.max_queue:
+            _rejections.inc(reason="queue_full", **self.labels)
+            raise AdmissionRejected(f"{self.provider}/{self.model} admission queue is full", retry_after=self.retry_after(tokens))
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, tokens))
+        _queue_depth.set(len(self._waiters), **self.labels)
+        self._schedule_pump()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                self.release()
+            self._discard(future)
+            _rejections.inc(reason="wait_timeout", **self.labels)
+            raise AdmissionRejected(f"Timed out waiting for {self.provider}/{self.model} admission", retry_after=self.retry_after(tokens))
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            self._discard(future)
+            raise
+        waited = time.monotonic() - started
+        _wait_seconds.observe(waited, **self.labels)
+        return waited
+
+    def release(self):
+        self.in_flight -= 1
+        _in_flight.set(self.in_flight, **self.labels)
+        self._pump()
+
+    def retry_after(self, tokens: int = 0) -> float:
+        """Seconds until the window has room for one more request of `tokens` tokens."""
+        now = time.monotonic()
+        self._prune(now)
+        requests, window_tokens = len(self._window), self._window_tokens
+        wait = 0.0
+        # Walk the window oldest first until enough entries have expired
+        for admitted_at, admitted_tokens in self._window:
+            if requests < self.rpm and window_tokens + tokens <= self.tpm:
+                break
+            requests -= 1
+            window_tokens -= admitted_tokens
+            wait = admitted_at + WINDOW_SECONDS - now
+        return max(1.0, math.ceil(wait))
+
+    def _can_admit(self, tokens: int) -> bool:
+        self._prune(time.monotonic())
+        return (self.in_flight < self.max_concurrency
+                and len(self._window) < self.rpm
+                and self._window_tokens + tokens <= self.tpm)
+
+    def _admit(self, tokens: int):
+        self.in_flight += 1
+        self._window.append((time.monotonic(), tokens))
+        self._window_tokens += tokens
+        _in_flight.set(self.in_flight, **self.labels)
+
+    def _prune(self, now: float):
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _discard(self, future: "asyncio.Future[None]"):
+        self._waiters = deque(entry for entry in self._waiters if entry[0] is not future)
+        _queue_depth.set(len(self._waiters), **self.labels)
+        self._pump()
+
+    def _pump(self):
+        self._timer = None
+        while self._waiters:
+            future, tokens = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._can_admit(tokens):
+                break
+            self._waiters.popleft()
+            self._admit(tokens)
+            future.set_result(None)
+        _queue_depth.set(len(self._waiters), **self.labels)
+        self._schedule_pump()
+
+    def _schedule_pump(self):
+        # Concurrency slots free up through release(); window capacity frees up with time
+        if not self._waiters or self._timer is not None or not self._window:
+            return
+        if self.in_flight >= self.max_concurrency:
+            return
+        delay = max(self._window[0][0] + WINDOW_SECONDS - time.monotonic(), 0.01)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune(time.monotonic())
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "requests_last_minute": len(self._window),
+            "tokens_last_minute": self._window_tokens,
+            "max_concurrency": self.max_concurrency,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+        }
+
+
+class AdmissionController:
+    """
+    Hands out per-provider, per-model limiters.
+
+    Limits come from DEFAULT_LIMITS, overridden by the LLM_LIMITS environment variable: a JSON object
+    whose keys are either a provider ("openai") or a provider and model ("ai71/falcon-180b"), e.g.
+    `{"openai": {"rpm": 500, "tpm": 200000}, "ai71/falcon-180b": {"max_concurrency": 4}}`.
+    """
+    def __init__(self, overrides: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.overrides = overrides or {}
+        self._limiters: Dict[Tuple[str, str], RateLimiter] = {}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        raw = os.getenv("LLM_LIMITS")
+        overrides = json.loads(raw) if raw else {}
+        return cls(overrides)
+
+    def limiter(self, provider: str, model: str) -> RateLimiter:
+        key = (provider, model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limits = {**DEFAULT_LIMITS, **self.overrides.get(provider, {}), **self.overrides.get(f"{provider}/{model}", {})}
+            limiter = RateLimiter(provider, model, **limits)
+            self._limiters[key] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str, tokens: int = 0):
+        limiter = self.limiter(provider, model)
+        await limiter.acquire(tokens)
+        ticket = _ticket.get()
+        if ticket is not None:
+            ticket.admitted = True
+        try:
+            yield limiter
+        finally:
+            limiter.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {f"{provider}/{model}": limiter.stats() for (provider, model), limiter in self._limiters.items()}
+
+
+admission_controller = AdmissionController.from_env()
+registry.gauge("llm_admission", "Admission limiter state per provider and model", callback=admission_controller.stats)
@@ -3,42 +3,105 @@ import aiohttp
 import asyncio
 import logging
 import json
-from typing import List, Dict, Any, Optional, Union
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import HumanMessage, SystemMessage, AIMessage
-from openai import OpenAI
-from datetime import datetime
+from contextlib import AsyncExitStack, aclosing
+from typing import Awaitable, List, Dict, Any, Optional
+from openai import AsyncOpenAI
+from .http_pool import HTTPSessionPool, http_pool
+from .transcript import transcript_writer
+from .conversation_memory import ConversationMemoryStore, conversation_memory
+from .llm_cache import LLMResponseCache, llm_cache
+from .single_flight import SingleFlight
+from .sse import SSEParser
+from .admission import AdmissionController, admission_controller, estimate_tokens
+from .resilience import Resilience
+from .usage import usage_tracker
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Add a new constant for development mode
-DEV_MODE = True  # Set this to False when deploying
-
 def log_conversation(api_name: str, action: str, data: Any):
-    if DEV_MODE:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"{timestamp} - {api_name} - {action}:\n{json.dumps(data, indent=2)}\n\n"
-        with open("conversation.log", "a") as log_file:
-            log_file.write(log_entry)
+    # Only enqueues the record; the transcript file is written by a background thread.
+    # Enable with DEV_MODE=true, see ai71/transcript.py for the remaining settings.
+    transcript_writer.record(api_name, action, data)
+
+
+class ConversationMemoryMixin:
+    """Conversation memory methods shared by the LLM clients; they set `self.memory`."""
+
+    memory: ConversationMemoryStore
 
+    async def _update_memory(self, student_id: str, character: str, messages: List[Dict[str, str]], response: str):
+        # Only a leading system message is the persona; any other message is context the memory already holds,
+        # and only the newest user message is a new turn
+        if messages and messages[0]['role'] == 'system':
+            await self.memory.set_system(student_id, character, messages[0]['content'])
+        new_turns = [message for message in messages[-1:] if message['role'] == 'user']
+        await self.memory.add_turns(student_id, character, [*new_turns, {"role": "assistant", "content": response}])
+
+    async def get_conversation_history(self, student_id: str, character: str = "ai-tutor") -> List[Dict[str, str]]:
+        return await self.memory.get_messages(student_id, character)
+
+    async def clear_memory(self, student_id: Optional[str] = None, character: Optional[str] = None):
+        await self.memory.clear(student_id, character)
+
+    async def memory_messages(self, student_id: Optional[str], character: str, system_prompt: Optional[str] = None,
+                              alongside: Optional[Awaitable[Any]] = None) -> List[Dict[str, str]]:
+        """
+        The stored context of a conversation, to pass as `messages` to the `*_with_memory` methods.
+        `alongside` (e.g. provisioning the student) runs concurrently with reading the memory; the
+        system prompt is only stored once it succeeded, so when it raises memory is left untouched.
+        """
+        read = self.memory.get_messages(student_id, character) if student_id is not None else asyncio.sleep(0, [])
+        if alongside is not None:
+            messages, _ = await asyncio.gather(read, alongside)
+        else:
+            messages = await read
+        if system_prompt is None:
+            return messages
+        if student_id is not None:
+            await self.memory.set_system(student_id, character, system_prompt)
+        # The stored persona, if any, always comes first
+        turns = messages[1:] if messages and messages[0]['role'] == 'system' else messages
+        return [{"role": "system", "content": system_prompt}, *turns]
 
-class AI71API:
+    async def _memory_context(self, user_input: str, messages: Optional[List[Dict[str, str]]], student_id: Optional[str], character: str, system_prompt: Optional[str]) -> List[Dict[str, str]]:
+        if messages is None:
+            messages = await self.memory_messages(student_id, character, system_prompt)
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    async def add_system_message(self, student_id: str, character: str, content: str):
+        await self.memory.set_system(student_id, character, content)
+
+    async def add_user_message(self, student_id: str, character: str, content: str):
+        await self.memory.add_turns(student_id, character, [{"role": "user", "content": content}])
+
+    async def add_ai_message(self, student_id: str, character: str, content: str):
+        await self.memory.add_turns(student_id, character, [{"role": "assistant", "content": content}])
+
+
+class AI71API(ConversationMemoryMixin):
     """
     AI71API is a class that provides an interface to interact with the AI71 API.
 
     Args:
         api_key (Optional[str]): The API key to authenticate the requests. If not provided, it will be fetched from the environment variable 'AI71_API_KEY'.
         base_url (str): The base URL of the AI71 API. Defaults to "https://api.ai71.ai/v1".
+        pool (Optional[HTTPSessionPool]): The shared HTTP session pool. Defaults to the worker-wide pool.
+        memory (Optional[ConversationMemoryStore]): Per-student conversation memory. Defaults to the process-wide store.
+        cache (Optional[LLMResponseCache]): Response cache for chat completions. Defaults to the process-wide cache.
+        admission (Optional[AdmissionController]): Per-model concurrency and rate limits. Defaults to the process-wide controller.
+        resilience (Optional[Resilience]): Retry, deadline and circuit breaker settings. Defaults to `Resilience.from_env("ai71")`.
 
     Attributes:
         api_key (str): The API key used for authentication.
         base_url (str): The base URL of the AI71 API.
         headers (dict): The headers to be included in the API requests.
-        memory (ConversationBufferMemory): The memory object to store conversation history.
+        pool (HTTPSessionPool): The pooled HTTP session used for all requests.
+        memory (ConversationMemoryStore): Token-budgeted conversation memory keyed by student and character.
 
     """
-    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://api.ai71.ai/v1"):
+    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://api.ai71.ai/v1", pool: Optional[HTTPSessionPool] = None, memory: Optional[ConversationMemoryStore] = None, cache: Optional[LLMResponseCache] = None, admission: Optional[AdmissionController] = None, resilience: Optional[Resilience] = None):
         self.api_key = api_key or os.getenv('AI71_API_KEY')
         if not self.api_key:
             raise ValueError("AI71_API_KEY not found. Please set it as an environment variable.")
@@ -48,182 +111,273 @@ class AI71API:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        self.memory = ConversationBufferMemory(return_messages=True)
+        self.pool = pool or http_pool
+        self.memory = memory or conversation_memory
+        self.cache = cache or llm_cache
+        self.admission = admission or admission_controller
+        self.resilience = resilience or Resilience.from_env("ai71")
+        self.usage = usage_tracker
+        self.in_flight = SingleFlight.from_env("ai71")
+
+    def _slot(self, payload: Dict[str, Any]):
+        model = payload["model"]
+        return self.admission.slot("ai71", model, estimate_tokens(payload.get("messages", []), model, payload.get("max_tokens")))
 
-    async def _make_request(self, endpoint: str, payload: Dict[str, Any], stream: bool = False, max_retries: int = 3) -> Union[Dict[str, Any], aiohttp.ClientResponse]:
+    async def _make_request(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         url = f"{self.base_url}/{endpoint}"
         log_conversation("AI71API", f"Request to {endpoint}", payload)
-        for attempt in range(max_retries):
-            try:
-                async with aiohttp.ClientSession(headers=self.headers) as session:
-                    async with session.post(url, json=payload) as response:
-                        response.raise_for_status()
-                        if stream:
-                            return response
-                        else:
-                            json_response = await response.json()
-                            log_conversation("AI71API", f"Response from {endpoint}", json_response)
-                            return json_response
-            except aiohttp.ClientError as e:
-                logger.error(f"Attempt {attempt + 1} failed: Error making request to {endpoint}: {str(e)}")
-                if attempt == max_retries - 1:
-                    raise
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-
-    async def chat_completion(self, messages: List[Dict[str, str]], model: str = "falcon-11b", **kwargs) -> Dict[str, Any]:
-        payload = {
-            "model": model,
-            "messages": messages,
-            **kwargs
-        }
-        response = await self._make_request("chat/completions", payload)
-        await self._update_memory(messages, response['choices'][0]['message']['content'])
+        json_response = await self.resilience.call(endpoint, lambda: self._attempt_request(url, payload))
+        log_conversation("AI71API", f"Response from {endpoint}", json_response)
+        return json_response
+
+    async def _attempt_request(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        async with self._slot(payload), self.pool.request("POST", url, json=payload, headers=self.headers) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _stream_request(self, endpoint: str, payload: Dict[str, Any]):
+        """Yields raw body chunks of a streamed response while keeping the pooled connection open."""
+        url = f"{self.base_url}/{endpoint}"
+        log_conversation("AI71API", f"Stream request to {endpoint}", payload)
+        # Only opening the stream is retried; once bytes were handed to the caller it cannot be replayed
+        stack, response = await self.resilience.call(endpoint, lambda: self._open_stream(url, payload), deadline_key=f"{endpoint}:stream")
+        async with stack:
+            async for data in response.content.iter_any():
+                yield data
+
+    async def _open_stream(self, url: str, payload: Dict[str, Any]):
+        stack = AsyncExitStack()
+        try:
+            # The admission slot is held until the stream is fully consumed
+            await stack.enter_async_context(self._slot(payload))
+            response = await stack.enter_async_context(self.pool.request("POST", url, json=payload, headers=self.headers))
+            response.raise_for_status()
+        except BaseException:
+            await stack.aclose()
+            raise
+        return stack, response
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str = "falcon-11b", student_id: Optional[str] = None, character: str = "ai-tutor", cache: bool = True, feature: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        key = self.cache.make_key("ai71", model, messages, kwargs)
+        response = await self.cache.get(key, provider="ai71") if cache else None
+        if response is None:
+            payload = {
+                "model": model,
+                "messages": messages,
+                **kwargs
+            }
+            # Identical concurrent requests share one upstream call
+            response = await self.in_flight.do(key, lambda: self._fetch_completion(key, payload, cache, feature))
+        if student_id is not None:
+            await self._update_memory(student_id, character, messages, response['choices'][0]['message']['content'])
         return response
 
-    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str = "falcon-11b", **kwargs):
+    async def _fetch_completion(self, key: str, payload: Dict[str, Any], cache: bool, feature: Optional[str]) -> Dict[str, Any]:
+        record = self.usage.begin("ai71", payload["model"], payload["messages"], feature)
+        try:
+            response = await self._make_request("chat/completions", payload)
+        except Exception:
+            record.fail()
+            raise
+        record.finish(response.get("usage"), response['choices'][0]['message']['content'])
+        if cache:
+            await self.cache.set(key, response, provider="ai71")
+        return response
+
+    async def _stream_events(self, endpoint: str, payload: Dict[str, Any]):
+        # Network reads do not line up with SSE frames, so parse incrementally
+        parser = SSEParser()
+        async for data in self._stream_request(endpoint, payload):
+            for event in parser.feed(data):
+                yield event
+        for event in parser.close():
+            yield event
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str = "falcon-11b", student_id: Optional[str] = None, character: str = "ai-tutor", feature: Optional[str] = None, **kwargs):
         payload = {
             "model": model,
             "messages": messages,
             "stream": True,
             **kwargs
         }
-        response = await self._make_request("chat/completions", payload, stream=True)
         full_response = ""
-        async for line in response.content:
-            if line:
-                chunk = json.loads(line.decode('utf-8').split('data: ')[1])
-                full_response += chunk['choices'][0]['delta'].get('content', '')
-                yield chunk
+        usage = None
+        record = self.usage.begin("ai71", model, messages, feature)
+        try:
+            # aclosing() releases the pooled connection as soon as [DONE] arrives
+            async with aclosing(self._stream_events("chat/completions", payload)) as events:
+                async for event in events:
+                    if event.data.strip() == '[DONE]':
+                        break
+                    chunk = json.loads(event.data)
+                    usage = chunk.get('usage') or usage
+                    if chunk.get('choices'):
+                        full_response += chunk['choices'][0]['delta'].get('content') or ''
+                    yield chunk
+        except Exception:
+            record.fail()
+            raise
+        record.finish(usage, full_response)
         log_conversation("AI71API", "Stream Chat Completion Full Response", full_response)
-        await self._update_memory(messages, full_response)
-
-    async def _update_memory(self, messages: List[Dict[str, str]], response: str):
-        for message in messages:
-            if message['role'] == 'user':
-                self.memory.chat_memory.add_user_message(message['content'])
-            elif message['role'] == 'system':
-                self.memory.chat_memory.add_message(SystemMessage(content=message['content']))
-        self.memory.chat_memory.add_ai_message(response)
+        if student_id is not None:
+            await self._update_memory(student_id, character, messages, full_response)
 
-    def get_conversation_history(self) -> List[Union[HumanMessage, AIMessage, SystemMessage]]:
-        return self.memory.chat_memory.messages
-
-    async def clear_memory(self):
-        self.memory.clear()
-
-    async def generate_with_memory(self, user_input: str, model: str = "falcon-180b", messages: List[Dict[str, str]] = None, **kwargs) -> str:
-        if messages is None:
-            messages = self.get_conversation_history()
-            messages.append(HumanMessage(content=user_input))
-            messages = [{"role": m.type, "content": m.content} for m in messages]
-        else:
-            messages.append({"role": "user", "content": user_input})
-        
-        response = await self.chat_completion(messages, model=model, **kwargs)
+    async def generate_with_memory(self, user_input: str, model: str = "falcon-180b", messages: List[Dict[str, str]] = None, student_id: Optional[str] = None, character: str = "ai-tutor", system_prompt: Optional[str] = None, **kwargs) -> str:
+        messages = await self._memory_context(user_input, messages, student_id, character, system_prompt)
+        response = await self.chat_completion(messages, model=model, student_id=student_id, character=character, **kwargs)
         return response['choices'][0]['message']['content']
 
-    def add_system_message(self, content: str):
-        self.memory.chat_memory.add_message(SystemMessage(content=content))
+    async def stream_with_memory(self, user_input: str, model: str = "falcon-180b", messages: List[Dict[str, str]] = None, student_id: Optional[str] = None, character: str = "ai-tutor", system_prompt: Optional[str] = None, **kwargs):
+        messages = await self._memory_context(user_input, messages, student_id, character, system_prompt)
+        async for chunk in self.stream_chat_completion(messages, model=model, student_id=student_id, character=character, **kwargs):
+            yield chunk
 
-    def add_user_message(self, content: str):
-        self.memory.chat_memory.add_user_message(content)
+class OpenAIAPI(ConversationMemoryMixin):
+    """
+    A class that provides an asynchronous interface to interact with the OpenAI API.
 
-    def add_ai_message(self, content: str):
-        self.memory.chat_memory.add_ai_message(content)
+    All calls go through `AsyncOpenAI`, so chat completions, streams and image generation await
+    the network instead of blocking the event loop.
 
-class OpenAIAPI:
-    """
-    A class that provides an interface to interact with the OpenAI API.
+    Args:
+        api_key (Optional[str]): The API key to authenticate the requests. If not provided, it will be fetched from the environment variable 'OPENAI_API_KEY'.
+        memory (Optional[ConversationMemoryStore]): Per-student conversation memory. Defaults to the process-wide store.
+        cache (Optional[LLMResponseCache]): Response cache for chat completions. Defaults to the process-wide cache.
+        admission (Optional[AdmissionController]): Per-model concurrency and rate limits. Defaults to the process-wide controller.
+        resilience (Optional[Resilience]): Retry, deadline and circuit breaker settings. Defaults to `Resilience.from_env("openai")`.
+
+    Attributes:
+        client (AsyncOpenAI): The underlying asynchronous OpenAI client.
+        memory (ConversationMemoryStore): Token-budgeted conversation memory keyed by student and character.
     """
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, memory: Optional[ConversationMemoryStore] = None, cache: Optional[LLMResponseCache] = None, admission: Optional[AdmissionController] = None, resilience: Optional[Resilience] = None):
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found. Please set it as an environment variable or provide it when initializing the class.")
         
-        self.client = OpenAI(api_key=self.api_key)
-        self.memory = ConversationBufferMemory(return_messages=True)
+        # Retries are handled by self.resilience so they share backoff, deadlines and the circuit breaker
+        self.client = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        self.memory = memory or conversation_memory
+        self.cache = cache or llm_cache
+        self.admission = admission or admission_controller
+        self.resilience = resilience or Resilience.from_env("openai")
+        self.usage = usage_tracker
+        self.in_flight = SingleFlight.from_env("openai")
 
-    # Rest of the class methods...
-class OpenAIAPI:
-    def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-        if not self.api_key:
-            raise ValueError("OPENAI_API_KEY not found. Please set it as an environment variable or provide it when initializing the class.")
-        
-        self.client = OpenAI(api_key=self.api_key)
-        self.memory = ConversationBufferMemory(return_messages=True)
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str = "gpt-4o-mini", student_id: Optional[str] = None, character: str = "ai-tutor", cache: bool = True, feature: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        key = self.cache.make_key("openai", model, messages, kwargs)
+        response = await self.cache.get(key, provider="openai") if cache else None
+        if response is None:
+            # Identical concurrent requests share one upstream call
+            response = await self.in_flight.do(key, lambda: self._fetch_completion(key, messages, model, cache, kwargs, feature))
+        if student_id is not None:
+            await self._update_memory(student_id, character, messages, response['choices'][0]['message']['content'])
+        return response
+
+    async def _fetch_completion(self, key: str, messages: List[Dict[str, str]], model: str, cache: bool, params: Dict[str, Any], feature: Optional[str]) -> Dict[str, Any]:
+        record = self.usage.begin("openai", model, messages, feature)
+        try:
+            response = await self._create_chat_completion(messages, model, **params)
+        except Exception:
+            record.fail()
+            raise
+        record.finish(response.get("usage"), response['choices'][0]['message']['content'])
+        if cache:
+            await self.cache.set(key, response, provider="openai")
+        return response
 
-    def chat_completion(self, messages: List[Dict[str, str]], model: str = "gpt-4o-mini", **kwargs) -> Dict[str, Any]:
+    async def _create_chat_completion(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Dict[str, Any]:
         log_conversation("OpenAIAPI", "Chat Completion Request", {"messages": messages, "model": model, **kwargs})
-        response = self.client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **kwargs
-        )
+        response = await self.resilience.call("chat/completions", lambda: self._attempt_chat_completion(messages, model, kwargs))
+        # Return a plain dict so callers can index responses the same way as AI71API responses
+        response = response.model_dump()
         log_conversation("OpenAIAPI", "Chat Completion Response", response)
-        self._update_memory(messages, response.choices[0].message.content)
         return response
 
-    def stream_chat_completion(self, messages: List[Dict[str, str]], model: str = "gpt-4o-mini", **kwargs):
+    async def _attempt_chat_completion(self, messages: List[Dict[str, str]], model: str, params: Dict[str, Any]):
+        async with self.admission.slot("openai", model, estimate_tokens(messages, model, params.get("max_tokens"))):
+            return await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **params
+            )
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str = "gpt-4o-mini", student_id: Optional[str] = None, character: str = "ai-tutor", feature: Optional[str] = None, **kwargs):
         log_conversation("OpenAIAPI", "Stream Chat Completion Request", {"messages": messages, "model": model, **kwargs})
-        stream = self.client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True,
-            **kwargs
-        )
+        # The final chunk then carries the usage; it has no choices and is not passed on
+        kwargs.setdefault("stream_options", {"include_usage": True})
         full_response = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                full_response += content
-                yield chunk
+        usage = None
+        record = self.usage.begin("openai", model, messages, feature)
+        try:
+            # Only opening the stream is retried; once chunks were handed to the caller it cannot be replayed
+            stack, stream = await self.resilience.call("chat/completions", lambda: self._open_stream(messages, model, kwargs), deadline_key="chat/completions:stream")
+            async with stack:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage.model_dump()
+                    if chunk.choices and chunk.choices[0].delta.content is not None:
+                        content = chunk.choices[0].delta.content
+                        full_response += content
+                        yield chunk
+        except Exception:
+            record.fail()
+            raise
+        record.finish(usage, full_response)
         log_conversation("OpenAIAPI", "Stream Chat Completion Full Response", full_response)
-        self._update_memory(messages, full_response)
+        if student_id is not None:
+            await self._update_memory(student_id, character, messages, full_response)
+
+    async def _open_stream(self, messages: List[Dict[str, str]], model: str, params: Dict[str, Any]):
+        stack = AsyncExitStack()
+        try:
+            # The admission slot is held until the stream is fully consumed
+            await stack.enter_async_context(self.admission.slot("openai", model, estimate_tokens(messages, model, params.get("max_tokens"))))
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **params
+            )
+            stack.push_async_callback(stream.close)
+        except BaseException:
+            await stack.aclose()
+            raise
+        return stack, stream
 
-    def create_image(self, prompt: str, model: str = "dall-e-3", size: str = "1024x1024", quality: str = "standard", n: int = 1) -> Dict[str, Any]:
+    async def create_image(self, prompt: str, model: str = "dall-e-3", size: str = "1024x1024", quality: str = "standard", n: int = 1) -> Dict[str, Any]:
+        key = self.cache.make_key("openai-images", model, [{"role": "user", "content": prompt}], {"size": size, "quality": quality, "n": n})
+        return await self.in_flight.do(key, lambda: self._create_image(prompt, model, size, quality, n))
+
+    async def _create_image(self, prompt: str, model: str, size: str, quality: str, n: int) -> Dict[str, Any]:
         log_conversation("OpenAIAPI", "Create Image Request", {"prompt": prompt, "model": model, "size": size, "quality": quality, "n": n})
-        response = self.client.images.generate(
-            model=model,
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            n=n
-        )
+        response = await self.resilience.call("images/generations", lambda: self._attempt_image(prompt, model, size, quality, n))
+        response = response.model_dump()
         log_conversation("OpenAIAPI", "Create Image Response", response)
         return response
 
-    def _update_memory(self, messages: List[Dict[str, str]], response: str):
-        for message in messages:
-            if message['role'] == 'user':
-                self.memory.chat_memory.add_user_message(message['content'])
-            elif message['role'] == 'system':
-                self.memory.chat_memory.add_message(SystemMessage(content=message['content']))
-        self.memory.chat_memory.add_ai_message(response)
-
-    def get_conversation_history(self) -> List[Union[HumanMessage, AIMessage, SystemMessage]]:
-        return self.memory.chat_memory.messages
+    async def _attempt_image(self, prompt: str, model: str, size: str, quality: str, n: int):
+        # Image requests only count against concurrency and requests per minute
+        async with self.admission.slot("openai", model):
+            return await self.client.images.generate(
+                model=model,
+                prompt=prompt,
+                size=size,
+                quality=quality,
+                n=n
+            )
 
-    def clear_memory(self):
-        self.memory.clear()
+    async def close(self):
+        await self.client.close()
 
-    def generate_with_memory(self, user_input: str, model: str = "gpt-4o-mini", messages: List[Dict[str, str]] = None, **kwargs) -> str:
-        if messages is None:
-            messages = self.get_conversation_history()
-            messages.append(HumanMessage(content=user_input))
-            messages = [{"role": m.type, "content": m.content} for m in messages]
-        else:
-            messages.append({"role": "user", "content": user_input})
-        
-        response = self.chat_completion(messages, model=model, **kwargs)
-        return response.choices[0].message.content
-
-    def add_system_message(self, content: str):
-        self.memory.chat_memory.add_message(SystemMessage(content=content))
+    async def generate_with_memory(self, user_input: str, model: str = "gpt-4o-mini", messages: List[Dict[str, str]] = None, student_id: Optional[str] = None, character: str = "ai-tutor", system_prompt: Optional[str] = None, **kwargs) -> str:
+        messages = await self._memory_context(user_input, messages, student_id, character, system_prompt)
+        response = await self.chat_completion(messages, model=model, student_id=student_id, character=character, **kwargs)
+        return response['choices'][0]['message']['content']
 
-    def add_user_message(self, content: str):
-        self.memory.chat_memory.add_user_message(content)
+    async def stream_with_memory(self, user_input: str, model: str = "gpt-4o-mini", messages: List[Dict[str, str]] = None, student_id: Optional[str] = None, character: str = "ai-tutor", system_prompt: Optional[str] = None, **kwargs):
+        messages = await self._memory_context(user_input, messages, student_id, character, system_prompt)
+        async for chunk in self.stream_chat_completion(messages, model=model, student_id=student_id, character=character, **kwargs):
+            yield chunk
 
-    def add_ai_message(self, content: str):
-        self.memory.chat_memory.add_ai_message(content)
\ No newline at end of file
@@ -0,0 +1,241 @@
+# ai71/bulk_ingest.py
+"""
+Bulk ingestion of users, profiles, engagements and achievements.
+
+Nightly LMS syncs push tens of thousands of rows. Instead of one request, insert and commit per row,
+items are validated one by one, then written in chunks: each chunk is one multi-row
+`INSERT ... ON CONFLICT` statement (batched by SQLAlchemy's insertmanyvalues) and one commit. Keyed
+entities are upserts, so re-running an import is safe; engagements are events and are appended.
+
+If a chunk violates a constraint (an unknown user, a username taken by another id), it is retried
+row by row so only the offending items fail. Every item gets a result with its position in the
+input, its status (created, updated, exists, duplicate, invalid or failed) and its row id or error.
+Input is a JSON array or NDJSON. NDJSON is parsed line by line as it arrives, so the raw body is never
+held whole; a JSON array is parsed in one piece. Rows are held one chunk at a time, but the response
+lists a result per item, so memory still grows with the number of items: split very large imports
+into several requests.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from fastapi import Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import User, UserAchievement, UserEngagement, UserProfile, dialect_insert
+from .metrics import registry
+from .models import User as UserModel, UserAchievementBulkItem, UserEngagementBulkItem, UserProfileBulkItem
+
+logger = logging.getLogger(__name__)
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+_items = registry.counter("bulk_ingest_items_total", "Bulk ingested items by entity and status")
+_chunk_seconds = registry.histogram("bulk_ingest_chunk_seconds", "Duration of writing one bulk ingest chunk")
+
+
+class BulkEntity:
+    """
+    Args:
+        model: The ORM model written to.
+        item_model (Type[BaseModel]): Validates one input item.
+        key (Sequence[str]): Columns of the unique constraint upserts conflict on; empty to always insert.
+        update (Sequence[str]): Columns overwritten when the key exists; empty to keep existing rows as they are.
+        defaults (Dict[str, Callable]): Values of columns an item leaves empty.
+    """
+    def __init__(self, model, item_model: Type[BaseModel], key: Sequence[str] = (), update: Sequence[str] = (),
+                 defaults: Optional[Dict[str, Callable[[], Any]]] = None):
+        self.table = model.__table__
+        self.item_model = item_model
+        self.key = tuple(key)
+        self.update = tuple(update)
+        self.defaults = defaults or {}
+
+    def row(self, item: BaseModel) -> Dict[str, Any]:
+        row = item.model_dump()
+        for column, default in self.defaults.items():
+            if row.get(column) is None:
+                row[column] = default()
+        return row
+
+    def key_of(self, row: Dict[str, Any]) -> Tuple:
+        return tuple(row[column] for column in self.key)
+
+    def statement(self, dialect: str):
+        stmt = dialect_insert(self.table, dialect)
+        if self.key and self.update:
+            stmt = stmt.on_conflict_do_update(index_elements=self.key, set_={column: stmt.excluded[column] for column in self.update})
+        elif self.key:
+            stmt = stmt.on_conflict_do_nothing(index_elements=self.key)
+        if self.key:
+            return stmt.returning(self.table.c.id, *(self.table.c[column] for column in self.key))
+        return stmt.returning(self.table.c.id, sort_by_parameter_order=True)
+
+
+ENTITIES: Dict[str, BulkEntity] = {
+    "users": BulkEntity(User, UserModel, key=("id",), update=("username", "email"), defaults={"created_at": datetime.utcnow}),
+    "user-profiles": BulkEntity(UserProfile, UserProfileBulkItem, key=("user_id",), update=("skills", "learning_style", "interests")),
+    "user-engagements": BulkEntity(UserEngagement, UserEngagementBulkItem, defaults={"timestamp": datetime.utcnow}),
+    # An achievement is unlocked once; re-imports keep the original unlock time
+    "user-achievements": BulkEntity(UserAchievement, UserAchievementBulkItem, key=("user_id", "achievement_id"),
+                                    defaults={"unlocked_at": datetime.utcnow}),
+}
+
+
+async def read_items(request: Request) -> AsyncIterator[Any]:
+    """
+    Yields the items of a JSON array or NDJSON body. A malformed NDJSON line is yielded as the
+    ValueError it raised; a body that is not a JSON array raises ValueError.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_TYPES:
+        buffer = b""
+        async for data in request.stream():
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+    try:
+        items = await request.json()
+    except ValueError:
+        raise ValueError("Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    for item in items:
+        yield item
+
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Malformed JSON line: {e}")
+
+
+class BulkIngester:
+    """
+    Args:
+        chunk_size (int): Items written per statement and transaction.
+    """
+    def __init__(self, chunk_size: int = 1000):
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_env(cls) -> "BulkIngester":
+        return cls(chunk_size=int(os.getenv("BULK_INGEST_CHUNK_SIZE", "1000")))
+
+    async def ingest(self, entity_name: str, items: AsyncIterator[Any], db: AsyncSession) -> Dict[str, Any]:
+        entity = ENTITIES[entity_name]
+        results: List[Dict[str, Any]] = []
+        chunk: List[Tuple[int, Dict[str, Any]]] = []
+        index = 0
+        async for raw in items:
+            row, error = self._validate(entity, raw)
+            if error is not None:
+                results.append({"index": index, "status": "invalid", "error": error})
+            else:
+                chunk.append((index, row))
+            index += 1
+            if len(chunk) >= self.chunk_size:
+                results.extend(await self._write(entity_name, entity, chunk, db))
+                chunk = []
+        if chunk:
+            results.extend(await self._write(entity_name, entity, chunk, db))
+        results.sort(key=lambda result: result["index"])
+        counts = Counter(result["status"] for result in results)
+        for status, count in counts.items():
+            _items.inc(count, entity=entity_name, status=status)
+        return {"entity": entity_name, "received": index, **counts, "results": results}
+
+    @staticmethod
+    def _validate(entity: BulkEntity, raw: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        if isinstance(raw, ValueError):
+            return None, str(raw)
+        try:
+            return entity.row(entity.item_model.model_validate(raw)), None
+        except ValidationError as e:
+            return None, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+    async def _write(self, entity_name: str, entity: BulkEntity, chunk: List[Tuple[int, Dict[str, Any]]],
+                     db: AsyncSession) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        results: List[Dict[str, Any]] = []
+        if entity.key:
+            # Within one statement a key may only be written once; the last occurrence wins
+            last = {entity.key_of(row): index for index, row in chunk}
+            for index, row in chunk:
+                if last[entity.key_of(row)] != index:
+                    results.append({"index": index, "status": "duplicate", "error": f"Superseded by item {last[entity.key_of(row)]}"})
+            chunk = [(index, row) for index, row in chunk if last[entity.key_of(row)] == index]
+        existing = await self._existing(entity, [row for _, row in chunk], db)
+        stmt = entity.statement(db.bind.dialect.name)
+        try:
+            result = await db.execute(stmt, [row for _, row in chunk])
+            returned = result.all()
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            logger.warning(f"Bulk insert of {len(chunk)} {entity_name} failed ({e.orig}); retrying them one by one")
+            results.extend(await self._write_each(entity, stmt, chunk, existing, db))
+        else:
+            results.extend(self._classify(entity, chunk, returned, existing))
+        _chunk_seconds.observe(time.perf_counter() - started, entity=entity_name)
+        return results
+
+    async def _write_each(self, entity: BulkEntity, stmt, chunk: List[Tuple[int, Dict[str, Any]]],
+                          existing: Dict[Tuple, Any], db: AsyncSession) -> List[Dict[str, Any]]:
+        results = []
+        for index, row in chunk:
+            try:
+                returned = (await db.execute(stmt, [row])).all()
+                await db.commit()
+            except IntegrityError as e:
+                await db.rollback()
+                results.append({"index": index, "status": "failed", "error": str(e.orig)})
+                continue
+            results.extend(self._classify(entity, [(index, row)], returned, existing))
+        return results
+
+    @staticmethod
+    async def _existing(entity: BulkEntity, rows: List[Dict[str, Any]], db: AsyncSession) -> Dict[Tuple, Any]:
+        """Ids of the rows whose keys already exist, which tells created from updated items."""
+        if not entity.key or not rows:
+            return {}
+        columns = [entity.table.c[column] for column in entity.key]
+        keys = [entity.key_of(row) for row in rows]
+        condition = columns[0].in_([key[0] for key in keys]) if len(columns) == 1 else tuple_(*columns).in_(keys)
+        result = await db.execute(select(entity.table.c.id, *columns).where(condition))
+        return {tuple(found[1:]): found[0] for found in result}
+
+    @staticmethod
+    def _classify(entity: BulkEntity, chunk: List[Tuple[int, Dict[str, Any]]], returned: List[Any],
+                  existing: Dict[Tuple, Any]) -> List[Dict[str, Any]]:
+        if not entity.key:
+            return [{"index": index, "status": "created", "id": found[0]} for (index, _), found in zip(chunk, returned)]
+        ids = {tuple(found[1:]): found[0] for found in returned}
+        results = []
+        for index, row in chunk:
+            key = entity.key_of(row)
+            if key in existing:
+                status = "updated" if entity.update else "exists"
+                results.append({"index": index, "status": status, "id": existing[key]})
+            elif key in ids:
+                results.append({"index": index, "status": "created", "id": ids[key]})
+            else:
+                # Inserted by someone else between the lookup and the insert
+                results.append({"index": index, "status": "exists", "id": None})
+        return results
+
+
+bulk_ingester = BulkIngester.from_env()
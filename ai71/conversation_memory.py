@@ -0,0 +1,208 @@
+# ai71/conversation_memory.py
+"""
+Token-budgeted conversation memory keyed by student and character.
+
+Each conversation keeps its system prompt plus the most recent turns that fit into a token budget
+(counted with tiktoken). Older turns are evicted and forgotten: the tutor loses what they said, so
+the budget should cover the span of a lesson. The store as a whole is capped by number of conversations and total tokens, evicting
+least recently used conversations first, and idle conversations expire after a TTL.
+
+When the state backend is shared (Redis), each conversation is stored there as one JSON document
+that expires after the idle TTL, so every worker continues the same conversation; the process-wide
+caps then do not apply. Concurrent updates of one conversation from two workers are last-writer-wins.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .metrics import registry
+from .state_backend import StateBackend, state_backend
+from .tokens import count_tokens, TOKENS_PER_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+ConversationKey = Tuple[str, str]
+
+
+class _Conversation:
+    __slots__ = ("system", "system_tokens", "turns", "turn_tokens", "last_access")
+
+    def __init__(self):
+        self.system: Optional[str] = None
+        self.system_tokens = 0
+        self.turns: Deque[Tuple[Dict[str, str], int]] = deque()
+        self.turn_tokens = 0
+        self.last_access = time.monotonic()
+
+    @property
+    def tokens(self) -> int:
+        return self.system_tokens + self.turn_tokens
+
+    def to_dict(self) -> Dict:
+        return {
+            "system": [self.system, self.system_tokens],
+            "turns": [[message, tokens] for message, tokens in self.turns],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "_Conversation":
+        conversation = cls()
+        conversation.system, conversation.system_tokens = data["system"]
+        conversation.turns = deque((message, tokens) for message, tokens in data["turns"])
+        conversation.turn_tokens = sum(tokens for _, tokens in conversation.turns)
+        return conversation
+
+
+class ConversationMemoryStore:
+    """
+    Args:
+        token_budget (int): Maximum tokens of turn history kept per conversation.
+        max_conversations (int): Maximum number of conversations held in the process.
+        max_total_tokens (int): Maximum tokens held across all conversations.
+        idle_ttl (float): Seconds after which an untouched conversation is dropped.
+        model (str): Model whose tokenizer is used for counting.
+        backend (Optional[StateBackend]): Where conversations live when it is shared between workers.
+    """
+    def __init__(self, token_budget: int = 3000, max_conversations: int = 10000, max_total_tokens: int = 5_000_000,
+                 idle_ttl: float = 6 * 3600, model: str = "gpt-4o-mini", backend: Optional[StateBackend] = None):
+        self.token_budget = token_budget
+        self.max_conversations = max_conversations
+        self.max_total_tokens = max_total_tokens
+        self.idle_ttl = idle_ttl
+        self.model = model
+        self.backend = backend
+        self._conversations: "OrderedDict[ConversationKey, _Conversation]" = OrderedDict()
+        self._total_tokens = 0
+        self._evictions = registry.counter("conversation_memory_evictions_total", "Turns and conversations evicted from conversation memory")
+        registry.gauge("conversation_memory", "Conversation memory usage", callback=self.stats)
+
+    @classmethod
+    def from_env(cls) -> "ConversationMemoryStore":
+        return cls(
+            token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", "3000")),
+            max_conversations=int(os.getenv("MEMORY_MAX_CONVERSATIONS", "10000")),
+            max_total_tokens=int(os.getenv("MEMORY_MAX_TOTAL_TOKENS", "5000000")),
+            idle_ttl=float(os.getenv("MEMORY_IDLE_TTL", str(6 * 3600))),
+            backend=state_backend,
+        )
+
+    @property
+    def shared(self) -> bool:
+        return self.backend is not None and self.backend.shared
+
+    @staticmethod
+    def _key(student_id: str, character: str) -> str:
+        return f"memory:{student_id}:{character}"
+
+    async def _load(self, student_id: str, character: str, create: bool = False) -> Optional[_Conversation]:
+        if not self.shared:
+            return self._get(student_id, character, create)
+        data = await self.backend.get(self._key(student_id, character))
+        if data is not None:
+            return _Conversation.from_dict(data)
+        return _Conversation() if create else None
+
+    async def _save(self, student_id: str, character: str, conversation: _Conversation, tokens_before: int):
+        if not self.shared:
+            self._total_tokens += conversation.tokens - tokens_before
+            self._enforce_caps()
+            return
+        await self.backend.set(self._key(student_id, character), conversation.to_dict(), ttl=self.idle_ttl)
+        # Lets clear(student_id) find every character of a student
+        await self.backend.set_add(f"memory:{student_id}", character, ttl=self.idle_ttl)
+
+    def _get(self, student_id: str, character: str, create: bool = False) -> Optional[_Conversation]:
+        key = (student_id, character)
+        conversation = self._conversations.get(key)
+        if conversation is None and create:
+            conversation = _Conversation()
+            self._conversations[key] = conversation
+        if conversation is not None:
+            conversation.last_access = time.monotonic()
+            self._conversations.move_to_end(key)
+        return conversation
+
+    async def set_system(self, student_id: str, character: str, content: str):
+        conversation = await self._load(student_id, character, create=True)
+        if conversation.system == content:
+            return
+        tokens_before = conversation.tokens
+        tokens = count_tokens(content, self.model) + TOKENS_PER_MESSAGE
+        conversation.system, conversation.system_tokens = content, tokens
+        await self._save(student_id, character, conversation, tokens_before)
+
+    async def add_turns(self, student_id: str, character: str, messages: List[Dict[str, str]]):
+        conversation = await self._load(student_id, character, create=True)
+        tokens_before = conversation.tokens
+        for message in messages:
+            tokens = count_tokens(message["content"], self.model) + TOKENS_PER_MESSAGE
+            conversation.turns.append(({"role": message["role"], "content": message["content"]}, tokens))
+            conversation.turn_tokens += tokens
+        self._trim(conversation)
+        await self._save(student_id, character, conversation, tokens_before)
+
+    async def get_messages(self, student_id: str, character: str) -> List[Dict[str, str]]:
+        conversation = await self._load(student_id, character)
+        if conversation is None:
+            return []
+        messages = []
+        if conversation.system:
+            messages.append({"role": "system", "content": conversation.system})
+        messages.extend(dict(message) for message, _ in conversation.turns)
+        return messages
+
+    async def clear(self, student_id: Optional[str] = None, character: Optional[str] = None):
+        if self.shared:
+            if student_id is None:
+                # Dropping every student's memory would need a keyspace scan; the idle TTL expires them instead
+                logger.warning("Clearing all conversation memory is not supported on a shared backend")
+                return
+            characters = [character] if character is not None else await self.backend.set_members(f"memory:{student_id}")
+            await self.backend.delete(*(self._key(student_id, name) for name in characters))
+            return
+        if student_id is None:
+            self._conversations.clear()
+            self._total_tokens = 0
+            return
+        keys = [key for key in self._conversations if key[0] == student_id and (character is None or key[1] == character)]
+        for key in keys:
+            self._total_tokens -= self._conversations.pop(key).tokens
+
+    def _trim(self, conversation: _Conversation):
+        evicted = 0
+        while conversation.turns and conversation.turn_tokens > self.token_budget:
+            self._pop_oldest(conversation)
+            evicted += 1
+        # Never start the retained history with an orphaned assistant reply
+        while conversation.turns and conversation.turns[0][0]["role"] == "assistant":
+            self._pop_oldest(conversation)
+            evicted += 1
+        if evicted:
+            self._evictions.inc(evicted, kind="turn")
+
+    def _pop_oldest(self, conversation: _Conversation) -> Dict[str, str]:
+        message, tokens = conversation.turns.popleft()
+        conversation.turn_tokens -= tokens
+        return message
+
+    def _enforce_caps(self):
+        now = time.monotonic()
+        while self._conversations:
+            key, oldest = next(iter(self._conversations.items()))
+            over_caps = len(self._conversations) > self.max_conversations or self._total_tokens > self.max_total_tokens
+            if not over_caps and now - oldest.last_access < self.idle_ttl:
+                break
+            del self._conversations[key]
+            self._total_tokens -= oldest.tokens
+            self._evictions.inc(kind="conversation")
+
+    def stats(self) -> Dict[str, Any]:
+        if self.shared:
+            return {"backend": self.backend.name}
+        return {"conversations": len(self._conversations), "total_tokens": self._total_tokens}
+
+
+conversation_memory = ConversationMemoryStore.from_env()
@@ -0,0 +1,145 @@
+# ai71/curriculum/cache.py
+"""
+Read-through cache for stored curricula.
+
+Curricula are written rarely (generation and optimization each insert a new row) and read on every
+page load of the frontend. Each cached entry holds the parsed document, the response body already
+serialized as JSON, and the validators (ETag, Last-Modified) used to answer conditional requests
+with 304. The id of the newest curriculum, which `GET /api/curriculum/latest` resolves, is cached as
+a pointer with a short TTL. Writers call `invalidate`, which drops the pointer in this process;
+other workers pick up the new curriculum when their pointer expires.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+from ..database import AsyncSessionLocal, Curriculum
+from ..metrics import registry
+from ..single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CachedCurriculum:
+    __slots__ = ("id", "document", "body", "etag", "last_modified")
+
+    def __init__(self, row: Curriculum):
+        self.id = row.id
+        self.document: Dict[str, Any] = json.loads(row.curriculum)
+        self.body = json.dumps({"curriculum": self.document}).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        modified = (row.updated_at or row.created_at or datetime.utcnow()).replace(tzinfo=timezone.utc)
+        # HTTP dates have second resolution; truncating keeps If-Modified-Since comparisons exact
+        self.last_modified = modified.replace(microsecond=0)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"ETag": self.etag, "Last-Modified": format_datetime(self.last_modified, usegmt=True)}
+
+
+class CurriculumCache:
+    """
+    Args:
+        max_entries (int): Curricula kept in process, least recently used evicted first.
+        ttl (float): Seconds a cached curriculum is served before it is read again.
+        latest_ttl (float): Seconds the id behind "latest" is trusted without asking the database.
+    """
+    def __init__(self, max_entries: int = 256, ttl: float = 3600, latest_ttl: float = 5.0, session_factory=AsyncSessionLocal):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.latest_ttl = latest_ttl
+        self.session_factory = session_factory
+        self._entries: "OrderedDict[int, Tuple[float, CachedCurriculum]]" = OrderedDict()
+        self._latest: Optional[Tuple[float, int]] = None
+        # Bumped by every invalidation so a load that started before a write cannot store stale data
+        self._generation = 0
+        self._loads = SingleFlight("curriculum")
+        self._lookups = registry.counter("curriculum_cache_lookups_total", "Curriculum cache lookups by kind and result")
+        registry.gauge("curriculum_cache_entries", "Curricula held in the in-process cache", callback=lambda: len(self._entries))
+
+    @classmethod
+    def from_env(cls) -> "CurriculumCache":
+        return cls(
+            max_entries=int(os.getenv("CURRICULUM_CACHE_MAX_ENTRIES", "256")),
+            ttl=float(os.getenv("CURRICULUM_CACHE_TTL", "3600")),
+            latest_ttl=float(os.getenv("CURRICULUM_LATEST_TTL", "5")),
+        )
+
+    async def get(self, curriculum_id: int) -> Optional[CachedCurriculum]:
+        entry = self._entries.get(curriculum_id)
+        if entry is not None:
+            expires_at, cached = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(curriculum_id)
+                self._lookups.inc(kind="id", result="hit")
+                return cached
+            del self._entries[curriculum_id]
+        self._lookups.inc(kind="id", result="miss")
+        # Keyed by generation, so a read after a write never joins a load that started before it
+        return await self._loads.do(f"id:{curriculum_id}:{self._generation}", lambda: self._load(curriculum_id))
+
+    async def latest(self) -> Optional[CachedCurriculum]:
+        if self._latest is not None and self._latest[0] > time.monotonic():
+            self._lookups.inc(kind="latest", result="hit")
+            return await self.get(self._latest[1])
+        self._lookups.inc(kind="latest", result="miss")
+        latest_id = await self._loads.do(f"latest:{self._generation}", self._load_latest_id)
+        return await self.get(latest_id) if latest_id is not None else None
+
+    def invalidate(self, curriculum_id: Optional[int] = None):
+        """Called after a curriculum is written; drops the latest pointer and the entry of `curriculum_id`."""
+        self._generation += 1
+        self._latest = None
+        if curriculum_id is not None:
+            self._entries.pop(curriculum_id, None)
+
+    def clear(self):
+        self.invalidate()
+        self._entries.clear()
+
+    async def _load(self, curriculum_id: int) -> Optional[CachedCurriculum]:
+        generation = self._generation
+        async with self.session_factory() as db:
+            row = await db.get(Curriculum, curriculum_id)
+        if row is None:
+            return None
+        cached = CachedCurriculum(row)
+        if generation == self._generation:
+            self._entries[curriculum_id] = (time.monotonic() + self.ttl, cached)
+            self._entries.move_to_end(curriculum_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    async def _load_latest_id(self) -> Optional[int]:
+        generation = self._generation
+        async with self.session_factory() as db:
+            latest_id = (await db.execute(select(Curriculum.id).order_by(Curriculum.id.desc()).limit(1))).scalar()
+        if latest_id is not None and generation == self._generation:
+            self._latest = (time.monotonic() + self.latest_ttl, latest_id)
+        return latest_id
+
+
+def not_modified(cached: CachedCurriculum, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """Evaluates conditional request headers against `cached`; If-None-Match takes precedence."""
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or cached.etag in tags or f"W/{cached.etag}" in tags
+    if if_modified_since is not None:
+        try:
+            return cached.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+curriculum_cache = CurriculumCache.from_env()
@@ -1,15 +1,15 @@
-from sqlalchemy.orm import Session
-from ..database import SessionLocal, Curriculum
+from ..database import AsyncSessionLocal, Curriculum
 import json
 from typing import List, Dict
 from ..api import OpenAIAPI
-from ..database import PerformanceData, LearningGoal
+from ..database import PerformanceData
+from .cache import curriculum_cache
 
 class CurriculumGenerator:
     def __init__(self):
         self.ai_api = OpenAIAPI()
 
-    def optimize_curriculum(self, character: str, subject: str, difficulty: str, chapters: List[str], performance_data: Dict[str, float], learning_goals: List[str]) -> Dict:
+    async def optimize_curriculum(self, character: str, subject: str, difficulty: str, chapters: List[str], performance_data: Dict[str, float], learning_goals: List[str]) -> Dict:
         system_message = """
         You are an expert curriculum designer. Your task is to generate a structured curriculum based on the provided information.
         Always return your response in the following JSON format, ensuring all fields are filled:
@@ -66,39 +66,34 @@ class CurriculumGenerator:
             {"role": "user", "content": user_prompt}
         ]
 
-        response = self.ai_api.chat_completion(messages, model="gpt-4o-mini")
+        response = await self.ai_api.chat_completion(messages, model="gpt-4o-mini", feature="curriculum.optimize")
         
         try:
-            curriculum_json = json.loads(response.choices[0].message.content)
-            self.save_curriculum(curriculum_json, character, subject, difficulty, performance_data, learning_goals)
+            curriculum_json = json.loads(response['choices'][0]['message']['content'])
+            await self.save_curriculum(curriculum_json, character, subject, difficulty, performance_data, learning_goals)
             return curriculum_json
         except json.JSONDecodeError as e:
             print(f"Error parsing AI response: {e}")
             return {}
 
-    def save_curriculum(self, curriculum: Dict, character: str, subject: str, difficulty: str, performance_data: Dict[str, float], learning_goals: List[str]):
-        db: Session = SessionLocal()
-        db_curriculum = Curriculum(
-            curriculum=json.dumps(curriculum),
-            character=character,
-            subject=subject,
-            difficulty=difficulty
-        )
-        db.add(db_curriculum)
-        db.flush()  # This assigns an id to db_curriculum
-
-        for chapter, score in performance_data.items():
-            db_performance = PerformanceData(curriculum_id=db_curriculum.id, chapter=chapter, score=score)
-            db.add(db_performance)
-
-        for goal in learning_goals:
-            db_goal = LearningGoal(curriculum_id=db_curriculum.id, goal=goal)
-            db.add(db_goal)
-
-        db.commit()
-        db.refresh(db_curriculum)
-
-    def generate_curriculum_stream(self, character: str, subject: str, difficulty: str, chapters: List[str], performance_data: Dict[str, float], learning_goals: List[str]):
+    async def save_curriculum(self, curriculum: Dict, character: str, subject: str, difficulty: str, performance_data: Dict[str, float], learning_goals: List[str]) -> int:
+        # The Curriculum model only stores the JSON document and there is no LearningGoal model any more,
+        # so the request context is kept inside the document
+        document = {**curriculum, "character": character, "subject": subject, "difficulty": difficulty, "learning_goals": learning_goals}
+        async with AsyncSessionLocal() as db:
+            db_curriculum = Curriculum(curriculum=json.dumps(document))
+            db.add(db_curriculum)
+            await db.flush()  # This assigns an id to db_curriculum
+
+            for chapter, score in performance_data.items():
+                db_performance = PerformanceData(curriculum_id=db_curriculum.id, chapter=chapter, score=score)
+                db.add(db_performance)
+
+            await db.commit()
+        curriculum_cache.invalidate(db_curriculum.id)
+        return db_curriculum.id
+
+    async def generate_curriculum_stream(self, character: str, subject: str, difficulty: str, chapters: List[str], performance_data: Dict[str, float], learning_goals: List[str]):
         system_message = """
         You are an expert curriculum designer. Your task is to generate a structured curriculum based on the provided information.
         Always return your response in the following JSON format, ensuring all fields are filled:
@@ -155,10 +150,10 @@ class CurriculumGenerator:
             {"role": "user", "content": user_prompt}
         ]
 
-        stream = self.ai_api.stream_chat_completion(messages, model="gpt-4o-mini")
+        stream = self.ai_api.stream_chat_completion(messages, model="gpt-4o-mini", feature="curriculum.stream")
         
         full_response = ""
-        for chunk in stream:
+        async for chunk in stream:
             if chunk.choices[0].delta.content is not None:
                 content = chunk.choices[0].delta.content
                 full_response += content
@@ -166,6 +161,6 @@ class CurriculumGenerator:
 
         try:
             curriculum_json = json.loads(full_response)
-            self.save_curriculum(curriculum_json, character, subject, difficulty, performance_data, learning_goals)
+            await self.save_curriculum(curriculum_json, character, subject, difficulty, performance_data, learning_goals)
         except json.JSONDecodeError as e:
             print(f"Error parsing AI response: {e}")
\ No newline at end of file
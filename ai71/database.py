@@ -1,24 +1,51 @@
 # ai71/database.py
 import os
-from sqlalchemy import create_engine, Column, Integer, Text, Float, ForeignKey, String, DateTime, Boolean, JSON
+from sqlalchemy import create_engine, Column, Integer, Text, Float, ForeignKey, String, DateTime, Boolean, JSON, Index
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from alembic import command
-from alembic.config import Config
 from datetime import datetime
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-engine = create_engine(
-    DATABASE_URL,
+def to_async_url(url: str) -> str:
+    """Maps a sync Postgres URL (psycopg2) to its asyncpg equivalent; other URLs are returned unchanged."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "postgresql":
+        return url
+    query = dict(parsed.query)
+    # asyncpg spells libpq's sslmode as ssl
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return parsed.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+
+# The sync engine is kept for Alembic, init_db and scripts; request handling uses async_engine
+# SQLite (used by tests) does not take queue pool settings
+_sync_pool_options = {} if make_url(DATABASE_URL).get_backend_name() == "sqlite" else dict(
     pool_size=5,
     max_overflow=10,
     pool_timeout=30,
     pool_recycle=1800,
 )
+engine = create_engine(DATABASE_URL, **_sync_pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL') or to_async_url(DATABASE_URL)
+
+_async_pool_options = {} if make_url(ASYNC_DATABASE_URL).get_backend_name() == "sqlite" else dict(
+    pool_size=int(os.getenv('DB_POOL_SIZE', '10')),
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_async_pool_options)
+# expire_on_commit=False keeps loaded attributes readable after commit without implicit (sync) refreshes
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # class User(Base):
@@ -74,12 +101,16 @@ class ConversationHistory(Base):
     __tablename__ = "conversation_history"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(String, ForeignKey("users.id"))
     character = Column(String, nullable=False)
+    role = Column(String)
     content = Column(Text, nullable=False)
     is_ai_response = Column(Boolean, default=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    # Serves the latest-turns and keyset-paginated reads of one student and character
+    __table_args__ = (Index("ix_conversation_history_user_character_ts", "user_id", "character", "timestamp"),)
+
     user = relationship("User", back_populates="conversations")
 
 class Environment(Base):
@@ -110,7 +141,14 @@ class UserAchievement(Base):
     unlocked_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="achievements")
-    achievement = relationship("Achievement")
+    # Read paths load achievements explicitly (see ai71/queries.py); a lazy load per row would be an N+1
+    achievement = relationship("Achievement", lazy="raise_on_sql")
+
+    __table_args__ = (
+        Index("ix_user_achievements_user_unlocked", "user_id", "unlocked_at"),
+        # A user unlocks an achievement once; bulk imports upsert on this key
+        Index("uq_user_achievements_user_achievement", "user_id", "achievement_id", unique=True),
+    )
 
 class UserEngagement(Base):
     __tablename__ = "user_engagements"
@@ -122,6 +160,8 @@ class UserEngagement(Base):
 
     user = relationship("User", back_populates="engagements")
 
+    __table_args__ = (Index("ix_user_engagements_user_timestamp", "user_id", "timestamp"),)
+
 class UserProfile(Base):
     __tablename__ = "user_profiles"
 
@@ -144,6 +184,8 @@ class Recommendation(Base):
 
     user = relationship("User", back_populates="recommendations")
 
+    __table_args__ = (Index("ix_recommendations_user_recommended", "user_id", "recommended_at"),)
+
 User.performance_data = relationship("PerformanceData", back_populates="user")
 # User.learning_goals = relationship("LearningGoal", back_populates="user")
 User.conversations = relationship("ConversationHistory", back_populates="user")
@@ -155,9 +197,21 @@ User.recommendations = relationship("Recommendation", back_populates="user")
 Curriculum.performance_data = relationship("PerformanceData", back_populates="curriculum")
 # Curriculum.learning_goals = relationship("LearningGoal", back_populates="curriculum")
 
+def dialect_insert(table, dialect: str):
+    """An INSERT supporting ON CONFLICT for `dialect` (Postgres in production, SQLite in tests)."""
+    return postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+async def init_db_async():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
 def run_migrations():
+    # Alembic is only needed here; importing it at module level costs startup time
+    from alembic import command
+    from alembic.config import Config
+
     alembic_cfg = Config("alembic.ini")
     command.upgrade(alembic_cfg, "head")
\ No newline at end of file
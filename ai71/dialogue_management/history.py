@@ -0,0 +1,330 @@
+# ai71/dialogue_management/history.py
+"""
+Storage-backed conversation history for the dialogue manager.
+
+Turns are written to `conversation_history` behind the request: `append` buffers a turn and a
+background task flushes the buffer in batched inserts, either every `flush_interval` seconds or as
+soon as `batch_size` turns are pending. The last `hot_turns` turns of recently used conversations
+are kept in the state backend (in process, or in Redis when workers share state), so the common
+read (the latest page of one student and character) needs no query. Older pages are read with
+keyset pagination on (timestamp, id), which the composite index
+`ix_conversation_history_user_character_ts` serves without scanning skipped rows. A cursor needs the
+row id of the turn it points at, so a page whose oldest turn is still buffered is flushed and read
+from the table instead.
+
+With a shared backend, a conversation that is first loaded into the recent-turn cache while another
+worker still buffers turns for it misses those turns in the cache until the entry expires
+(`hot_ttl`); the table itself is always complete.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from ..database import AsyncSessionLocal, ConversationHistory
+from ..metrics import registry
+from ..pagination import decode_cursor, encode_cursor
+from ..state_backend import StateBackend, state_backend
+
+logger = logging.getLogger(__name__)
+
+ConversationKey = Tuple[str, str]
+Turn = Dict[str, Any]
+
+_flushed = registry.counter("conversation_history_flushed_total", "Turns written to conversation_history by outcome")
+_flush_seconds = registry.histogram("conversation_history_flush_seconds", "Duration of one batched history flush")
+_reads = registry.counter("conversation_history_reads_total", "History reads by source (cache or database)")
+
+
+def turn_cursor(turn: Turn) -> str:
+    """Keyset cursor pointing just before `turn`."""
+    # A turn buffered by another worker has no id yet; id 0 continues strictly before its timestamp
+    return encode_cursor(datetime.fromisoformat(turn["timestamp"]), turn.get("id") or 0)
+
+
+class ConversationHistoryStore:
+    """
+    Args:
+        hot_turns (int): Most recent turns cached per student and character.
+        hot_ttl (float): Seconds an untouched conversation stays in the recent-turn cache.
+        batch_size (int): Pending turns that trigger an immediate flush, and the size of one insert.
+        flush_interval (float): Seconds between background flushes.
+        max_pending (int): Turns buffered while the database is unavailable; the oldest are dropped beyond it.
+        backend (StateBackend): Holds the recent-turn cache.
+
+    A cached conversation holding fewer than `hot_turns` turns is the whole conversation.
+    """
+    def __init__(self, hot_turns: int = 50, hot_ttl: float = 3600, batch_size: int = 200, flush_interval: float = 1.0,
+                 max_pending: int = 20000, session_factory=AsyncSessionLocal, backend: StateBackend = state_backend):
+        self.hot_turns = hot_turns
+        self.hot_ttl = hot_ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.session_factory = session_factory
+        self.backend = backend
+        self._pending: List[Turn] = []
+        # Turns appended while their conversation is being loaded into the cache
+        self._loading: Dict[ConversationKey, List[Turn]] = {}
+        # Serializes flushes with cache loads and deletes, so a load never misses a turn in flight
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        registry.gauge("conversation_history", "Conversation history buffer and cache sizes", callback=self.stats)
+
+    @classmethod
+    def from_env(cls) -> "ConversationHistoryStore":
+        return cls(
+            hot_turns=int(os.getenv("HISTORY_HOT_TURNS", "50")),
+            hot_ttl=float(os.getenv("HISTORY_HOT_TTL", "3600")),
+            batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "200")),
+            flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0")),
+            max_pending=int(os.getenv("HISTORY_MAX_PENDING", "20000")),
+        )
+
+    async def append(self, student_id: str, character: str, role: str, content: str) -> Turn:
+        """Buffers one turn for writing and adds it to the recent-turn cache."""
+        turn = {
+            "id": None,
+            "student_id": student_id,
+            "character": character,
+            "role": role,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+        self._pending.append(turn)
+        if len(self._pending) > self.max_pending:
+            dropped = len(self._pending) - self.max_pending
+            del self._pending[:dropped]
+            _flushed.inc(dropped, outcome="dropped")
+            logger.error(f"Conversation history buffer is full; dropped {dropped} unwritten turns")
+        self._ensure_writer()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        loading = self._loading.get((student_id, character))
+        if loading is not None:
+            loading.append(turn)
+        else:
+            # Uncached conversations are loaded from the table (plus the buffer) on their next read
+            await self.backend.list_append(self._hot_key(student_id, character), turn, self.hot_turns, self.hot_ttl)
+        return turn
+
+    async def recent(self, student_id: str, character: str, limit: Optional[int] = None, before: Optional[str] = None) -> List[Turn]:
+        """Up to `limit` turns (default `hot_turns`) older than the cursor `before`, oldest first."""
+        return [self._public(turn) for turn in await self._read(student_id, character, limit or self.hot_turns, before)]
+
+    async def page(self, student_id: str, character: str, limit: Optional[int] = None, before: Optional[str] = None) -> Dict[str, Any]:
+        """Like `recent`, plus the cursor of the next (older) page, or None after the last one."""
+        limit = limit or self.hot_turns
+        turns = await self._read(student_id, character, limit, before)
+        if len(turns) == limit and turns[0].get("id") is None:
+            # The cursor needs the id of the oldest turn; a buffered one gets it once written
+            await self.flush()
+            turns = await self._query(student_id, character, limit, before)
+        next_cursor = turn_cursor(turns[0]) if len(turns) == limit else None
+        return {"history": [self._public(turn) for turn in turns], "next_cursor": next_cursor}
+
+    async def _read(self, student_id: str, character: str, limit: int, before: Optional[str]) -> List[Turn]:
+        if before is None and limit <= self.hot_turns:
+            turns = await self._load(student_id, character)
+            if limit <= len(turns) or len(turns) < self.hot_turns:
+                _reads.inc(source="cache")
+                return turns[-limit:]
+        # Deeper pages come from the table, so pending turns have to be written first
+        await self.flush()
+        _reads.inc(source="database")
+        return await self._query(student_id, character, limit, before)
+
+    async def characters(self, student_id: str) -> List[str]:
+        await self.flush()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(ConversationHistory.character).where(ConversationHistory.user_id == student_id).distinct()
+            )
+            return list(result.scalars())
+
+    async def interaction_stats(self, student_id: str) -> Dict[str, int]:
+        """Turn count and number of characters that answered the student."""
+        await self.flush()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(
+                    func.count(ConversationHistory.id),
+                    func.count(func.distinct(ConversationHistory.character)).filter(ConversationHistory.is_ai_response.is_(True)),
+                ).where(ConversationHistory.user_id == student_id)
+            )
+            turns, characters = result.one()
+            return {"interaction_count": turns, "topic_coverage": characters}
+
+    async def clear(self, student_id: str, character: str):
+        async with self._lock:
+            self._pending = [turn for turn in self._pending if (turn["student_id"], turn["character"]) != (student_id, character)]
+            await self.backend.delete(self._hot_key(student_id, character))
+            async with self.session_factory() as db:
+                await db.execute(
+                    delete(ConversationHistory).where(
+                        ConversationHistory.user_id == student_id, ConversationHistory.character == character
+                    )
+                )
+                await db.commit()
+
+    async def flush(self):
+        async with self._lock:
+            while self._pending:
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                if not await self._write(batch):
+                    break
+
+    async def close(self):
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"Conversation history closed with {len(self._pending)} unwritten turns")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": len(self._pending), "loading": len(self._loading)}
+
+    def _ensure_writer(self):
+        if self._task is None and not self._closed:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Conversation history flush failed: {str(e)}")
+
+    async def _write(self, batch: List[Turn]) -> bool:
+        """Inserts one batch and backfills the new ids; returns False if the batch was requeued."""
+        started = asyncio.get_running_loop().time()
+        try:
+            async with self.session_factory() as db:
+                result = await db.execute(
+                    insert(ConversationHistory).returning(ConversationHistory.id, sort_by_parameter_order=True),
+                    [self._row(turn) for turn in batch],
+                )
+                ids = result.scalars().all()
+                await db.commit()
+        except IntegrityError as e:
+            # One bad row (e.g. an unknown student) must not take the rest of the batch down with it
+            logger.warning(f"Batched history insert failed ({e.orig}); retrying {len(batch)} turns one by one")
+            await self._write_each(batch)
+            return True
+        except Exception as e:
+            # Most likely the database is unreachable: keep the turns and try again on the next flush
+            self._pending[:0] = batch
+            _flushed.inc(len(batch), outcome="retried")
+            logger.error(f"Could not write {len(batch)} conversation turns: {str(e)}")
+            return False
+        for turn, row_id in zip(batch, ids):
+            turn["id"] = row_id
+        _flushed.inc(len(batch), outcome="ok")
+        _flush_seconds.observe(asyncio.get_running_loop().time() - started)
+        return True
+
+    async def _write_each(self, batch: List[Turn]):
+        async with self.session_factory() as db:
+            for turn in batch:
+                try:
+                    result = await db.execute(insert(ConversationHistory).returning(ConversationHistory.id), [self._row(turn)])
+                    turn["id"] = result.scalar_one()
+                    await db.commit()
+                    _flushed.inc(outcome="ok")
+                except IntegrityError as e:
+                    await db.rollback()
+                    _flushed.inc(outcome="rejected")
+                    logger.error(f"Dropped conversation turn of student {turn['student_id']} with {turn['character']}: {e.orig}")
+
+    @staticmethod
+    def _hot_key(student_id: str, character: str) -> str:
+        return f"history:{student_id}:{character}"
+
+    async def _load(self, student_id: str, character: str) -> List[Turn]:
+        key = (student_id, character)
+        hot_key = self._hot_key(student_id, character)
+        turns = await self.backend.list_tail(hot_key, self.hot_turns)
+        if turns is not None:
+            return turns
+        async with self._lock:
+            turns = await self.backend.list_tail(hot_key, self.hot_turns)
+            if turns is not None:
+                return turns
+            late = self._loading[key] = []
+            try:
+                rows = await self._query(student_id, character, self.hot_turns, None)
+                # Holding the lock means no flush ran since the query, so the buffer has exactly the unwritten turns
+                turns = (rows + [turn for turn in self._pending if (turn["student_id"], turn["character"]) == key])[-self.hot_turns:]
+                loaded = {id(turn) for turn in turns}
+                await self.backend.list_replace(hot_key, turns, self.hot_turns, self.hot_ttl)
+                # Turns appended while the list was being stored were parked in `late` instead of the cache
+                while late:
+                    turn = late.pop(0)
+                    if id(turn) in loaded:
+                        continue
+                    if not await self.backend.list_append(hot_key, turn, self.hot_turns, self.hot_ttl):
+                        await self.backend.list_replace(hot_key, [turn], self.hot_turns, self.hot_ttl)
+                    turns = (turns + [turn])[-self.hot_turns:]
+            finally:
+                del self._loading[key]
+            return turns
+
+    async def _query(self, student_id: str, character: str, limit: int, before: Optional[str]) -> List[Turn]:
+        query = select(ConversationHistory).where(
+            ConversationHistory.user_id == student_id, ConversationHistory.character == character
+        )
+        if before is not None:
+            timestamp, row_id = decode_cursor(before)
+            query = query.where(or_(
+                ConversationHistory.timestamp < timestamp,
+                and_(ConversationHistory.timestamp == timestamp, ConversationHistory.id < row_id),
+            ))
+        query = query.order_by(ConversationHistory.timestamp.desc(), ConversationHistory.id.desc()).limit(limit)
+        async with self.session_factory() as db:
+            rows = (await db.execute(query)).scalars().all()
+        return [self._turn(row) for row in reversed(rows)]
+
+    @staticmethod
+    def _row(turn: Turn) -> Dict[str, Any]:
+        return {
+            "user_id": turn["student_id"],
+            "character": turn["character"],
+            "role": turn["role"],
+            "content": turn["content"],
+            "is_ai_response": turn["role"] == "assistant",
+            "timestamp": datetime.fromisoformat(turn["timestamp"]),
+        }
+
+    @staticmethod
+    def _turn(row: ConversationHistory) -> Turn:
+        return {
+            "id": row.id,
+            "student_id": row.user_id,
+            "character": row.character,
+            # Rows written before the role column existed only know whether the AI answered
+            "role": row.role or ("assistant" if row.is_ai_response else "user"),
+            "content": row.content,
+            "timestamp": row.timestamp.isoformat(),
+        }
+
+    @staticmethod
+    def _public(turn: Turn) -> Turn:
+        return {key: turn[key] for key in ("id", "role", "content", "timestamp", "character")}
@@ -1,18 +1,20 @@
 # ai71/dialogue_management/manager.py
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 import random
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import json
-from ..models import CurriculumData, PerformanceData #, LearningGoal
+from ..database import Curriculum, PerformanceData #, LearningGoal
+from .history import ConversationHistoryStore
+from ..curriculum.cache import curriculum_cache
 
 
 
 class DialogueManager:
     def __init__(self):
         self.logger = self._setup_logger()
-        self.conversations: Dict[str, Dict[str, List[Dict[str, str]]]] = {}
+        self.history = ConversationHistoryStore.from_env()
         self.character_personas = {
             "wake": {
                 "name": "Wake",
@@ -51,13 +53,18 @@ class DialogueManager:
             }
         }
 
+    async def close(self):
+        await self.history.close()
+
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        # Only for standalone use; under the API the root handlers already print these records
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
     
     # def _generate_character_response(self, character: str, content: str) -> str:
@@ -77,19 +84,14 @@ class DialogueManager:
 
     async def process_ai_response(self, response: str, student_id: str, character: str):
         character_response = self._generate_character_response(character, response)
-        self.conversations.setdefault(student_id, {}).setdefault(character, []).append({
-            "role": "assistant",
-            "content": character_response,
-            "timestamp": datetime.now().isoformat(),
-            "character": character
-        })
+        await self.history.append(student_id, character, "assistant", character_response)
         return character_response
 
     # async def get_conversation_history(self, student_id: str, character: str) -> List[Dict[str, str]]:
-    async def get_conversation_history(self, student_id: str, character: str):
-
+    async def get_conversation_history(self, student_id: str, character: str, limit: Optional[int] = None, before: Optional[str] = None):
+        """The latest turns come from the hot cache; older pages (`before` a cursor) from the database."""
         try:
-            history = self.conversations.get(student_id, {}).get(character, [])
+            history = await self.history.recent(student_id, character, limit, before)
             self.logger.info(f"Retrieved conversation history for student {student_id} with character {character}")
             return history
         except Exception as e:
@@ -98,8 +100,7 @@ class DialogueManager:
 
     async def clear_history(self, student_id: str, character: str):
         try:
-            if student_id in self.conversations and character in self.conversations[student_id]:
-                self.conversations[student_id][character] = []
+            await self.history.clear(student_id, character)
             self.logger.info(f"Cleared conversation history for student {student_id} with character {character}")
         except Exception as e:
             self.logger.error(f"Error clearing conversation history for student {student_id} with character {character}: {str(e)}")
@@ -107,25 +108,17 @@ class DialogueManager:
     async def collect_feedback(self, student_id: str, feedback: str):
         try:
             self.logger.info(f"Collected feedback from student {student_id}: {feedback}")
-            for character in self.conversations.get(student_id, {}):
-                self.conversations[student_id][character].append({
-                    "role": "feedback",
-                    "content": feedback,
-                    "timestamp": datetime.now().isoformat()
-                })
+            for character in await self.history.characters(student_id):
+                await self.history.append(student_id, character, "feedback", feedback)
         except Exception as e:
             self.logger.error(f"Error collecting feedback from student {student_id}: {str(e)}")
 
-    async def analyze_learning_progress(self, student_id: str, db: Session) -> Dict[str, Any]:
+    async def analyze_learning_progress(self, student_id: str, db: AsyncSession) -> Dict[str, Any]:
         try:
             # Your existing code here, but make sure to use the db parameter if needed
-            all_interactions = [
-                msg 
-                for character_history in self.conversations.get(student_id, {}).values() 
-                for msg in character_history
-            ]
-            interaction_count = len(all_interactions)
-            topic_coverage = len(set(msg["character"] for msg in all_interactions if msg["role"] == "assistant"))
+            stats = await self.history.interaction_stats(student_id)
+            interaction_count = stats["interaction_count"]
+            topic_coverage = stats["topic_coverage"]
             progress = min((interaction_count / 50) * 0.5 + (topic_coverage / len(self.character_personas)) * 0.5, 1.0)
             self.logger.info(f"Analyzed learning progress for student {student_id}")
             return {"progress": progress, "interaction_count": interaction_count, "topic_coverage": topic_coverage}
@@ -133,7 +126,7 @@ class DialogueManager:
             self.logger.error(f"Error analyzing learning progress for student {student_id}: {str(e)}")
             return {"progress": 0.0, "interaction_count": 0, "topic_coverage": 0}
 
-    async def recommend_next_steps(self, student_id: str, db: Session) -> List[str]:
+    async def recommend_next_steps(self, student_id: str, db: AsyncSession) -> List[str]:
         try:
             # Your existing code here, but make sure to use the db parameter if needed
             progress_data = await self.analyze_learning_progress(student_id, db)
@@ -163,14 +156,13 @@ class DialogueManager:
             self.logger.error(f"Error generating recommendations for student {student_id}: {str(e)}")
             return ["Continue with your current learning path"]
 
+    async def record_user_input(self, user_input: str, student_id: str, character: str):
+        await self.history.append(student_id, character, "user", user_input)
+
     async def process_user_input(self, user_input: str, student_id: str, character: str) -> str:
         try:
             self.logger.info(f"Processing input for student {student_id} with character {character}: {user_input}")
-            self.conversations.setdefault(student_id, {}).setdefault(character, []).append({
-                "role": "user",
-                "content": user_input,
-                "timestamp": datetime.now().isoformat()
-            })
+            await self.history.append(student_id, character, "user", user_input)
             # This is a placeholder. In a real implementation, you would call your AI model here.
             ai_response = f"Thank you for your question about {user_input}. Let's explore this topic together!"
             character_response = await self.process_ai_response(ai_response, student_id, character)
@@ -179,7 +171,7 @@ class DialogueManager:
             self.logger.error(f"Error processing input for student {student_id}: {str(e)}")
             return "I'm sorry, but I encountered an error. Please try again later."
 
-    async def optimize_curriculum(self, current_curriculum: Dict, performance_data: List[Dict], db: Session) -> Dict: #learning_goals: List[str]
+    async def optimize_curriculum(self, current_curriculum: Dict, performance_data: List[Dict], db: AsyncSession) -> Dict: #learning_goals: List[str]
         try:
             self.logger.info(f"Optimizing curriculum with current_curriculum={current_curriculum}, performance_data={performance_data}") #, learning_goals={learning_goals}")
 
@@ -197,15 +189,10 @@ class DialogueManager:
             # Add more topics based on learning goals
             optimized_curriculum["topics"] = list(set(current_curriculum.get("topics", []) )) #+ learning_goals
 
-            # Save the optimized curriculum to the database
-            db_curriculum = CurriculumData(
-                curriculum=json.dumps(optimized_curriculum),
-                character=current_curriculum["character"],
-                subject=current_curriculum["subject"],
-                difficulty=optimized_curriculum["difficulty"]
-            )
+            # Save the optimized curriculum to the database; character, subject and difficulty are part of the JSON
+            db_curriculum = Curriculum(curriculum=json.dumps(optimized_curriculum))
             db.add(db_curriculum)
-            db.flush()  # This assigns an id to db_curriculum
+            await db.flush()  # This assigns an id to db_curriculum
 
             self.logger.info(f"Saved curriculum with ID {db_curriculum.id}")
 
@@ -219,8 +206,8 @@ class DialogueManager:
             #     db.add(db_goal)
             #     self.logger.info(f"Saved learning goal {goal}")
 
-            db.commit()
-            db.refresh(db_curriculum)
+            await db.commit()
+            curriculum_cache.invalidate(db_curriculum.id)
 
             return {
                 "optimized_curriculum": optimized_curriculum,
@@ -17,18 +17,19 @@ class JSElementGenerator:
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
 
-    async def _generate_element(self, system_message: str, user_prompt: str) -> UIElement:
+    async def _generate_element(self, system_message: str, user_prompt: str, feature: str) -> UIElement:
         try:
             response = await self.ai_api.chat_completion([
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_prompt}
-            ], model="gpt-4o-mini")  # Assuming we're using the gpt-4o-mini model
+            ], model="gpt-4o-mini", feature=feature)  # Assuming we're using the gpt-4o-mini model
             
             content = response['choices'][0]['message']['content']
             element_data = json.loads(content)
@@ -64,7 +65,7 @@ class JSElementGenerator:
         If an onClick function is specified, include it in the JavaScript.
         """
 
-        return await self._generate_element(system_message, user_prompt)
+        return await self._generate_element(system_message, user_prompt, feature="element_lab.button")
 
     async def generate_card(self, title: str, content: str, image_url: Optional[str] = None) -> UIElement:
         system_message = """
@@ -91,7 +92,7 @@ class JSElementGenerator:
         Add a subtle hover effect to the card.
         """
 
-        return await self._generate_element(system_message, user_prompt)
+        return await self._generate_element(system_message, user_prompt, feature="element_lab.card")
 
     async def generate_modal(self, title: str, content: str, trigger_button_text: str) -> UIElement:
         system_message = """
@@ -118,7 +119,7 @@ class JSElementGenerator:
         The JavaScript should handle showing/hiding the modal and managing focus for accessibility.
         """
 
-        return await self._generate_element(system_message, user_prompt)
+        return await self._generate_element(system_message, user_prompt, feature="element_lab.modal")
 
 # Usage example
 async def main():
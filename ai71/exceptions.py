@@ -0,0 +1,19 @@
+# ai71/exceptions.py
+from typing import Optional
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    Raised when an upstream LLM call is refused locally instead of being attempted, e.g. because the
+    provider's admission queue is full. The API maps it to 503 with a Retry-After header.
+    """
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitedError(Exception):
+    """Raised when a user has spent their request budget; the API maps it to 429 with Retry-After."""
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -1,9 +1,12 @@
 from ..api import OpenAIAPI
+from ..state_backend import state_backend
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional
+import hashlib
 import json
 import logging
 import asyncio
+import os
 
 class Achievement(BaseModel):
     id: str
@@ -31,24 +34,32 @@ class GamificationSystem:
     def __init__(self):
         self.ai_api = OpenAIAPI()
         self.logger = self._setup_logger()
-        self.achievement_cache: Dict[str, List[Achievement]] = {}
-        self.challenge_cache: Dict[str, List[Challenge]] = {}
+        # Generated achievement systems and challenges are shared by all workers through the state backend
+        self.state = state_backend
+        self.cache_ttl = float(os.getenv("GAMIFICATION_CACHE_TTL", str(24 * 3600)))
+
+    @staticmethod
+    def _fingerprint(value) -> str:
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
 
     async def generate_achievement_system(self, curriculum: dict) -> List[Achievement]:
         try:
-            curriculum_hash = hash(json.dumps(curriculum, sort_keys=True))
-            if curriculum_hash in self.achievement_cache:
+            # hash() is salted per process, so it cannot key a cache shared between workers
+            cache_key = f"gamification:achievements:{self._fingerprint(curriculum)}"
+            cached = await self.state.get(cache_key)
+            if cached is not None:
                 self.logger.info("Using cached achievement system")
-                return self.achievement_cache[curriculum_hash]
+                return [Achievement(**ach) for ach in cached]
 
             system_message = """
             You are an AI expert in gamification for education. Your task is to create a comprehensive and engaging achievement system for a given curriculum. Focus on creating achievements that motivate students, track progress, and enhance the learning experience.
@@ -88,10 +99,10 @@ class GamificationSystem:
             response = await self.ai_api.chat_completion([
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_prompt}
-            ])
+            ], feature="gamification.achievement_system")
             
             achievements = [Achievement(**ach) for ach in json.loads(response['choices'][0]['message']['content'])]
-            self.achievement_cache[curriculum_hash] = achievements
+            await self.state.set(cache_key, [ach.dict() for ach in achievements], ttl=self.cache_ttl)
             self.logger.info("Generated new achievement system")
             return achievements
         except Exception as e:
@@ -122,7 +133,7 @@ class GamificationSystem:
             response = await self.ai_api.chat_completion([
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_prompt}
-            ])
+            ], feature="gamification.update_achievements")
             
             updates = json.loads(response['choices'][0]['message']['content'])
             self.logger.info(f"Updated achievements for student {student_id}")
@@ -133,6 +144,12 @@ class GamificationSystem:
 
     async def generate_personalized_challenges(self, student_id: str, progress: UserProgress, achievements: List[Achievement]) -> List[Challenge]:
         try:
+            cache_key = f"gamification:challenges:{student_id}:{self._fingerprint([progress.dict(), [ach.dict() for ach in achievements]])}"
+            cached = await self.state.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Using cached challenges for student {student_id}")
+                return [Challenge(**chl) for chl in cached]
+
             system_message = """
             You are an AI expert in creating educational challenges. Your task is to generate personalized, engaging challenges for a student based on their current progress and available achievements.
             """
@@ -171,9 +188,10 @@ class GamificationSystem:
             response = await self.ai_api.chat_completion([
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_prompt}
-            ])
+            ], feature="gamification.personalized_challenges")
             
             challenges = [Challenge(**chl) for chl in json.loads(response['choices'][0]['message']['content'])]
+            await self.state.set(cache_key, [chl.dict() for chl in challenges], ttl=self.cache_ttl)
             self.logger.info(f"Generated personalized challenges for student {student_id}")
             return challenges
         except Exception as e:
@@ -223,7 +241,7 @@ class GamificationSystem:
             response = await self.ai_api.chat_completion([
                 {"role": "system", "content": system_message},
                 {"role": "user", "content": user_prompt}
-            ])
+            ], feature="gamification.engagement_score")
             
             result = json.loads(response['choices'][0]['message']['content'])
             engagement_score = result['final_score']
@@ -0,0 +1,122 @@
+# ai71/http_pool.py
+"""
+Shared, long-lived aiohttp session for outbound HTTP calls.
+
+One `HTTPSessionPool` is created per worker and started from the application startup hook, so
+requests to upstream providers reuse pooled keep-alive connections instead of paying a fresh
+TCP + TLS handshake per call. Connector limits are configurable through environment variables.
+"""
+
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPSessionPool:
+    """
+    Owns a single aiohttp.ClientSession and its TCPConnector.
+
+    Args:
+        limit (int): Maximum number of simultaneous connections across all hosts.
+        limit_per_host (int): Maximum number of simultaneous connections to a single host.
+        ttl_dns_cache (int): Seconds to cache DNS lookups.
+        keepalive_timeout (float): Seconds an idle connection is kept open for reuse.
+        total_timeout (float): Overall timeout of a single request, in seconds.
+        connect_timeout (float): Timeout for acquiring and establishing a connection, in seconds.
+    """
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 30.0, total_timeout: float = 120.0, connect_timeout: float = 10.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.sessions_created = 0
+        self.requests = registry.counter("http_pool_requests_total", "Outbound HTTP requests sent through the shared session")
+
+    @classmethod
+    def from_env(cls) -> "HTTPSessionPool":
+        return cls(
+            limit=int(os.getenv("HTTP_POOL_LIMIT", "100")),
+            limit_per_host=int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20")),
+            ttl_dns_cache=int(os.getenv("HTTP_POOL_DNS_TTL", "300")),
+            keepalive_timeout=float(os.getenv("HTTP_POOL_KEEPALIVE_TIMEOUT", "30")),
+            total_timeout=float(os.getenv("HTTP_POOL_TOTAL_TIMEOUT", "120")),
+            connect_timeout=float(os.getenv("HTTP_POOL_CONNECT_TIMEOUT", "10")),
+        )
+
+    async def start(self) -> aiohttp.ClientSession:
+        # No await between the check and the assignment, so concurrent callers cannot create two sessions
+        if self._session is None or self._session.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=self._connector, timeout=self.timeout)
+            self.sessions_created += 1
+            logger.info(f"Started shared HTTP session (limit={self.limit}, limit_per_host={self.limit_per_host})")
+        return self._session
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        # Lazily start the session for scripts and tests that skip the app startup hook
+        if self._session is None or self._session.closed:
+            return await self.start()
+        return self._session
+
+    def request(self, method: str, url: str, **kwargs):
+        """Returns an async context manager for a request on the shared session."""
+        return _PooledRequest(self, method, url, kwargs)
+
+    async def close(self):
+        session, self._session, self._connector = self._session, None, None
+        if session is not None and not session.closed:
+            await session.close()
+            logger.info("Closed shared HTTP session")
+
+    def stats(self) -> Dict[str, Any]:
+        connector = self._connector
+        if connector is None or connector.closed:
+            return {"open": False, "sessions_created": self.sessions_created}
+        idle = sum(len(conns) for conns in connector._conns.values())
+        return {
+            "open": True,
+            "sessions_created": self.sessions_created,
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+            "acquired": len(connector._acquired),
+            "idle": idle,
+            "hosts": len(connector._conns),
+            "requests": sum(value["value"] for value in self.requests.snapshot()["values"]),
+        }
+
+
+class _PooledRequest:
+    def __init__(self, pool: HTTPSessionPool, method: str, url: str, kwargs: Dict[str, Any]):
+        self.pool = pool
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self._context = None
+
+    async def __aenter__(self) -> aiohttp.ClientResponse:
+        session = await self.pool.get_session()
+        self.pool.requests.inc(method=self.method)
+        self._context = session.request(self.method, self.url, **self.kwargs)
+        return await self._context.__aenter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await self._context.__aexit__(exc_type, exc, tb)
+
+
+http_pool = HTTPSessionPool.from_env()
+registry.gauge("http_pool", "Connection statistics of the shared outbound HTTP session", callback=http_pool.stats)
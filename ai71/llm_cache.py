@@ -0,0 +1,124 @@
+# ai71/llm_cache.py
+"""
+Exact-match cache for LLM chat completions.
+
+Keys are a hash of the provider, model, normalized messages and sampling parameters, so the same
+prompt sent twice (modulo whitespace in the templates) is answered from the cache. Entries live in
+an in-process LRU with TTL and, when a Redis client is attached, in a shared Redis tier that other
+workers can read.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_content(content: Any) -> Any:
+    # Prompt templates are indented triple-quoted strings; whitespace differences do not change the prompt
+    if isinstance(content, str):
+        return " ".join(content.split())
+    return content
+
+
+class LLMResponseCache:
+    """
+    Args:
+        max_entries (int): Maximum number of responses kept in process.
+        ttl (float): Seconds a cached response stays valid, locally and in Redis.
+        namespace (str): Prefix of the Redis keys.
+        enabled (bool): When False every lookup is a miss and nothing is stored.
+
+    Cached responses are shared between callers and must be treated as read-only.
+    """
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, namespace: str = "llmcache", enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.namespace = namespace
+        self.enabled = enabled
+        self.redis = None
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lookups = registry.counter("llm_cache_lookups_total", "LLM response cache lookups by result")
+        self._stores = registry.counter("llm_cache_stores_total", "Responses written to the LLM response cache")
+        self._evictions = registry.counter("llm_cache_evictions_total", "Responses evicted from the in-process LLM cache")
+        registry.gauge("llm_cache_entries", "Responses held in the in-process LLM cache", callback=lambda: len(self._entries))
+
+    @classmethod
+    def from_env(cls) -> "LLMResponseCache":
+        return cls(
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+            enabled=os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"),
+        )
+
+    def attach_redis(self, client):
+        """Enables the shared tier on a `redis.asyncio` client."""
+        self.redis = client
+
+    def make_key(self, provider: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        normalized = {
+            "provider": provider,
+            "model": model,
+            "messages": [{"role": m.get("role"), "content": _normalize_content(m.get("content"))} for m in messages],
+            "params": params,
+        }
+        digest = hashlib.sha256(json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(self, key: str, provider: str = "") -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._lookups.inc(provider=provider, result="hit_local")
+                return value
+            del self._entries[key]
+
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(f"{self.namespace}:{key}")
+            except Exception as e:
+                logger.warning(f"LLM cache Redis lookup failed: {str(e)}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._store_local(key, value)
+                self._lookups.inc(provider=provider, result="hit_redis")
+                return value
+
+        self._lookups.inc(provider=provider, result="miss")
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any], provider: str = ""):
+        if not self.enabled:
+            return
+        self._store_local(key, value)
+        self._stores.inc(provider=provider)
+        if self.redis is not None:
+            try:
+                await self.redis.set(f"{self.namespace}:{key}", json.dumps(value, default=str), ex=int(self.ttl))
+            except Exception as e:
+                logger.warning(f"LLM cache Redis write failed: {str(e)}")
+
+    def _store_local(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions.inc()
+
+    def clear(self):
+        self._entries.clear()
+
+
+llm_cache = LLMResponseCache.from_env()
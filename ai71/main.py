@@ -1,24 +1,41 @@
 # ai71/main.py
 
-from fastapi import FastAPI, HTTPException, Depends, Body
+from fastapi import FastAPI, HTTPException, Depends, Body, Query, Request, Response, Header
+from fastapi.routing import APIRoute
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional
 import logging
 import logging.config
+import os
 import json
+import math
+import asyncio
 import redis.asyncio as redis
-from .dialogue_management.manager import DialogueManager
-from .api import AI71API, OpenAIAPI
+from .startup import ComponentRegistry, env_flag, startup_profiler
+from .http_pool import http_pool
+from .transcript import transcript_writer
+from .llm_cache import llm_cache
+from .state_backend import state_backend
+from .rate_limits import enforce_rate_limit, rate_limiter
+from .bulk_ingest import ENTITIES as BULK_ENTITIES, bulk_ingester, read_items
+from .user_provisioning import UserConflictError, user_provisioner
+from .sse import format_sse
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, keyset, stream_ndjson
+from .queries import user_achievement_response, user_achievements_query
+from .curriculum.cache import curriculum_cache, not_modified
+from .metrics import registry as metrics_registry
+from .admission import admission_controller
+from .resilience import breaker_stats
+from .usage import TemplateOrder, llm_endpoint, usage_tracker
+from .exceptions import RateLimitedError, UpstreamUnavailableError
 from .database import (
-    SessionLocal, init_db, Curriculum, User, UserProfile, Achievement,
-    UserAchievement, UserEngagement, Environment, Recommendation
+    AsyncSessionLocal, init_db_async, Curriculum, User, UserProfile, Achievement,
+    UserAchievement, UserEngagement, Environment, Recommendation, dialect_insert
 )
-from .gamification.system import GamificationSystem
-from .peer_matching.matcher import PeerMatcher
-from .academica.environment_generator import Academica
 from .models import (
     CurriculumData, CurriculumOptimizationInput, ChallengeRequest,
     UserProfileCreate, UserProfileResponse, AchievementCreate,
@@ -27,8 +44,6 @@ from .models import (
     PeerMatchingRequest, EnvironmentGenerationRequest, ImageGenerationRequest,
     EnvironmentCreate, Environment as EnvironmentModel, AITutorRequest
 )
-from .recommender_system.recommender import ResourceRecommender
-from .element_lab.element_gen import JSElementGenerator
 from datetime import datetime
 
 
@@ -66,7 +81,91 @@ log_config = {
 logging.config.dictConfig(log_config)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+class UsageAttributedRoute(APIRoute):
+    """Tags every LLM call made while handling a request with the route's path template."""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        path = self.path
+
+        async def attributed_handler(request):
+            # Not reset afterwards: streamed bodies run after the handler returns and must still see it
+            llm_endpoint.set(path)
+            return await handler(request)
+
+        return attributed_handler
+
+# Components are built on first use, or in parallel by the lifespan (see KODA_COMPONENT_STARTUP)
+components = ComponentRegistry(__package__)
+dialogue_manager = components.register("dialogue_manager", ".dialogue_management.manager:DialogueManager")
+ai71_api = components.register("ai71_api", ".api:AI71API")
+openai_api = components.register("openai_api", ".api:OpenAIAPI")
+gamification_system = components.register("gamification_system", ".gamification.system:GamificationSystem")
+peer_matcher = components.register("peer_matcher", ".peer_matching.matcher:PeerMatcher")
+academica = components.register("academica", ".academica.environment_generator:Academica")
+resource_recommender = components.register("resource_recommender", ".recommender_system.recommender:ResourceRecommender")
+element_generator = components.register("element_generator", ".element_lab.element_gen:JSElementGenerator")
+
+def uses(*names: str):
+    """
+    Route dependency naming the components a handler uses. They are built, or awaited while a warm-up
+    thread builds them, off the event loop; touching an unbuilt component from a handler would block it.
+    """
+    async def dependency():
+        await components.ready(*names)
+    return dependency
+
+def log_warm_up(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Component warm-up failed, failed components are built on first use: {str(task.exception())}")
+
+async def init_rate_limiting():
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
+    r = await redis.from_url(redis_url, encoding="utf-8", decode_responses=True)
+    rate_limiter.attach_redis(r)
+    llm_cache.attach_redis(r)
+    state_backend.attach_redis(r)
+
+async def timed(name: str, awaitable):
+    with startup_profiler.phase(name):
+        return await awaitable
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup work runs concurrently. Settings:
+
+    - KODA_SKIP_SCHEMA_CHECK=true skips the `create_all` round trip, e.g. when migrations run separately.
+    - KODA_COMPONENT_STARTUP selects how service components are built: `background` (default) serves
+      immediately and builds them in parallel threads, `eager` waits for that before serving, `lazy`
+      builds each one on first use.
+    """
+    mode = os.getenv("KODA_COMPONENT_STARTUP", "background").lower()
+    warm_up = None
+    with startup_profiler.phase("lifespan_startup"):
+        tasks = [timed("rate_limiting", init_rate_limiting()), timed("http_pool", http_pool.start())]
+        if not env_flag("KODA_SKIP_SCHEMA_CHECK"):
+            tasks.append(timed("schema_check", init_db_async()))
+        if mode == "eager":
+            tasks.append(timed("components", components.start()))
+        await asyncio.gather(*tasks)
+        if mode == "background":
+            warm_up = asyncio.create_task(timed("components", components.start()))
+            warm_up.add_done_callback(log_warm_up)
+    if startup_profiler.profiling_imports:
+        startup_profiler.log_report()
+
+    yield
+
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    await http_pool.close()
+    await components.close()
+    await asyncio.to_thread(transcript_writer.close)
+
+# Every route is charged against the caller's rate limit budget; see rate_limits.DEFAULT_COSTS
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(enforce_rate_limit)])
+app.router.route_class = UsageAttributedRoute
 
 # CORS middleware setup
 app.add_middleware(
@@ -75,43 +174,55 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified", "Retry-After"],
 )
 
-# Initialize components
-dialogue_manager = DialogueManager()
-ai71_api = AI71API()
-openai_api = OpenAIAPI()
-gamification_system = GamificationSystem()
-peer_matcher = PeerMatcher()
-academica = Academica()
-resource_recommender = ResourceRecommender()
-element_generator = JSElementGenerator()
-
-# Initialize rate limiting
-@app.on_event("startup")
-async def startup():
-    redis_url = "redis://localhost:6379"
-    r = await redis.from_url(redis_url, encoding="utf-8", decode_responses=True)
-    await FastAPILimiter.init(r)
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_handler(request, exc: UpstreamUnavailableError):
+    headers = {"Retry-After": str(int(exc.retry_after))} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_handler(request, exc: RateLimitedError):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(math.ceil(exc.retry_after))})
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
-
-# Initialize the database
-init_db()
 
 @app.get("/")
 async def root():
     logger.info("Root endpoint accessed")
     return {"message": "Welcome to the KodaWorld API"}
 
+@app.get("/api/metrics")
+async def get_metrics():
+    return metrics_registry.snapshot()
+
+@app.get("/api/debug/http-pool")
+async def get_http_pool_stats():
+    return http_pool.stats()
+
+@app.get("/api/debug/admission")
+async def get_admission_stats():
+    return admission_controller.stats()
+
+@app.get("/api/debug/circuit-breakers")
+async def get_circuit_breakers():
+    return breaker_stats()
+
+@app.get("/api/debug/startup")
+async def get_startup_profile(top: int = 25):
+    return {**startup_profiler.report(top), "components": {name: components.is_started(name) for name in components.names}}
+
+@app.get("/api/debug/prompt-costs")
+async def get_prompt_costs(limit: int = 20, order_by: TemplateOrder = "total_tokens"):
+    """Prompt templates ranked by tokens spent (or another numeric field, e.g. `max_prompt_tokens`; anything else is a 422)."""
+    return {"templates": usage_tracker.top_templates(limit, order_by)}
+
 # @app.post("/api/ai-tutor")
-# async def ai_tutor(request: AITutorRequest, db: Session = Depends(get_db)):
+# async def ai_tutor(request: AITutorRequest, db: AsyncSession = Depends(get_db)):
 #     try:
 #         user = None
 #         if request.id:
@@ -145,7 +256,7 @@ async def root():
 #         raise HTTPException(status_code=500, detail="An error occurred while processing your request")
 
 # @app.post("/api/ai-tutor")
-# async def ai_tutor(request: AITutorRequest, db: Session = Depends(get_db)):
+# async def ai_tutor(request: AITutorRequest, db: AsyncSession = Depends(get_db)):
 #     try:
 #         logger.info(f"Received AI tutor request: {request}")
         
@@ -178,74 +289,123 @@ async def root():
 
 
 
+async def tutor_context(request: AITutorRequest) -> List[Dict[str, str]]:
+    """Provisions the student while their conversation memory is read; returns the LLM context."""
+    # The persona is only written once provisioning succeeded, so a 409 leaves memory untouched
+    try:
+        return await ai71_api.memory_messages(str(request.id), request.character, request.systemPrompt,
+                                              alongside=user_provisioner.ensure(str(request.id), request.username, request.email))
+    except UserConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/api/ai-tutor/stream", dependencies=[Depends(uses("ai71_api", "dialogue_manager"))])
+async def ai_tutor_stream(request: AITutorRequest, db: AsyncSession = Depends(get_db)):
+    """Streams the tutor reply as server-sent events: `message` events carry token deltas and a final
+    `done` event carries the persona-processed response once the stream completes."""
+    logger.info(f"Received streaming AI tutor request: {request}")
+
+    messages = await tutor_context(request)
+
+    async def event_stream():
+        parts = []
+        try:
+            async for chunk in ai71_api.stream_with_memory(
+                request.message,
+                model="falcon-180b",
+                messages=messages,
+                student_id=str(request.id),
+                character=request.character,
+                system_prompt=request.systemPrompt,
+                feature="ai_tutor.stream",
+            ):
+                delta = chunk['choices'][0]['delta'].get('content') if chunk.get('choices') else None
+                if delta:
+                    parts.append(delta)
+                    yield format_sse(json.dumps({"delta": delta}))
+
+            await dialogue_manager.record_user_input(request.message, str(request.id), request.character)
+            character_response = await dialogue_manager.process_ai_response("".join(parts), str(request.id), request.character)
+            yield format_sse(json.dumps({"response": character_response}), event="done")
+        except UpstreamUnavailableError as e:
+            # Headers are already sent, so the 503 and its Retry-After travel in the error event
+            yield format_sse(json.dumps({"error": str(e), "status": 503, "retryAfter": e.retry_after}), event="error")
+        except Exception as e:
+            logger.exception(f"Error in streaming AI tutor: {str(e)}")
+            yield format_sse(json.dumps({"error": "An error occurred while processing your request"}), event="error")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # @app.get("/api/conversation-history/{student_id}/{character}")
-# async def get_conversation_history(student_id: str, character: str, db: Session = Depends(get_db)):
+# async def get_conversation_history(student_id: str, character: str, db: AsyncSession = Depends(get_db)):
 #     history = await dialogue_manager.get_conversation_history(student_id, character)
 #     return {"history": history}
 
 ##### THIS IS FOR DB RETRIEVE, ABOVE
 
-@app.post("/api/ai-tutor")
-async def ai_tutor(request: AITutorRequest, db: Session = Depends(get_db)):
+@app.post("/api/ai-tutor", dependencies=[Depends(uses("ai71_api", "dialogue_manager"))])
+async def ai_tutor(request: AITutorRequest, db: AsyncSession = Depends(get_db)):
     try:
         logger.info(f"Received AI tutor request: {request}")
         
-        # Check if user exists, if not, create a new user
-        user = db.query(User).filter(User.id == request.id).first()
-        if not user:
-            logger.info(f"User not found, creating new user with id: {request.id}")
-            user = User(id=request.id, username=request.username, email=request.email, created_at=datetime.utcnow())
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        history = await dialogue_manager.get_conversation_history(str(request.id), db)
-        
-        context = [
-            {"role": "system", "content": request.systemPrompt},
-            *[{"role": "user" if msg.is_user else "assistant", "content": msg.content} for msg in history],
-            {"role": "user", "content": request.message}
-        ]
-        
-        ai_response = await ai71_api.generate_with_memory(request.message, model="falcon-180b", messages=context)
+        # The token-budgeted memory of this student and character supplies the LLM context
+        messages = await tutor_context(request)
+        ai_response = await ai71_api.generate_with_memory(
+            request.message,
+            model="falcon-180b",
+            messages=messages,
+            student_id=str(request.id),
+            character=request.character,
+            system_prompt=request.systemPrompt,
+            feature="ai_tutor",
+        )
         
+        await dialogue_manager.record_user_input(request.message, str(request.id), request.character)
         character_response = await dialogue_manager.process_ai_response(ai_response, str(request.id), request.character)
-        await dialogue_manager.process_user_input(request.message, str(request.id), request.character)
         
         return {"response": character_response}
+    except (UpstreamUnavailableError, HTTPException):
+        raise
     except Exception as e:
         logger.exception(f"Error in AI tutor: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while processing your request")
 
-@app.get("/api/conversation-history/{student_id}/{character}")
-async def get_conversation_history(student_id: str, character: str, db: Session = Depends(get_db)):
-    history = await dialogue_manager.get_conversation_history(student_id, character)
-    return {"history": history}
-
-@app.post("/api/clear-history/{student_id}/{character}")
-async def clear_conversation_history(student_id: str, character: str, db: Session = Depends(get_db)):
-    await dialogue_manager.clear_history(student_id, character, db)
-    await ai71_api.clear_memory()
+@app.get("/api/conversation-history/{student_id}/{character}", dependencies=[Depends(uses("dialogue_manager"))])
+async def get_conversation_history(student_id: str, character: str, limit: Optional[int] = Query(None, ge=1, le=500),
+                                   before: Optional[str] = None):
+    """Latest turns, oldest first. Pass the returned `next_cursor` as `before` to page further back."""
+    try:
+        return await dialogue_manager.history.page(student_id, character, limit, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/clear-history/{student_id}/{character}", dependencies=[Depends(uses("dialogue_manager", "ai71_api"))])
+async def clear_conversation_history(student_id: str, character: str, db: AsyncSession = Depends(get_db)):
+    await dialogue_manager.clear_history(student_id, character)
+    await ai71_api.clear_memory(student_id, character)
     return {"message": "Conversation history cleared successfully"}
 
-@app.post("/api/collect-feedback/{student_id}")
-async def collect_student_feedback(student_id: str, feedback: str = Body(...), db: Session = Depends(get_db)):
-    await dialogue_manager.collect_feedback(student_id, feedback, db)
+@app.post("/api/collect-feedback/{student_id}", dependencies=[Depends(uses("dialogue_manager"))])
+async def collect_student_feedback(student_id: str, feedback: str = Body(...), db: AsyncSession = Depends(get_db)):
+    await dialogue_manager.collect_feedback(student_id, feedback)
     return {"message": "Feedback collected successfully"}
 
-@app.get("/api/learning-progress/{student_id}")
-async def get_learning_progress(student_id: str, db: Session = Depends(get_db)):
+@app.get("/api/learning-progress/{student_id}", dependencies=[Depends(uses("dialogue_manager"))])
+async def get_learning_progress(student_id: str, db: AsyncSession = Depends(get_db)):
     progress = await dialogue_manager.analyze_learning_progress(student_id, db)
     return {"progress": progress}
 
-@app.get("/api/next-steps/{student_id}")
-async def get_next_steps(student_id: str, db: Session = Depends(get_db)):
+@app.get("/api/next-steps/{student_id}", dependencies=[Depends(uses("dialogue_manager"))])
+async def get_next_steps(student_id: str, db: AsyncSession = Depends(get_db)):
     next_steps = await dialogue_manager.recommend_next_steps(student_id, db)
     return {"nextSteps": next_steps}
 
-@app.post("/api/optimize-curriculum")
-@app.post("/api/optimize-curriculum")
-async def optimize_curriculum(input_data: CurriculumOptimizationInput, db: Session = Depends(get_db)):
+@app.post("/api/optimize-curriculum", dependencies=[Depends(uses("dialogue_manager"))])
+@app.post("/api/optimize-curriculum", dependencies=[Depends(uses("dialogue_manager"))])
+async def optimize_curriculum(input_data: CurriculumOptimizationInput, db: AsyncSession = Depends(get_db)):
     try:
         result = await dialogue_manager.optimize_curriculum(
             current_curriculum=input_data.current_curriculum.dict(),
@@ -254,62 +414,73 @@ async def optimize_curriculum(input_data: CurriculumOptimizationInput, db: Sessi
             db=db
         )
         return result
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
     
 @app.get("/api/curriculum/{curriculum_id}")
-async def get_curriculum(curriculum_id: str, db: Session = Depends(get_db)):
+async def get_curriculum(curriculum_id: str, if_none_match: Optional[str] = Header(None),
+                         if_modified_since: Optional[str] = Header(None)):
+    """Served from the curriculum cache as pre-serialized JSON; conditional requests get a 304."""
     if curriculum_id == 'latest':
-        curriculum = db.query(Curriculum).order_by(Curriculum.id.desc()).first()
+        curriculum = await curriculum_cache.latest()
     else:
-        curriculum = db.query(Curriculum).filter(Curriculum.id == curriculum_id).first()
+        curriculum = await curriculum_cache.get(int(curriculum_id)) if curriculum_id.isdigit() else None
     
     if not curriculum:
         raise HTTPException(status_code=404, detail="Curriculum not found")
     
-    return {"curriculum": json.loads(curriculum.curriculum)}
-
-@app.post("/api/generate-achievements")
-async def generate_achievements(curriculum: CurriculumData, db: Session = Depends(get_db)):
+    # "latest" moves with every write, so clients always revalidate; a 304 costs no body
+    headers = {**curriculum.headers, "Cache-Control": "no-cache"}
+    if not_modified(curriculum, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+    return Response(content=curriculum.body, media_type="application/json", headers=headers)
+
+@app.post("/api/generate-achievements", dependencies=[Depends(uses("gamification_system"))])
+async def generate_achievements(curriculum: CurriculumData, db: AsyncSession = Depends(get_db)):
     achievement_system = await gamification_system.generate_achievement_system(curriculum.dict(), db)
     return {"achievementSystem": achievement_system}
 
-@app.post("/api/update-achievements/{student_id}")
-async def update_achievements(student_id: str, progress: Dict[str, float], db: Session = Depends(get_db)):
+@app.post("/api/update-achievements/{student_id}", dependencies=[Depends(uses("gamification_system"))])
+async def update_achievements(student_id: str, progress: Dict[str, float], db: AsyncSession = Depends(get_db)):
     updates = await gamification_system.update_student_achievements(student_id, progress, db)
     return {"achievementUpdates": updates}
 
-@app.post("/api/generate-challenges/{student_id}")
-async def generate_challenges(student_id: str, db: Session = Depends(get_db)):
+@app.post("/api/generate-challenges/{student_id}", dependencies=[Depends(uses("gamification_system"))])
+async def generate_challenges(student_id: str, db: AsyncSession = Depends(get_db)):
     challenges = await gamification_system.generate_personalized_challenges(student_id, db)
     return {"challenges": challenges}
 
-@app.post("/api/calculate-engagement/{student_id}")
-async def calculate_engagement(student_id: str, activity_log: List[Dict], db: Session = Depends(get_db)):
+@app.post("/api/calculate-engagement/{student_id}", dependencies=[Depends(uses("gamification_system"))])
+async def calculate_engagement(student_id: str, activity_log: List[Dict], db: AsyncSession = Depends(get_db)):
     engagement_score = await gamification_system.calculate_engagement_score(student_id, activity_log, db)
     return {"engagementScore": engagement_score}
 
-@app.post("/api/match-peers")
-async def match_peers(request: PeerMatchingRequest, db: Session = Depends(get_db)):
-    matches = await peer_matcher.find_optimal_matches(request.users, request.group_size, db)
-    return {"matches": matches}
+@app.post("/api/match-peers", dependencies=[Depends(uses("peer_matcher"))])
+async def match_peers(request: PeerMatchingRequest):
+    # The optimization runs in the peer matcher's process pool, so the event loop keeps serving
+    matches, score = await peer_matcher.find_optimal_matches(request.users, request.group_size, request.seed)
+    return {"matches": matches, "score": score}
 
-@app.post("/api/generate-environment")
-async def generate_environment(request: EnvironmentGenerationRequest, db: Session = Depends(get_db)):
-    environment = await academica.generate_environment(request.topic, request.complexity, db)
+@app.post("/api/generate-environment", dependencies=[Depends(uses("academica"))])
+async def generate_environment(request: EnvironmentGenerationRequest, db: AsyncSession = Depends(get_db)):
+    environment = await academica.generate_environment(request.topic, request.complexity)
     return {"environment": environment}
 
-@app.post("/api/generate-challenge")
-async def generate_challenge(request: ChallengeRequest, db: Session = Depends(get_db)):
+@app.post("/api/generate-challenge", dependencies=[Depends(uses("academica"))])
+async def generate_challenge(request: ChallengeRequest, db: AsyncSession = Depends(get_db)):
     try:
-        challenge = await academica.generate_challenge(request.environment, request.difficulty, db)
+        challenge = await academica.generate_challenge(request.environment, request.difficulty)
         return {"challenge": challenge}
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error generating challenge: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to generate challenge")
 
-@app.post("/api/generate-image")
+@app.post("/api/generate-image", dependencies=[Depends(uses("openai_api"))])
 async def generate_image(request: ImageGenerationRequest):
     try:
         response = await openai_api.create_image(
@@ -319,28 +490,32 @@ async def generate_image(request: ImageGenerationRequest):
             n=request.n
         )
         return response
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error in image generation: {str(e)}")
         raise HTTPException(status_code=500, detail="An error occurred while generating the image")
 
-@app.post("/api/generate-environment-with-image")
-async def generate_environment_with_image(request: EnvironmentGenerationRequest, db: Session = Depends(get_db)):
+@app.post("/api/generate-environment-with-image", dependencies=[Depends(uses("academica", "openai_api"))])
+async def generate_environment_with_image(request: EnvironmentGenerationRequest, db: AsyncSession = Depends(get_db)):
     try:
-        environment = await academica.generate_environment(request.topic, request.complexity, db)
+        environment = await academica.generate_environment(request.topic, request.complexity)
         
         image_prompt = f"An educational environment for {request.topic} at {request.complexity} level: {environment.description}"
         image_response = await openai_api.create_image(prompt=image_prompt)
         
         environment.image_url = image_response['data'][0]['url']
         db.add(environment)
-        db.commit()
+        await db.commit()
         return {"environment": environment}
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error generating environment with image: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to generate environment with image")
 
-@app.post("/api/generate-achievement-badge")
-async def generate_achievement_badge(achievement: AchievementCreate, db: Session = Depends(get_db)):
+@app.post("/api/generate-achievement-badge", dependencies=[Depends(uses("openai_api"))])
+async def generate_achievement_badge(achievement: AchievementCreate, db: AsyncSession = Depends(get_db)):
     try:
         badge_prompt = f"An achievement badge for '{achievement.name}': {achievement.description}"
         badge_response = await openai_api.create_image(
@@ -350,26 +525,28 @@ async def generate_achievement_badge(achievement: AchievementCreate, db: Session
         )
         achievement_db = Achievement(**achievement.dict(), badge_url=badge_response['data'][0]['url'])
         db.add(achievement_db)
-        db.commit()
+        await db.commit()
         return {"badge_url": badge_response['data'][0]['url']}
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error generating achievement badge: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to generate achievement badge")
     
-@app.post("/api/recommend-resources")
-async def api_recommend_resources(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+@app.post("/api/recommend-resources", dependencies=[Depends(uses("resource_recommender"))])
+async def api_recommend_resources(user_id: str, db: AsyncSession = Depends(get_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user_profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+    user_profile = (await db.execute(select(UserProfile).filter(UserProfile.user_id == user_id))).scalars().first()
     if not user_profile:
         raise HTTPException(status_code=404, detail="User profile not found")
 
     recommendations = await resource_recommender.recommend_resources(user, user_profile, db)
     return {"resources": recommendations}
 
-@app.post("/api/generate-element")
+@app.post("/api/generate-element", dependencies=[Depends(uses("element_generator"))])
 async def generate_element(element_type: str, params: Dict[str, Any]):
     if element_type == "button":
         return await element_generator.generate_button(**params)
@@ -381,127 +558,169 @@ async def generate_element(element_type: str, params: Dict[str, Any]):
         raise HTTPException(status_code=400, detail="Unsupported element type")
 
 @app.post("/api/user")
-async def create_user(user: UserModel, db: Session = Depends(get_db)):
+async def create_user(user: UserModel, db: AsyncSession = Depends(get_db)):
     db_user = User(**user.dict())
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.get("/api/user/{user_id}")
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    user = await db.get(User, str(user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @app.post("/api/user-profile")
-async def create_user_profile(profile: UserProfileCreate, db: Session = Depends(get_db)):
+async def create_user_profile(profile: UserProfileCreate, db: AsyncSession = Depends(get_db)):
     db_profile = UserProfile(**profile.dict())
     db.add(db_profile)
-    db.commit()
-    db.refresh(db_profile)
+    await db.commit()
+    await db.refresh(db_profile)
     return UserProfileResponse.from_orm(db_profile)
 
 @app.get("/api/user-profile/{user_id}")
-async def get_user_profile(user_id: int, db: Session = Depends(get_db)):
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+async def get_user_profile(user_id: int, db: AsyncSession = Depends(get_db)):
+    profile = (await db.execute(select(UserProfile).filter(UserProfile.user_id == user_id))).scalars().first()
     if not profile:
         raise HTTPException(status_code=404, detail="User profile not found")
     return UserProfileResponse.from_orm(profile)
 
+async def list_rows(db: AsyncSession, response: Response, query, sort_column, id_column, to_response, limit: Optional[int],
+                    cursor: Optional[str], stream: bool, scalars: bool = True):
+    """
+    Newest-first page of `query`, with the next page's cursor in the X-Next-Cursor header. With
+    `stream=true` the rows after `cursor` (all of them unless `limit` is given) are sent as NDJSON.
+    `to_response` turns a row into its response model.
+    """
+    try:
+        if stream:
+            query = keyset(query, sort_column, id_column, cursor)
+            if limit is not None:
+                query = query.limit(limit)
+            serialize = lambda row: to_response(row).model_dump_json()
+            return StreamingResponse(stream_ndjson(AsyncSessionLocal, query, serialize, scalars=scalars), media_type="application/x-ndjson")
+        rows, next_cursor = await fetch_page(db, query, sort_column, id_column, limit or DEFAULT_PAGE_SIZE, cursor, scalars=scalars)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [to_response(row) for row in rows]
+
 @app.post("/api/user-engagement")
 @app.get("/api/user-engagement/{user_id}")
-async def get_user_engagement(user_id: int, db: Session = Depends(get_db)):
-    engagements = db.query(UserEngagement).filter(UserEngagement.user_id == user_id).all()
-    return [UserEngagementResponse.from_orm(engagement) for engagement in engagements]
+async def get_user_engagement(user_id: int, response: Response, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                              cursor: Optional[str] = None, stream: bool = False, db: AsyncSession = Depends(get_db)):
+    query = select(UserEngagement).filter(UserEngagement.user_id == user_id)
+    return await list_rows(db, response, query, UserEngagement.timestamp, UserEngagement.id, UserEngagementResponse.from_orm, limit, cursor, stream)
 
 @app.post("/api/user-achievement")
-async def create_user_achievement(achievement: UserAchievementResponse, db: Session = Depends(get_db)):
-    db_achievement = UserAchievement(**achievement.dict())
-    db.add(db_achievement)
-    db.commit()
-    db.refresh(db_achievement)
-    return UserAchievementResponse.from_orm(db_achievement)
+async def create_user_achievement(achievement: UserAchievementResponse, db: AsyncSession = Depends(get_db)):
+    # An achievement is unlocked once per user: repeating the request returns the original unlock
+    stmt = dialect_insert(UserAchievement.__table__, db.bind.dialect.name).values(
+        user_id=achievement.user_id, achievement_id=achievement.achievement.id, unlocked_at=achievement.unlocked_at,
+    ).on_conflict_do_nothing(index_elements=["user_id", "achievement_id"])
+    await db.execute(stmt)
+    await db.commit()
+    query = user_achievements_query(achievement.user_id).where(UserAchievement.achievement_id == achievement.achievement.id)
+    return user_achievement_response((await db.execute(query)).one())
 
 @app.get("/api/user-achievement/{user_id}")
-async def get_user_achievements(user_id: int, db: Session = Depends(get_db)):
-    achievements = db.query(UserAchievement).filter(UserAchievement.user_id == user_id).all()
-    return [UserAchievementResponse.from_orm(achievement) for achievement in achievements]
+async def get_user_achievements(user_id: int, response: Response, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                                cursor: Optional[str] = None, stream: bool = False, db: AsyncSession = Depends(get_db)):
+    # Joined column projection: one round trip per page whatever the number of achievements
+    return await list_rows(db, response, user_achievements_query(user_id), UserAchievement.unlocked_at, UserAchievement.id,
+                           user_achievement_response, limit, cursor, stream, scalars=False)
 
 @app.post("/api/recommendation")
-async def create_recommendation(recommendation: RecommendationCreate, db: Session = Depends(get_db)):
+async def create_recommendation(recommendation: RecommendationCreate, db: AsyncSession = Depends(get_db)):
     db_recommendation = Recommendation(**recommendation.dict())
     db.add(db_recommendation)
-    db.commit()
-    db.refresh(db_recommendation)
+    await db.commit()
+    await db.refresh(db_recommendation)
     return RecommendationResponse.from_orm(db_recommendation)
 
 @app.get("/api/recommendation/{user_id}")
-async def get_user_recommendations(user_id: int, db: Session = Depends(get_db)):
-    recommendations = db.query(Recommendation).filter(Recommendation.user_id == user_id).all()
-    return [RecommendationResponse.from_orm(recommendation) for recommendation in recommendations]
-
+async def get_user_recommendations(user_id: int, response: Response, limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                                   cursor: Optional[str] = None, stream: bool = False, db: AsyncSession = Depends(get_db)):
+    query = select(Recommendation).filter(Recommendation.user_id == user_id)
+    return await list_rows(db, response, query, Recommendation.recommended_at, Recommendation.id, RecommendationResponse.from_orm, limit, cursor, stream)
+
+
+@app.post("/api/bulk/{entity}")
+async def bulk_ingest(entity: str, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Upserts users, user-profiles or user-achievements, or appends user-engagements, from a JSON array
+    or an NDJSON body (Content-Type: application/x-ndjson). Returns one result per item.
+    """
+    if entity not in BULK_ENTITIES:
+        raise HTTPException(status_code=404, detail=f"Unknown entity {entity!r}; expected one of {', '.join(BULK_ENTITIES)}")
+    try:
+        return await bulk_ingester.ingest(entity, read_items(request), db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/api/environment", response_model=EnvironmentModel)
-async def create_environment(environment: EnvironmentCreate, db: Session = Depends(get_db)):
+async def create_environment(environment: EnvironmentCreate, db: AsyncSession = Depends(get_db)):
     db_environment = Environment(**environment.dict())
     db.add(db_environment)
-    db.commit()
-    db.refresh(db_environment)
+    await db.commit()
+    await db.refresh(db_environment)
     return EnvironmentModel.from_orm(db_environment)
 
 @app.get("/api/environment/{environment_id}")
-async def get_environment(environment_id: int, db: Session = Depends(get_db)):
-    environment = db.query(Environment).filter(Environment.id == environment_id).first()
+async def get_environment(environment_id: int, db: AsyncSession = Depends(get_db)):
+    environment = await db.get(Environment, environment_id)
     if not environment:
         raise HTTPException(status_code=404, detail="Environment not found")
     return environment
 
 @app.put("/api/user/{user_id}")
-async def update_user(user_id: int, user_update: UserModel, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def update_user(user_id: int, user_update: UserModel, db: AsyncSession = Depends(get_db)):
+    db_user = await db.get(User, str(user_id))
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
     for key, value in user_update.dict(exclude_unset=True).items():
         setattr(db_user, key, value)
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.delete("/api/user/{user_id}")
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_user = await db.get(User, str(user_id))
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
+    user_provisioner.forget(str(user_id))
     return {"message": "User deleted successfully"}
 
 @app.put("/api/user-profile/{user_id}")
-async def update_user_profile(user_id: int, profile_update: UserProfileCreate, db: Session = Depends(get_db)):
-    db_profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+async def update_user_profile(user_id: int, profile_update: UserProfileCreate, db: AsyncSession = Depends(get_db)):
+    db_profile = (await db.execute(select(UserProfile).filter(UserProfile.user_id == user_id))).scalars().first()
     if not db_profile:
         raise HTTPException(status_code=404, detail="User profile not found")
     
     for key, value in profile_update.dict(exclude_unset=True).items():
         setattr(db_profile, key, value)
     
-    db.commit()
-    db.refresh(db_profile)
+    await db.commit()
+    await db.refresh(db_profile)
     return UserProfileResponse.from_orm(db_profile)
 
 @app.delete("/api/user-profile/{user_id}")
-async def delete_user_profile(user_id: int, db: Session = Depends(get_db)):
-    db_profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+async def delete_user_profile(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_profile = (await db.execute(select(UserProfile).filter(UserProfile.user_id == user_id))).scalars().first()
     if not db_profile:
         raise HTTPException(status_code=404, detail="User profile not found")
     
-    db.delete(db_profile)
-    db.commit()
+    await db.delete(db_profile)
+    await db.commit()
     return {"message": "User profile deleted successfully"}
 
 if __name__ == "__main__":
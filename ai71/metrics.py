@@ -0,0 +1,139 @@
+# ai71/metrics.py
+"""
+Lightweight in-process metrics for the KodaWorld backend.
+
+Counters, gauges and histograms are registered on a module-level registry and exposed as JSON
+through the `/api/metrics` endpoint. Metric updates are guarded by a lock so they can be recorded
+from background threads as well as from the event loop.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+        return {"type": "counter", "description": self.description, "values": values}
+
+
+class Gauge:
+    def __init__(self, name: str, description: str, callback: Optional[Callable[[], Any]] = None):
+        self.name = name
+        self.description = description
+        self.callback = callback
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        if self.callback is not None:
+            return {"type": "gauge", "description": self.description, "value": self.callback()}
+        with self._lock:
+            values = [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+        return {"type": "gauge", "description": self.description, "values": values}
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"count": 0, "sum": 0.0, "buckets": [0] * (len(self.buckets) + 1)}
+                self._series[key] = series
+            series["count"] += 1
+            series["sum"] += value
+            series["buckets"][index] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        bounds: List[Any] = list(self.buckets) + ["+Inf"]
+        values = []
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative, running = [], 0
+                for count in series["buckets"]:
+                    running += count
+                    cumulative.append(running)
+                values.append({
+                    "labels": dict(key),
+                    "count": series["count"],
+                    "sum": series["sum"],
+                    "buckets": dict(zip(map(str, bounds), cumulative)),
+                })
+        return {"type": "histogram", "description": self.description, "values": values}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name: str, factory: Callable[[], Any]):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._register(name, lambda: Counter(name, description))
+
+    def gauge(self, name: str, description: str = "", callback: Optional[Callable[[], Any]] = None) -> Gauge:
+        return self._register(name, lambda: Gauge(name, description, callback))
+
+    def histogram(self, name: str, description: str = "", buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(name, lambda: Histogram(name, description, buckets))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+registry = MetricsRegistry()
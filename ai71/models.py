@@ -34,10 +34,16 @@ class UserProfileCreate(BaseModel):
     learning_style: str
     interests: List[str]
 
+class UserProfileBulkItem(UserProfileCreate):
+    user_id: int
+
 class UserProfileResponse(UserProfileCreate):
     id: int
     user_id: int
 
+    class Config:
+        from_attributes = True
+
 class AchievementCreate(BaseModel):
     name: str
     description: str
@@ -47,20 +53,38 @@ class AchievementCreate(BaseModel):
 class AchievementResponse(AchievementCreate):
     id: int
 
+    class Config:
+        from_attributes = True
+
 class UserAchievementResponse(BaseModel):
     id: int
     user_id: int
     achievement: AchievementResponse
     unlocked_at: datetime
 
+    class Config:
+        from_attributes = True
+
+class UserAchievementBulkItem(BaseModel):
+    user_id: int
+    achievement_id: int
+    unlocked_at: Optional[datetime] = None
+
 class UserEngagementCreate(BaseModel):
     engagement_score: float
 
+class UserEngagementBulkItem(UserEngagementCreate):
+    user_id: int
+    timestamp: Optional[datetime] = None
+
 class UserEngagementResponse(UserEngagementCreate):
     id: int
     user_id: int
     timestamp: datetime
 
+    class Config:
+        from_attributes = True
+
 class RecommendationCreate(BaseModel):
     resource_title: str
     resource_url: str
@@ -70,6 +94,9 @@ class RecommendationResponse(RecommendationCreate):
     user_id: int
     recommended_at: datetime
 
+    class Config:
+        from_attributes = True
+
 class CurriculumData(BaseModel):
     character: str
     subject: str
@@ -91,10 +118,14 @@ class CurriculumOptimizationInput(BaseModel):
 class UserProfile(BaseModel):
     id: int
     skills: Dict[str, float] = Field(...)  # Dict of skill names to proficiency levels (0-1)
+    learning_style: str = ""
+    interests: List[str] = []
+    personality_traits: List[str] = []
 
 class PeerMatchingRequest(BaseModel):
     users: List[UserProfile]
     group_size: int = Field(gt=0)
+    seed: Optional[int] = None
 
 class EnvironmentGenerationRequest(BaseModel):
     topic: str
@@ -0,0 +1,68 @@
+# ai71/pagination.py
+"""
+Keyset pagination and NDJSON streaming for per-user list endpoints.
+
+Pages are ordered newest first by (sort column, id). The cursor names the last row of a page, and
+the next page continues strictly after it, so the database seeks through the index instead of
+skipping rows the way OFFSET would. Streaming pulls rows in `yield_per` partitions from a server-side
+cursor and serializes each partition as it arrives, so memory stays bounded by the partition size
+rather than by how much history a user has.
+"""
+
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_YIELD_PER = 500
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    return f"{sort_value.isoformat()}_{row_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    sort_value, _, row_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def keyset(query: Select, sort_column, id_column, cursor: Optional[str] = None) -> Select:
+    """Orders `query` newest first and, given a cursor, keeps only the rows after it."""
+    if cursor is not None:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.where(or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id)))
+    return query.order_by(sort_column.desc(), id_column.desc())
+
+
+async def fetch_page(db: AsyncSession, query: Select, sort_column, id_column, limit: int,
+                     cursor: Optional[str] = None, scalars: bool = True) -> Tuple[List[Any], Optional[str]]:
+    """
+    Returns up to `limit` rows and the cursor of the next page (None on the last page). Pass
+    `scalars=False` for column projections; their rows must include the sort and id columns.
+    """
+    # One extra row tells whether another page exists without a COUNT query
+    result = await db.execute(keyset(query, sort_column, id_column, cursor).limit(limit + 1))
+    rows = (result.scalars() if scalars else result).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+
+
+async def stream_ndjson(session_factory: Callable[[], AsyncSession], query: Select, serialize: Callable[[Any], str],
+                        yield_per: int = STREAM_YIELD_PER, scalars: bool = True) -> AsyncIterator[bytes]:
+    """
+    Yields one newline-terminated JSON document per row. The stream opens its own session because it
+    outlives the request handler, and with it the request's session.
+    """
+    async with session_factory() as db:
+        result = await db.stream(query.execution_options(yield_per=yield_per))
+        async for partition in (result.scalars() if scalars else result).partitions():
+            yield "".join(f"{serialize(row)}\n" for row in partition).encode("utf-8")
@@ -0,0 +1,81 @@
+# ai71/peer_matching/benchmark.py
+"""
+Runtime and score of pair formation (group_size=2) on synthetic cohorts.
+
+Compares `PeerMatcher.monte_carlo_group_formation` with the exact matching of
+`PeerMatcher.pair_formation`. Both score the cohort first, and that time is included in both.
+
+Usage:
+    python -m ai71.peer_matching.benchmark --sizes 100 500 1000 --iterations 1000
+"""
+
+import argparse
+import logging
+import random
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .matcher import PeerMatcher, User
+
+SKILLS = ["math", "programming", "writing", "biology", "art", "history", "music"]
+STYLES = ["visual", "auditory", "kinesthetic", "reading"]
+INTERESTS = ["AI", "robotics", "music", "history", "space", "games", "ecology", "chess", "film", "poetry", "sports"]
+TRAITS = ["creative", "analytical", "outgoing", "curious", "organized", "empathetic", "practical", "calm"]
+
+
+def synthetic_cohort(size: int, seed: int = 0) -> List[User]:
+    rng = random.Random(seed)
+    return [
+        User(
+            id=i,
+            name=f"student{i}",
+            skills={skill: round(rng.random(), 2) for skill in rng.sample(SKILLS, rng.randint(1, 4))},
+            learning_style=rng.choice(STYLES),
+            interests=rng.sample(INTERESTS, rng.randint(1, 5)),
+            personality_traits=rng.sample(TRAITS, rng.randint(1, 3)),
+        )
+        for i in range(size)
+    ]
+
+
+def benchmark_pairing(sizes: Sequence[int], iterations: int = 1000, seed: int = 0) -> List[Dict[str, float]]:
+    matcher = PeerMatcher()
+    rows = []
+    for size in sizes:
+        users = synthetic_cohort(size, seed)
+        np.random.seed(seed)
+        started = time.perf_counter()
+        _, monte_carlo_score = matcher.monte_carlo_group_formation(users, group_size=2, iterations=iterations)
+        monte_carlo_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        _, exact_score = matcher.pair_formation(users)
+        exact_seconds = time.perf_counter() - started
+        rows.append({
+            "size": size,
+            "monte_carlo_score": float(monte_carlo_score),
+            "monte_carlo_seconds": monte_carlo_seconds,
+            "exact_score": exact_score,
+            "exact_seconds": exact_seconds,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Monte Carlo and exact pair formation")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 500, 1000])
+    parser.add_argument("--iterations", type=int, default=1000, help="Monte Carlo iterations")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger("ai71.peer_matching.matcher").setLevel(logging.WARNING)
+
+    print(f"{'students':>8} {'monte carlo':>12} {'seconds':>8} {'exact':>8} {'seconds':>8} {'gain':>7}")
+    for row in benchmark_pairing(args.sizes, args.iterations, args.seed):
+        gain = row["exact_score"] / row["monte_carlo_score"] - 1 if row["monte_carlo_score"] > 0 else float("nan")
+        print(f"{row['size']:>8} {row['monte_carlo_score']:>12.4f} {row['monte_carlo_seconds']:>8.2f} "
+              f"{row['exact_score']:>8.4f} {row['exact_seconds']:>8.2f} {gain:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
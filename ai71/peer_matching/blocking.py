@@ -0,0 +1,158 @@
+# ai71/peer_matching/blocking.py
+"""
+Group formation for cohorts too large for an n x n compatibility matrix.
+
+`HierarchicalGroupOptimizer` works in three stages:
+
+1. Blocking: the cohort is split recursively in two by a balanced 2-means over
+   `CohortEncoding.features`. Each split runs a few Lloyd steps, then cuts the points ordered by how
+   much closer they are to one center than to the other, so that the first part holds a whole number
+   of groups. Splitting stops at `bucket_size` students. All buckets but one then hold a multiple of
+   `group_size` students, and only the last group of the cohort can be short.
+2. Each bucket scores its own compatibility matrix and runs the regular optimizer on it, in the
+   process pool when one is given: `SwapOptimizer`, or the exact matching for groups of two.
+3. Repair: students the bucketing placed badly end up in the weakest groups. Those groups are
+   pooled across buckets, up to `repair_size` students, and optimized together from their current
+   grouping, so the repair can only raise the score.
+
+The largest structures are the feature matrix (n rows) and one bucket_size x bucket_size matrix
+per running bucket, so memory grows linearly with the cohort. Blocking costs O(n log n) and the
+buckets O(n * bucket_size), so time grows far slower than with a full matrix.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import Executor
+from itertools import repeat
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from .compatibility import CohortEncoding, compatibility_matrix, group_score
+from .optimizer import GroupingResult, SwapOptimizer, partition_score
+from .pairing import optimal_pairs
+from .parallel import restart_seeds
+
+logger = logging.getLogger(__name__)
+
+
+class BucketResult(NamedTuple):
+    # Groups of indices into the whole cohort, with the score of each group
+    groups: List[List[int]]
+    scores: List[float]
+    iterations: int
+
+
+def optimize_bucket(encoding: CohortEncoding, members: np.ndarray, group_size: int, seed: int,
+                    options: Dict[str, Any]) -> BucketResult:
+    """Runs in a pool worker: groups the students of one bucket, given the encoding of just them."""
+    matrix = compatibility_matrix(encoding)
+    if group_size == 2:
+        result = optimal_pairs(matrix)
+    else:
+        result = SwapOptimizer(**options).optimize(matrix, group_size, seed=seed)
+    return BucketResult([members[group].tolist() for group in result.groups],
+                        [group_score(matrix, group) for group in result.groups], result.iterations)
+
+
+class HierarchicalGroupOptimizer:
+    """
+    Args:
+        bucket_size (int): Most students in one bucket.
+        repair_size (int): Most students of the weakest groups re-optimized together across buckets.
+        split_iterations (int): Lloyd steps of each balanced 2-means split.
+        options (Dict[str, Any]): Keyword arguments of `SwapOptimizer` in each bucket and in the repair.
+    """
+    def __init__(self, bucket_size: int = 1000, repair_size: int = 1000, split_iterations: int = 5,
+                 options: Optional[Dict[str, Any]] = None):
+        self.bucket_size = bucket_size
+        self.repair_size = repair_size
+        self.split_iterations = split_iterations
+        self.options = options or {}
+
+    @classmethod
+    def from_env(cls) -> "HierarchicalGroupOptimizer":
+        return cls(
+            bucket_size=int(os.getenv("PEER_MATCHING_BUCKET_SIZE", "1000")),
+            repair_size=int(os.getenv("PEER_MATCHING_REPAIR_SIZE", "1000")),
+            options={
+                "max_iterations": int(os.getenv("PEER_MATCHING_BUCKET_ITERATIONS", "20000")),
+                "time_budget": float(os.getenv("PEER_MATCHING_BUCKET_TIME_BUDGET", "2")),
+            },
+        )
+
+    def buckets(self, features: np.ndarray, group_size: int, rng: np.random.Generator) -> List[np.ndarray]:
+        """Indices of the students of each bucket; only the last bucket may hold a short group."""
+        limit = max(self.bucket_size, 2 * group_size)
+        pending = [np.arange(len(features))]
+        buckets = []
+        while pending:
+            members = pending.pop()
+            if len(members) <= limit:
+                buckets.append(members)
+                continue
+            points = features[members]
+            # The first part gets half of the whole groups; the second also keeps any remainder
+            cut = group_size * (len(members) // group_size // 2)
+            centers = points[rng.choice(len(points), size=2, replace=False)]
+            for _ in range(self.split_iterations):
+                closer_to_first = points @ (centers[1] - centers[0])
+                order = np.argsort(closer_to_first, kind="stable")
+                centers = np.stack([points[order[:cut]].mean(axis=0), points[order[cut:]].mean(axis=0)])
+            pending += [members[order[cut:]], members[order[:cut]]]
+        # The bucket with the short group goes last
+        buckets.sort(key=lambda bucket: len(bucket) % group_size != 0)
+        return buckets
+
+    def optimize(self, encoding: CohortEncoding, group_size: int, seed: Optional[int] = None,
+                 executor: Optional[Executor] = None) -> GroupingResult:
+        started = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        buckets = self.buckets(encoding.features(), group_size, rng)
+        # One seed per bucket, and the last one for the repair
+        seeds = restart_seeds(seed, len(buckets) + 1)
+        subsets = (encoding.subset(bucket) for bucket in buckets)
+        run = executor.map if executor is not None else map
+        results = list(run(optimize_bucket, subsets, buckets, repeat(group_size), seeds, repeat(self.options)))
+        groups = [group for result in results for group in result.groups]
+        scores = [score for result in results for score in result.scores]
+        logger.info(f"Grouped {encoding.size} students in {len(buckets)} buckets in {time.perf_counter() - started:.2f}s")
+
+        trace = [float(np.mean(scores)) if scores else 0.0]
+        self._repair(encoding, groups, scores, group_size, seeds[-1])
+        # Only the last group of the cohort may be short
+        order = sorted(range(len(groups)), key=lambda index: len(groups[index]) < group_size)
+        groups = [groups[index] for index in order]
+        trace.append(float(np.mean([scores[index] for index in order])) if scores else 0.0)
+        return GroupingResult(groups, trace[-1], trace, sum(result.iterations for result in results), time.perf_counter() - started)
+
+    def _repair(self, encoding: CohortEncoding, groups: List[List[int]], scores: List[float], group_size: int,
+                seed: Optional[int]):
+        """Re-optimizes the weakest groups of all buckets together, replacing them in place if that scores higher."""
+        chosen, pooled = [], 0
+        for index in np.argsort(scores, kind="stable").tolist():
+            if pooled + len(groups[index]) > self.repair_size:
+                break
+            chosen.append(index)
+            pooled += len(groups[index])
+        if len(chosen) < 2:
+            return
+        chosen.sort(key=lambda index: len(groups[index]) < group_size)
+        members = np.array([student for index in chosen for student in groups[index]])
+        matrix = compatibility_matrix(encoding.subset(members))
+        initial, start = [], 0
+        for index in chosen:
+            initial.append(list(range(start, start + len(groups[index]))))
+            start += len(groups[index])
+        if group_size == 2:
+            result = optimal_pairs(matrix)
+        else:
+            result = SwapOptimizer(**self.options).optimize(matrix, group_size, seed=seed, initial=initial)
+        before = partition_score(matrix, initial)
+        if result.score <= before:
+            return
+        logger.info(f"Repair of the {len(chosen)} weakest groups raised their mean score from {before} to {result.score}")
+        for index, group in zip(chosen, result.groups):
+            groups[index] = members[group].tolist()
+            scores[index] = group_score(matrix, group)
@@ -0,0 +1,142 @@
+# ai71/peer_matching/compatibility.py
+"""
+Vectorized pairwise compatibility for a whole cohort.
+
+`CohortEncoding` encodes the users once: skills as a dense matrix with a presence mask over the
+sorted skill vocabulary, learning styles one-hot, and interests and personality traits as packed
+bit vectors over interned vocabularies. `compatibility_block` then scores every pair of two index
+sets with array operations, and `compatibility_matrix` gives the full n x n matrix group scoring
+reads from. `features` gives dense vectors for clustering cohorts too large for a full matrix.
+
+Scores are bit-for-bit those of `PeerMatcher.calculate_pair_compatibility`: skill differences are
+added in the same (sorted) order, skills two users do not share add exactly 0.0, Jaccard ratios
+divide the same integers, and the weighted sum is evaluated in the same order.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+SKILL_WEIGHT = 0.4
+STYLE_WEIGHT = 0.2
+INTEREST_WEIGHT = 0.2
+PERSONALITY_WEIGHT = 0.2
+
+# Rows scored per step, keeping the rows x n x bytes popcount intermediate near this many bytes
+BLOCK_BYTES = 16 * 1024 * 1024
+
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _pack(members: Sequence[Sequence[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Bit vectors (one row per user, packed into uint8) and set sizes over the sorted vocabulary."""
+    vocabulary = {term: index for index, term in enumerate(sorted({term for terms in members for term in terms}))}
+    present = np.zeros((len(members), max(len(vocabulary), 1)), dtype=bool)
+    for row, terms in enumerate(members):
+        present[row, [vocabulary[term] for term in terms]] = True
+    return np.packbits(present, axis=1), present.sum(axis=1, dtype=np.int64)
+
+
+class CohortEncoding:
+    """
+    Array encoding of a list of users (anything with `skills`, `learning_style`, `interests` and
+    `personality_traits`). Row i describes `users[i]`.
+    """
+    def __init__(self, users: Sequence):
+        self.size = len(users)
+        self.skill_names: List[str] = sorted({skill for user in users for skill in user.skills})
+        skill_index: Dict[str, int] = {skill: index for index, skill in enumerate(self.skill_names)}
+        self.skills = np.zeros((self.size, len(self.skill_names)), dtype=np.float64)
+        self.skill_mask = np.zeros((self.size, len(self.skill_names)), dtype=bool)
+        for row, user in enumerate(users):
+            for skill, level in user.skills.items():
+                self.skills[row, skill_index[skill]] = level
+                self.skill_mask[row, skill_index[skill]] = True
+
+        styles = {style: index for index, style in enumerate(sorted({user.learning_style for user in users}))}
+        self.styles = np.zeros((self.size, max(len(styles), 1)), dtype=np.int64)
+        self.styles[np.arange(self.size), [styles[user.learning_style] for user in users]] = 1
+
+        self.interests, self.interest_counts = _pack([user.interests for user in users])
+        self.traits, self.trait_counts = _pack([user.personality_traits for user in users])
+
+    def subset(self, rows: Sequence[int]) -> "CohortEncoding":
+        """Encoding of the users at `rows`, over the same vocabularies."""
+        subset = CohortEncoding.__new__(CohortEncoding)
+        subset.size = len(rows)
+        subset.skill_names = self.skill_names
+        for name in ("skills", "skill_mask", "styles", "interests", "interest_counts", "traits", "trait_counts"):
+            setattr(subset, name, getattr(self, name)[rows])
+        return subset
+
+    def features(self) -> np.ndarray:
+        """
+        Dense vectors, one row per user, placing users that share skills at similar levels,
+        interests and traits close together. Learning styles are left out: compatibility rewards
+        different styles, so they should not drive users together.
+        """
+        def unit_rows(bits: np.ndarray, counts: np.ndarray) -> np.ndarray:
+            return np.unpackbits(bits, axis=1).astype(np.float32) / np.sqrt(np.maximum(counts, 1))[:, None].astype(np.float32)
+
+        return np.hstack([
+            np.sqrt(SKILL_WEIGHT) * self.skill_mask,
+            np.sqrt(SKILL_WEIGHT) * self.skills,
+            np.sqrt(INTEREST_WEIGHT) * unit_rows(self.interests, self.interest_counts),
+            np.sqrt(PERSONALITY_WEIGHT) * unit_rows(self.traits, self.trait_counts),
+        ]).astype(np.float32)
+
+
+def _jaccard(bits: np.ndarray, counts: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    common = _POPCOUNT[bits[rows][:, None, :] & bits[cols][None, :, :]].sum(axis=2, dtype=np.int64)
+    total = counts[rows][:, None] + counts[cols][None, :] - common
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, common / total, 0.0)
+
+
+def _block(encoding: CohortEncoding, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    differences = np.zeros((len(rows), len(cols)), dtype=np.float64)
+    for skill in range(len(encoding.skill_names)):
+        shared = encoding.skill_mask[rows, skill][:, None] & encoding.skill_mask[cols, skill][None, :]
+        difference = np.abs(encoding.skills[rows, skill][:, None] - encoding.skills[cols, skill][None, :])
+        differences += np.where(shared, difference, 0.0)
+    shared_skills = encoding.skill_mask[rows].astype(np.int64) @ encoding.skill_mask[cols].T.astype(np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        skill_complementarity = np.where(shared_skills > 0, 1 - differences / shared_skills, 0.0)
+
+    style_diversity = 1.0 - (encoding.styles[rows] @ encoding.styles[cols].T).astype(np.float64)
+    interest_overlap = _jaccard(encoding.interests, encoding.interest_counts, rows, cols)
+    personality_dynamics = _jaccard(encoding.traits, encoding.trait_counts, rows, cols)
+
+    return (SKILL_WEIGHT * skill_complementarity +
+            STYLE_WEIGHT * style_diversity +
+            INTEREST_WEIGHT * interest_overlap +
+            PERSONALITY_WEIGHT * personality_dynamics)
+
+
+def compatibility_block(encoding: CohortEncoding, rows: Sequence[int], cols: Sequence[int]) -> np.ndarray:
+    """Compatibility of every user in `rows` with every user in `cols`, shape (len(rows), len(cols))."""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    width = max(encoding.interests.shape[1], encoding.traits.shape[1], 1)
+    if not len(rows):
+        return np.zeros((0, len(cols)), dtype=np.float64)
+    step = max(BLOCK_BYTES // max(len(cols) * width, 1), 1)
+    return np.vstack([_block(encoding, rows[start:start + step], cols) for start in range(0, len(rows), step)])
+
+
+def compatibility_matrix(encoding: CohortEncoding) -> np.ndarray:
+    """Symmetric n x n compatibility of the cohort, with zeros on the diagonal."""
+    everyone = np.arange(encoding.size)
+    matrix = compatibility_block(encoding, everyone, everyone)
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def group_score(matrix: np.ndarray, members: Sequence[int]) -> float:
+    """Mean pairwise compatibility of `members`, summed in the same order as `PeerMatcher.evaluate_group`."""
+    size = len(members)
+    if size < 2:
+        return 0.0
+    first, second = np.triu_indices(size, 1)
+    members = np.asarray(members)
+    return sum(matrix[members[first], members[second]].tolist()) / (size * (size - 1) / 2)
@@ -24,16 +24,30 @@ Methods:
     - calculate_pair_compatibility: Calculates an overall compatibility score for a pair of users.
     - generate_initial_groups: Generates initial random groups.
     - evaluate_group: Evaluates the overall compatibility of a group.
+    - compatibility_matrix: Scores every pair of a cohort at once (see compatibility.py).
+    - evaluate_group_indices: Evaluates a group of cohort indices with lookups into the compatibility matrix.
     - monte_carlo_group_formation: Uses a Monte Carlo simulation to form groups and optimize compatibility.
+    - anneal_group_formation: Improves a greedy grouping with member swaps and simulated annealing (see optimizer.py).
+    - pair_formation: Forms provably optimal pairs (groups of two) by maximum-weight matching (see pairing.py).
+    - hierarchical_group_formation: Groups cohorts too large for a full compatibility matrix bucket by bucket (see blocking.py).
+    - find_optimal_matches: Pairs exactly, or runs annealing restarts in a process pool, off the event loop (see parallel.py).
 
 Usage Example:
     See the __main__ section for an example of how to use the PeerMatcher class to form groups and evaluate their compatibility.
 """
 
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Sequence, Tuple
 from pydantic import BaseModel
 import numpy as np
+import asyncio
 import logging
+import os
+
+from .blocking import HierarchicalGroupOptimizer
+from .compatibility import CohortEncoding, compatibility_matrix, group_score
+from .optimizer import SwapOptimizer
+from .pairing import optimal_pairs
+from .parallel import ParallelGroupOptimizer
 
 class User(BaseModel):
     id: int
@@ -46,21 +60,29 @@ class User(BaseModel):
 class PeerMatcher:
     def __init__(self):
         self.logger = self._setup_logger()
+        self.parallel = ParallelGroupOptimizer.from_env()
+        # Exact pairing needs O(n^2) memory and O(n^3) time; larger cohorts of pairs are annealed
+        self.max_exact_pairs = int(os.getenv("PEER_MATCHING_MAX_EXACT_PAIRS", "1000"))
+        # Larger cohorts are split into buckets instead of scoring every pair
+        self.max_dense_size = int(os.getenv("PEER_MATCHING_MAX_DENSE_SIZE", "5000"))
+        self.hierarchical = HierarchicalGroupOptimizer.from_env()
 
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
 
     def calculate_skill_complementarity(self, user1: User, user2: User) -> float:
         common_skills = set(user1.skills.keys()).intersection(set(user2.skills.keys()))
         if not common_skills:
             return 0.0
-        score = sum(abs(user1.skills[skill] - user2.skills[skill]) for skill in common_skills) / len(common_skills)
+        # Sorted, so the sum does not depend on set order and matches the vectorized matrix exactly
+        score = sum(abs(user1.skills[skill] - user2.skills[skill]) for skill in sorted(common_skills)) / len(common_skills)
         return 1 - score  # Higher score for higher complementarity
 
     def calculate_learning_style_diversity(self, user1: User, user2: User) -> float:
@@ -69,11 +91,15 @@ class PeerMatcher:
     def calculate_interest_overlap(self, user1: User, user2: User) -> float:
         common_interests = set(user1.interests).intersection(set(user2.interests))
         total_interests = set(user1.interests).union(set(user2.interests))
+        if not total_interests:
+            return 0.0
         return len(common_interests) / len(total_interests)
 
     def calculate_personality_dynamics(self, user1: User, user2: User) -> float:
         common_traits = set(user1.personality_traits).intersection(set(user2.personality_traits))
         total_traits = set(user1.personality_traits).union(set(user2.personality_traits))
+        if not total_traits:
+            return 0.0
         return len(common_traits) / len(total_traits)
 
     def calculate_pair_compatibility(self, user1: User, user2: User) -> float:
@@ -95,27 +121,80 @@ class PeerMatcher:
 
     def evaluate_group(self, group: List[User]) -> float:
         n = len(group)
+        if n < 2:
+            return 0.0
         total_compatibility = 0.0
         for i in range(n):
             for j in range(i + 1, n):
                 total_compatibility += self.calculate_pair_compatibility(group[i], group[j])
         return total_compatibility / (n * (n - 1) / 2)
 
-    def monte_carlo_group_formation(self, users: List[User], group_size: int, iterations: int = 1000) -> List[List[int]]:
+    def compatibility_matrix(self, users: Sequence[User]) -> np.ndarray:
+        """Pairwise compatibility of the whole cohort; entry (i, j) equals calculate_pair_compatibility(users[i], users[j])."""
+        return compatibility_matrix(CohortEncoding(users))
+
+    def evaluate_group_indices(self, matrix: np.ndarray, members: Sequence[int]) -> float:
+        """evaluate_group for the users at `members`, read from a compatibility matrix."""
+        return group_score(matrix, members)
+
+    def monte_carlo_group_formation(self, users: List[User], group_size: int, iterations: int = 1000) -> Tuple[List[List[User]], float]:
+        # The cohort is scored once; each iteration only shuffles indices and looks groups up in the matrix
+        matrix = self.compatibility_matrix(users)
         best_groups = []
         best_score = -1
 
         for _ in range(iterations):
-            np.random.shuffle(users)
-            groups = self.generate_initial_groups(users, group_size)
-            avg_score = np.mean([self.evaluate_group(group) for group in groups])
+            order = np.random.permutation(len(users))
+            groups = [order[i:i + group_size] for i in range(0, len(users), group_size)]
+            avg_score = np.mean([self.evaluate_group_indices(matrix, group) for group in groups])
 
             if avg_score > best_score:
                 best_score = avg_score
                 best_groups = groups
 
         self.logger.info(f"Best average compatibility score: {best_score}")
-        return best_groups, best_score
+        return [[users[i] for i in group] for group in best_groups], best_score
+
+    def anneal_group_formation(self, users: List[User], group_size: int, max_iterations: int = 20000,
+                               time_budget: Optional[float] = 5.0, seed: Optional[int] = None) -> Tuple[List[List[User]], float, List[float]]:
+        """Same objective as monte_carlo_group_formation; also returns the trace of the best score."""
+        matrix = self.compatibility_matrix(users)
+        result = SwapOptimizer(max_iterations=max_iterations, time_budget=time_budget).optimize(matrix, group_size, seed=seed)
+        self.logger.info(f"Best average compatibility score: {result.score} after {result.iterations} swaps in {result.elapsed:.2f}s")
+        return [[users[i] for i in group] for group in result.groups], result.score, result.trace
+
+    def pair_formation(self, users: List[User]) -> Tuple[List[List[User]], float]:
+        """Pairs maximizing the objective of monte_carlo_group_formation with group_size=2; an odd cohort's last group has one student."""
+        result = optimal_pairs(self.compatibility_matrix(users))
+        self.logger.info(f"Optimal average compatibility score: {result.score} after {result.iterations} augmentations in {result.elapsed:.2f}s")
+        return [[users[i] for i in group] for group in result.groups], result.score
+
+    def hierarchical_group_formation(self, users: List[User], group_size: int, seed: Optional[int] = None) -> Tuple[List[List[User]], float]:
+        """Same objective as monte_carlo_group_formation, optimized in buckets of similar users; runs in this process."""
+        result = self.hierarchical.optimize(CohortEncoding(users), group_size, seed)
+        self.logger.info(f"Best average compatibility score: {result.score} (before repair {result.trace[0]}) in {result.elapsed:.2f}s")
+        return [[users[i] for i in group] for group in result.groups], result.score
+
+    async def find_optimal_matches(self, users: Sequence[Any], group_size: int, seed: Optional[int] = None) -> Tuple[List[List[Any]], float]:
+        """
+        Groups of user ids and their score. Cohorts over `max_dense_size` are optimized bucket by
+        bucket in the process pool. Otherwise pairs of cohorts up to `max_exact_pairs` are optimal,
+        and other groups come from the best of several annealing restarts run in the process pool.
+        The same seed gives the same groups unless an optimizer hits its time budget.
+        """
+        if len(users) > self.max_dense_size:
+            encoding = await asyncio.to_thread(CohortEncoding, users)
+            result = await asyncio.to_thread(self.hierarchical.optimize, encoding, group_size, seed, self.parallel.pool())
+            return [[users[i].id for i in group] for group in result.groups], result.score
+        matrix = await asyncio.to_thread(self.compatibility_matrix, users)
+        if group_size == 2 and len(users) <= self.max_exact_pairs:
+            result = await asyncio.to_thread(optimal_pairs, matrix)
+        else:
+            result = await self.parallel.optimize(matrix, group_size, seed)
+        return [[users[i].id for i in group] for group in result.groups], result.score
+
+    def close(self):
+        self.parallel.close()
 
 # Usage example
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+# ai71/peer_matching/optimizer.py
+"""
+Group formation by swap-based local search over a precomputed compatibility matrix.
+
+The objective is the one `PeerMatcher.monte_carlo_group_formation` maximizes: the mean over groups
+of each group's mean pairwise compatibility. Groups are filled in order, so every group has
+`group_size` members except possibly the last.
+
+`SwapOptimizer` starts from a greedy partition and improves it in two phases:
+
+1. Simulated annealing proposes swapping two members of different groups. A proposal is scored in
+   O(g) from the two rows of the matrix restricted to the two groups, and accepted if it improves
+   the objective or, with probability exp(delta / T), if it does not. The temperature cools
+   geometrically over `max_iterations` proposals.
+2. Hill climbing from the best partition found: every student is checked against every student of
+   the other groups with vectorized deltas, until no improving swap is left.
+
+Both phases stop when `time_budget` runs out. The result carries the best partition, its score and
+a trace of the best score over time.
+"""
+
+import math
+import time
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .compatibility import group_score
+
+# Swaps have to improve the objective by more than this to count, so rounding cannot cycle
+IMPROVEMENT_EPSILON = 1e-12
+
+
+class GroupingResult(NamedTuple):
+    groups: List[List[int]]
+    score: float
+    # Best score after every `trace_every` proposals, then after every hill-climbing pass
+    trace: List[float]
+    iterations: int
+    elapsed: float
+
+
+def partition_score(matrix: np.ndarray, groups: Sequence[Sequence[int]]) -> float:
+    """Mean of the groups' scores, the objective every optimizer maximizes."""
+    return float(np.mean([group_score(matrix, group) for group in groups])) if groups else 0.0
+
+
+def greedy_groups(matrix: np.ndarray, group_size: int) -> List[List[int]]:
+    """
+    Fills groups one at a time, adding the unassigned student most compatible with the members so
+    far. Each group starts from the unassigned student with the lowest total compatibility, so hard
+    to place students are placed while they still have a choice of partners.
+    """
+    size = len(matrix)
+    unassigned = np.ones(size, dtype=bool)
+    groups = []
+    for start in np.argsort(matrix.sum(axis=1), kind="stable"):
+        if not unassigned[start]:
+            continue
+        members = [int(start)]
+        unassigned[start] = False
+        gain = matrix[start].copy()
+        while len(members) < group_size and unassigned.any():
+            pick = int(np.argmax(np.where(unassigned, gain, -np.inf)))
+            members.append(pick)
+            unassigned[pick] = False
+            gain += matrix[pick]
+        groups.append(members)
+    return groups
+
+
+class SwapOptimizer:
+    """
+    Args:
+        max_iterations (int): Swap proposals of the annealing phase.
+        time_budget (Optional[float]): Seconds both phases may take together; None for no limit.
+        initial_temperature (Optional[float]): Starting temperature; None estimates it from the mean
+            magnitude of sampled swap deltas.
+        cooling (float): Final temperature as a fraction of the initial one.
+        trace_every (int): Proposals between two entries of the score trace.
+    """
+    def __init__(self, max_iterations: int = 20000, time_budget: Optional[float] = 5.0,
+                 initial_temperature: Optional[float] = None, cooling: float = 1e-3, trace_every: int = 500):
+        self.max_iterations = max_iterations
+        self.time_budget = time_budget
+        self.initial_temperature = initial_temperature
+        self.cooling = cooling
+        self.trace_every = trace_every
+
+    def optimize(self, matrix: np.ndarray, group_size: int, seed: Optional[int] = None,
+                 initial: Optional[Sequence[Sequence[int]]] = None) -> GroupingResult:
+        started = time.perf_counter()
+        deadline = started + self.time_budget if self.time_budget is not None else math.inf
+        rng = np.random.default_rng(seed)
+        groups = [list(group) for group in (initial if initial is not None else greedy_groups(matrix, group_size))]
+        state = _Partition(matrix, groups)
+        trace = [state.score()]
+        iterations = 0
+        if len(groups) > 1:
+            iterations = self._anneal(state, rng, deadline, trace)
+            state = _Partition(matrix, state.best_groups)
+            self._hill_climb(state, deadline, trace)
+        best = state.groups()
+        return GroupingResult(best, partition_score(matrix, best), trace, iterations, time.perf_counter() - started)
+
+    def _anneal(self, state: "_Partition", rng: np.random.Generator, deadline: float, trace: List[float]) -> int:
+        temperature = self.initial_temperature
+        if temperature is None:
+            samples = [abs(state.swap_delta(*state.random_swap(rng))) for _ in range(min(200, self.max_iterations))]
+            temperature = float(np.mean(samples)) if samples else 0.0
+        decay = self.cooling ** (1 / max(self.max_iterations, 1))
+        current = best = state.score()
+        iteration = 0
+        for iteration in range(1, self.max_iterations + 1):
+            a, b = state.random_swap(rng)
+            delta = state.swap_delta(a, b)
+            if delta > IMPROVEMENT_EPSILON or (temperature > 0 and rng.random() < math.exp(delta / temperature)):
+                state.swap(a, b)
+                current += delta
+                if current > best + IMPROVEMENT_EPSILON:
+                    best = current
+                    state.keep_best()
+            temperature *= decay
+            if iteration % self.trace_every == 0:
+                trace.append(best)
+            if iteration % 256 == 0 and time.perf_counter() > deadline:
+                break
+        return iteration
+
+    def _hill_climb(self, state: "_Partition", deadline: float, trace: List[float]):
+        contributions = state.contributions()
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for a in range(state.size):
+                deltas = state.swap_deltas(a, contributions)
+                b = int(np.argmax(deltas))
+                if deltas[b] > IMPROVEMENT_EPSILON:
+                    state.swap(a, b, contributions)
+                    improved = True
+            trace.append(state.score())
+
+
+class _Partition:
+    """Members of each group plus, for each student, its group and slot in that group."""
+
+    def __init__(self, matrix: np.ndarray, groups: List[List[int]]):
+        self.matrix = matrix
+        self.size = len(matrix)
+        self.group_count = len(groups)
+        self.sizes = np.array([len(group) for group in groups], dtype=np.int64)
+        self.members = np.full((self.group_count, int(self.sizes.max()) if groups else 0), -1, dtype=np.int64)
+        self.group_of = np.empty(self.size, dtype=np.int64)
+        self.slot_of = np.empty(self.size, dtype=np.int64)
+        for index, group in enumerate(groups):
+            self.members[index, :len(group)] = group
+            self.group_of[group] = index
+            self.slot_of[group] = np.arange(len(group))
+        pairs = self.sizes * (self.sizes - 1) / 2
+        # Each group's pair sum counts 1 / (pairs * groups) towards the objective; singletons count 0
+        self.weights = np.divide(1.0, pairs * self.group_count, out=np.zeros(self.group_count), where=pairs > 0)
+        self.best_members = self.members.copy()
+
+    def groups(self, members: Optional[np.ndarray] = None) -> List[List[int]]:
+        members = self.members if members is None else members
+        return [members[index, :self.sizes[index]].tolist() for index in range(self.group_count)]
+
+    @property
+    def best_groups(self) -> List[List[int]]:
+        return self.groups(self.best_members)
+
+    def keep_best(self):
+        self.best_members = self.members.copy()
+
+    def score(self) -> float:
+        return partition_score(self.matrix, self.groups())
+
+    def random_swap(self, rng: np.random.Generator):
+        first, second = rng.choice(self.group_count, size=2, replace=False)
+        a = self.members[first, rng.integers(self.sizes[first])]
+        b = self.members[second, rng.integers(self.sizes[second])]
+        return int(a), int(b)
+
+    def swap_delta(self, a: int, b: int) -> float:
+        """Change of the objective if `a` and `b` (in different groups) traded places; O(g)."""
+        first, second = self.group_of[a], self.group_of[b]
+        row_a, row_b = self.matrix[a], self.matrix[b]
+        in_first = self.members[first, :self.sizes[first]]
+        in_second = self.members[second, :self.sizes[second]]
+        first_change = row_b[in_first].sum() - row_b[a] - row_a[in_first].sum()
+        second_change = row_a[in_second].sum() - row_a[b] - row_b[in_second].sum()
+        return float(first_change * self.weights[first] + second_change * self.weights[second])
+
+    def contributions(self) -> np.ndarray:
+        """(n, groups) matrix of each student's summed compatibility with each group."""
+        membership = np.zeros((self.size, self.group_count))
+        membership[np.arange(self.size), self.group_of] = 1.0
+        return self.matrix @ membership
+
+    def swap_deltas(self, a: int, contributions: np.ndarray) -> np.ndarray:
+        """Objective change of swapping `a` with every student; -inf for students of its own group."""
+        first = self.group_of[a]
+        own = contributions[np.arange(self.size), self.group_of]
+        first_change = (contributions[:, first] - self.matrix[:, a] - contributions[a, first]) * self.weights[first]
+        second_change = (contributions[a, self.group_of] - self.matrix[a] - own) * self.weights[self.group_of]
+        deltas = first_change + second_change
+        deltas[self.group_of == first] = -np.inf
+        return deltas
+
+    def swap(self, a: int, b: int, contributions: Optional[np.ndarray] = None):
+        first, second = self.group_of[a], self.group_of[b]
+        slot_a, slot_b = self.slot_of[a], self.slot_of[b]
+        self.members[first, slot_a], self.members[second, slot_b] = b, a
+        self.group_of[a], self.group_of[b] = second, first
+        self.slot_of[a], self.slot_of[b] = slot_b, slot_a
+        if contributions is not None:
+            change = self.matrix[:, b] - self.matrix[:, a]
+            contributions[:, first] += change
+            contributions[:, second] -= change
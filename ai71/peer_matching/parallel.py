@@ -0,0 +1,136 @@
+# ai71/peer_matching/parallel.py
+"""
+Independent optimizer restarts across a process pool.
+
+Group optimization is CPU-bound and runs outside the event loop. `ParallelGroupOptimizer` places
+the compatibility matrix in shared memory once, and each restart attaches to it by name, so the
+matrix is not pickled per task. Each restart runs `SwapOptimizer` with its own seed, spawned from a
+single `SeedSequence`. A given seed therefore gives the same result whatever the number of workers,
+as long as no restart runs out of its time budget. The best restart wins, and ties go to the lower
+restart index.
+
+Small cohorts run their restarts in a thread instead, where starting worker processes would cost
+more than the work. Workers are spawned rather than forked, so the main module of the program must
+guard its entry point with `if __name__ == "__main__"` (uvicorn's does).
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..metrics import registry
+from .optimizer import GroupingResult, SwapOptimizer
+
+logger = logging.getLogger(__name__)
+
+MatrixHandle = Tuple[str, Tuple[int, ...], str]
+
+_restarts = registry.counter("peer_matching_restarts_total", "Group optimizer restarts by where they ran (pool or thread)")
+
+
+class SharedMatrix:
+    """A copy of a matrix in shared memory, released when the context exits."""
+
+    def __init__(self, matrix: np.ndarray):
+        self.shape = matrix.shape
+        self.dtype = matrix.dtype
+        self._memory = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=self._memory.buf)[...] = matrix
+
+    @property
+    def handle(self) -> MatrixHandle:
+        return self._memory.name, self.shape, self.dtype.str
+
+    def __enter__(self) -> "SharedMatrix":
+        return self
+
+    def __exit__(self, *exc_info):
+        self._memory.close()
+        self._memory.unlink()
+
+
+def run_restart(handle: MatrixHandle, group_size: int, seed: int, options: Dict[str, Any]) -> GroupingResult:
+    """Runs in a pool worker: attaches to the shared matrix and optimizes one restart."""
+    name, shape, dtype = handle
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        matrix = np.ndarray(shape, dtype=np.dtype(dtype), buffer=memory.buf)
+        result = SwapOptimizer(**options).optimize(matrix, group_size, seed=seed)
+        del matrix
+        return result
+    finally:
+        memory.close()
+
+
+def restart_seeds(seed: Optional[int], restarts: int) -> List[int]:
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(restarts)]
+
+
+def best_result(results: Sequence[GroupingResult]) -> GroupingResult:
+    return max(enumerate(results), key=lambda indexed: (indexed[1].score, -indexed[0]))[1]
+
+
+class ParallelGroupOptimizer:
+    """
+    Args:
+        workers (int): Worker processes of the pool.
+        restarts (int): Independent optimizer runs per request; the best one is returned.
+        min_parallel_size (int): Cohorts smaller than this run their restarts in a thread.
+        options (Dict[str, Any]): Keyword arguments of `SwapOptimizer`, applied to every restart.
+    """
+    def __init__(self, workers: int = 4, restarts: int = 4, min_parallel_size: int = 200, options: Optional[Dict[str, Any]] = None):
+        self.workers = workers
+        self.restarts = restarts
+        self.min_parallel_size = min_parallel_size
+        self.options = options or {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "ParallelGroupOptimizer":
+        workers = int(os.getenv("PEER_MATCHING_WORKERS", str(os.cpu_count() or 1)))
+        return cls(
+            workers=workers,
+            restarts=int(os.getenv("PEER_MATCHING_RESTARTS", str(max(workers, 2)))),
+            min_parallel_size=int(os.getenv("PEER_MATCHING_MIN_PARALLEL_SIZE", "200")),
+            options={
+                "max_iterations": int(os.getenv("PEER_MATCHING_ITERATIONS", "20000")),
+                "time_budget": float(os.getenv("PEER_MATCHING_TIME_BUDGET", "5")),
+            },
+        )
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking a process that runs an event loop and threads is unsafe; spawned workers import only this package
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def optimize(self, matrix: np.ndarray, group_size: int, seed: Optional[int] = None) -> GroupingResult:
+        seeds = restart_seeds(seed, self.restarts)
+        if len(matrix) < self.min_parallel_size or self.workers < 1:
+            _restarts.inc(len(seeds), runner="thread")
+            results = await asyncio.to_thread(self._run_local, matrix, group_size, seeds)
+        else:
+            _restarts.inc(len(seeds), runner="pool")
+            loop = asyncio.get_running_loop()
+            with SharedMatrix(matrix) as shared:
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(self.pool(), run_restart, shared.handle, group_size, restart_seed, self.options)
+                    for restart_seed in seeds
+                ))
+        best = best_result(results)
+        logger.info(f"Best of {len(results)} restarts: {best.score} (scores {[round(result.score, 4) for result in results]})")
+        return best
+
+    def _run_local(self, matrix: np.ndarray, group_size: int, seeds: Sequence[int]) -> List[GroupingResult]:
+        return [SwapOptimizer(**self.options).optimize(matrix, group_size, seed=restart_seed) for restart_seed in seeds]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
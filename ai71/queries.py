@@ -0,0 +1,51 @@
+# ai71/queries.py
+"""
+Projection queries for read endpoints.
+
+A user achievement is served together with its achievement. Loading `UserAchievement` objects and
+then their `achievement` relationship costs a query per row when done lazily (and raises on an
+AsyncSession), and still two round trips with `selectinload`. The projection below joins both
+tables and selects exactly the columns of `UserAchievementResponse`, so a page costs one query and
+no ORM objects are built.
+"""
+
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.sql import Select
+
+from .database import Achievement, UserAchievement
+from .models import AchievementResponse, UserAchievementResponse
+
+
+def user_achievements_query(user_id: int) -> Select:
+    return (
+        select(
+            UserAchievement.id,
+            UserAchievement.user_id,
+            UserAchievement.unlocked_at,
+            Achievement.id.label("achievement_id"),
+            Achievement.name,
+            Achievement.description,
+            Achievement.criteria,
+            Achievement.points,
+        )
+        .join(Achievement, UserAchievement.achievement_id == Achievement.id)
+        .where(UserAchievement.user_id == user_id)
+    )
+
+
+def user_achievement_response(row: Any) -> UserAchievementResponse:
+    """Builds the response from a `user_achievements_query` row."""
+    return UserAchievementResponse(
+        id=row.id,
+        user_id=row.user_id,
+        unlocked_at=row.unlocked_at,
+        achievement=AchievementResponse(
+            id=row.achievement_id,
+            name=row.name,
+            description=row.description,
+            criteria=row.criteria,
+            points=row.points,
+        ),
+    )
@@ -0,0 +1,305 @@
+# ai71/rate_limits.py
+"""
+Cost-weighted, per-user rate limiting of API requests.
+
+Every user has a token bucket of `capacity` credits that refills at `refill_rate` credits per
+second, and every request is charged the cost of its route: an image generation costs what dozens
+of profile reads cost. Buckets live in Redis, so the limit holds across workers and nodes; a Lua
+script refills and charges a bucket atomically.
+
+Cheap requests take a local fast path. A worker leases a batch of credits from the user's Redis
+bucket and spends them in process until the lease is used up or expires, so most cheap requests
+never wait for Redis. Leased credits are already deducted in Redis, so leasing can only make a user
+hit the limit slightly early, never late. Requests costing more than `local_max_cost` always go to
+Redis. Without Redis, or while Redis fails, buckets are kept per process.
+
+The user a request is charged to comes from the request itself (see `rate_limit_key`), and nothing
+authenticates it, so a client could spread its requests over made-up users. Every request is
+therefore also charged to a bucket of its client address, `client_capacity` credits refilling at
+`client_refill_rate`. It is larger than a user's bucket, since a classroom may share one address,
+and it is charged first, so a request it refuses costs the user nothing.
+
+Route costs come from DEFAULT_COSTS, overridden by RATE_LIMIT_COSTS, a JSON object mapping route
+paths to costs, e.g. `{"/api/generate-image": 60}`. A cost of 0 exempts a route.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from fastapi import Request
+
+from .exceptions import RateLimitedError
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COST = 1
+
+DEFAULT_COSTS = {
+    "/": 0,
+    "/api/metrics": 0,
+    "/api/generate-image": 40,
+    "/api/generate-achievement-badge": 40,
+    "/api/generate-environment-with-image": 50,
+    "/api/generate-environment": 10,
+    "/api/optimize-curriculum": 10,
+    "/api/ai-tutor": 5,
+    "/api/ai-tutor/stream": 5,
+    "/api/generate-challenge": 5,
+    "/api/generate-challenges/{student_id}": 5,
+    "/api/generate-achievements": 5,
+    "/api/update-achievements/{student_id}": 5,
+    "/api/calculate-engagement/{student_id}": 5,
+    "/api/recommend-resources": 5,
+    "/api/generate-element": 5,
+    "/api/match-peers": 3,
+    "/api/bulk/{entity}": 20,
+}
+
+# Refills the bucket by elapsed time (Redis clock), then grants between ARGV[3] and ARGV[4] credits
+# if the bucket holds at least ARGV[3]. Returns the credits granted and the credits left.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local take = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = 0
+if tokens >= cost then
+    granted = math.min(take, tokens)
+    tokens = tokens - granted
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {tostring(granted), tostring(tokens)}
+"""
+
+_decisions = registry.counter("rate_limit_decisions_total", "Rate limit decisions by route, bucket, outcome and path taken")
+_near_misses = registry.counter("rate_limit_near_misses_total", "Allowed requests that left a bucket nearly empty")
+_redis_errors = registry.counter("rate_limit_redis_errors_total", "Redis failures that fell back to per-process buckets")
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    remaining: float
+    retry_after: float
+
+
+class RateLimiter:
+    """
+    Args:
+        capacity (float): Credits a user can spend in a burst.
+        refill_rate (float): Credits returned to a user's bucket per second.
+        client_capacity (float): Credits a client address can spend in a burst, across all its users; 0 disables the client buckets.
+        client_refill_rate (float): Credits returned to a client address's bucket per second.
+        costs (Dict[str, float]): Cost per route path; routes not listed cost `default_cost`.
+        default_cost (float): Cost of routes missing from `costs`.
+        local_max_cost (float): Requests costing at most this are served from leased credits.
+        lease_size (float): Credits a worker leases from Redis at a time.
+        lease_ttl (float): Seconds unspent leased credits stay usable.
+        near_miss_ratio (float): Allowed requests leaving less than this share of `capacity` count as near misses.
+        max_users (int): Per-process buckets and leases kept, least recently used evicted first.
+        enabled (bool): When False every request is allowed.
+        namespace (str): Prefix of the Redis keys.
+    """
+    def __init__(self, capacity: float = 120, refill_rate: float = 1.0, client_capacity: float = 600,
+                 client_refill_rate: float = 5.0, costs: Optional[Dict[str, float]] = None,
+                 default_cost: float = DEFAULT_COST, local_max_cost: float = 1, lease_size: float = 10,
+                 lease_ttl: float = 5.0, near_miss_ratio: float = 0.1, max_users: int = 10000,
+                 enabled: bool = True, namespace: str = "koda:ratelimit"):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.client_capacity = client_capacity
+        self.client_refill_rate = client_refill_rate
+        self.costs = {**DEFAULT_COSTS, **(costs or {})}
+        self.default_cost = default_cost
+        self.local_max_cost = local_max_cost
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self.near_miss_ratio = near_miss_ratio
+        self.max_users = max_users
+        self.enabled = enabled
+        self.namespace = namespace
+        self.redis = None
+        self._script = None
+        # bucket key -> [tokens, updated_at]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        # bucket key -> [credits, expires_at, remaining in Redis when leased]
+        self._leases: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        raw = os.getenv("RATE_LIMIT_COSTS")
+        return cls(
+            capacity=float(os.getenv("RATE_LIMIT_CAPACITY", "120")),
+            refill_rate=float(os.getenv("RATE_LIMIT_REFILL_PER_SECOND", "1")),
+            client_capacity=float(os.getenv("RATE_LIMIT_CLIENT_CAPACITY", "600")),
+            client_refill_rate=float(os.getenv("RATE_LIMIT_CLIENT_REFILL_PER_SECOND", "5")),
+            costs=json.loads(raw) if raw else None,
+            default_cost=float(os.getenv("RATE_LIMIT_DEFAULT_COST", str(DEFAULT_COST))),
+            local_max_cost=float(os.getenv("RATE_LIMIT_LOCAL_MAX_COST", "1")),
+            lease_size=float(os.getenv("RATE_LIMIT_LEASE_SIZE", "10")),
+            lease_ttl=float(os.getenv("RATE_LIMIT_LEASE_TTL", "5")),
+            near_miss_ratio=float(os.getenv("RATE_LIMIT_NEAR_MISS_RATIO", "0.1")),
+            max_users=int(os.getenv("RATE_LIMIT_MAX_USERS", "10000")),
+            enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes"),
+            namespace=os.getenv("RATE_LIMIT_NAMESPACE", "koda:ratelimit"),
+        )
+
+    def attach_redis(self, client):
+        self.redis = client
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._leases.clear()
+
+    def cost(self, route: str) -> float:
+        return self.costs.get(route, self.default_cost)
+
+    async def check(self, user: str, route: str, client: Optional[str] = None) -> Decision:
+        """Charges the route to the `client` bucket, when given, and then to the `user` bucket."""
+        cost = self.cost(route)
+        if not self.enabled or cost <= 0:
+            return Decision(True, self.capacity, 0.0)
+        if cost > self.capacity:
+            logger.warning(f"Route {route} costs {cost}, more than the rate limit capacity {self.capacity}")
+            cost = self.capacity
+        buckets = [("user", user, self.capacity, self.refill_rate)]
+        if client is not None and self.client_capacity > 0:
+            buckets.insert(0, ("client", client, self.client_capacity, self.client_refill_rate))
+        for bucket, key, capacity, rate in buckets:
+            decision = await self._take(route, bucket, key, min(cost, capacity), capacity, rate)
+            if not decision.allowed:
+                return decision
+        return decision
+
+    async def _take(self, route: str, bucket: str, key: str, cost: float, capacity: float, rate: float) -> Decision:
+        if self.redis is None:
+            decision, path = self._take_local(key, cost, capacity, rate), "local"
+        else:
+            try:
+                decision, path = await self._take_shared(key, cost, capacity, rate)
+            except Exception as e:
+                _redis_errors.inc()
+                logger.warning(f"Rate limit check in Redis failed, using per-process buckets: {str(e)}")
+                decision, path = self._take_local(key, cost, capacity, rate), "local_fallback"
+        self._record(route, bucket, path, decision, capacity)
+        return decision
+
+    async def _take_shared(self, key: str, cost: float, capacity: float, rate: float):
+        if cost <= self.local_max_cost:
+            now = time.monotonic()
+            lease = self._leases.get(key)
+            if lease is not None and lease[1] > now and lease[0] >= cost:
+                lease[0] -= cost
+                self._leases.move_to_end(key)
+                return Decision(True, lease[0] + lease[2], 0.0), "lease"
+            granted, remaining = await self._redis_take(key, cost, max(self.lease_size, cost), capacity, rate)
+            if granted < cost:
+                self._leases.pop(key, None)
+                return self._denied(cost, remaining, rate), "redis"
+            self._remember(self._leases, key, [granted - cost, now + self.lease_ttl, remaining])
+            return Decision(True, granted - cost + remaining, 0.0), "redis"
+        granted, remaining = await self._redis_take(key, cost, cost, capacity, rate)
+        if granted < cost:
+            return self._denied(cost, remaining, rate), "redis"
+        return Decision(True, remaining, 0.0), "redis"
+
+    async def _redis_take(self, key: str, cost: float, take: float, capacity: float, rate: float):
+        granted, remaining = await self._script(
+            keys=[f"{self.namespace}:{key}"], args=[capacity, rate, cost, take],
+        )
+        return float(granted), float(remaining)
+
+    def _take_local(self, key: str, cost: float, capacity: float, rate: float) -> Decision:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._remember(self._buckets, key, [capacity, now])
+        else:
+            self._buckets.move_to_end(key)
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < cost:
+            return self._denied(cost, bucket[0], rate)
+        bucket[0] -= cost
+        return Decision(True, bucket[0], 0.0)
+
+    def _remember(self, entries: "OrderedDict[str, List[float]]", key: str, entry: List[float]) -> List[float]:
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > self.max_users:
+            entries.popitem(last=False)
+        return entry
+
+    def _denied(self, cost: float, remaining: float, rate: float) -> Decision:
+        return Decision(False, remaining, (cost - remaining) / rate)
+
+    def _record(self, route: str, bucket: str, path: str, decision: Decision, capacity: float):
+        outcome = "allowed" if decision.allowed else "limited"
+        _decisions.inc(route=route, bucket=bucket, outcome=outcome, path=path)
+        if decision.allowed and decision.remaining < capacity * self.near_miss_ratio:
+            _near_misses.inc(route=route, bucket=bucket)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis" if self.redis is not None else "memory",
+            "capacity": self.capacity,
+            "refill_rate": self.refill_rate,
+            "client_capacity": self.client_capacity,
+            "client_refill_rate": self.client_refill_rate,
+            "local_buckets": len(self._buckets),
+            "leases": len(self._leases),
+        }
+
+
+def rate_limit_key(request: Request, body: Any = None) -> str:
+    """
+    The user a request is charged to: the X-User-Id header, a `student_id` or `user_id` path
+    parameter, or an `id`, `user_id` or `student_id` field of a JSON body, in that order. Requests
+    without any of these are charged to the client address. None of these is authenticated; see
+    `client_key` for the bucket that backs this one up.
+    """
+    user = request.headers.get("x-user-id")
+    if not user:
+        params = request.path_params
+        user = params.get("student_id") or params.get("user_id")
+    if not user and isinstance(body, dict):
+        user = body.get("id") or body.get("user_id") or body.get("student_id")
+    if user:
+        return f"user:{user}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def client_key(request: Request) -> str:
+    """The client address bucket every request is charged to, whichever user it claims to be."""
+    return f"client:{request.client.host if request.client else 'unknown'}"
+
+
+async def enforce_rate_limit(request: Request):
+    """App-wide dependency; raises `RateLimitedError` when the client's or the user's bucket cannot pay for the route."""
+    route = request.scope.get("route")
+    path = getattr(route, "path", request.url.path)
+    if not rate_limiter.enabled or rate_limiter.cost(path) <= 0:
+        return
+    body = None
+    if request.headers.get("content-type", "").startswith("application/json"):
+        # FastAPI has already read the body to parse the request model, so this is served from memory
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+    decision = await rate_limiter.check(rate_limit_key(request, body), path, client=client_key(request))
+    if not decision.allowed:
+        raise RateLimitedError(f"Rate limit exceeded for {path}", retry_after=decision.retry_after)
+
+
+rate_limiter = RateLimiter.from_env()
+registry.gauge("rate_limiter", "Rate limiter configuration and per-process state", callback=rate_limiter.stats)
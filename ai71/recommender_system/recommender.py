@@ -1,7 +1,7 @@
-import aiohttp
 from typing import List, Dict
 from pydantic import BaseModel
 from ..api import OpenAIAPI
+from ..http_pool import http_pool
 import json
 import logging
 from urllib.parse import quote_plus
@@ -29,24 +29,24 @@ class ResourceRecommender:
     def _setup_logger(self):
         logger = logging.getLogger(__name__)
         logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
         return logger
 
     async def search_duckduckgo(self, query: str, num_results: int = 10) -> List[Dict]:
         encoded_query = quote_plus(query)
         url = f"https://api.duckduckgo.com/?q={encoded_query}&format=json&pretty=1"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data.get('Results', [])[:num_results]
-                else:
-                    self.logger.error(f"DuckDuckGo API request failed with status {response.status}")
-                    return []
+        async with http_pool.request("GET", url) as response:
+            if response.status == 200:
+                data = await response.json()
+                return data.get('Results', [])[:num_results]
+            else:
+                self.logger.error(f"DuckDuckGo API request failed with status {response.status}")
+                return []
 
     async def filter_and_enhance_resources(self, user: User, raw_resources: List[Dict]) -> List[Resource]:
         system_prompt = """
@@ -91,7 +91,7 @@ class ResourceRecommender:
         response = await self.openai_api.chat_completion([
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
-        ])
+        ], feature="recommender.enhance_resources")
 
         try:
             enhanced_resources = json.loads(response['choices'][0]['message']['content'])
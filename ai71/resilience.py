@@ -0,0 +1,291 @@
+# ai71/resilience.py
+"""
+Retries, deadlines and circuit breaking for upstream LLM calls.
+
+`Resilience.call(endpoint, attempt)` runs `attempt` (a zero-argument coroutine factory, invoked once
+per try) under three guards:
+
+* a per-endpoint deadline that bounds the whole call, including backoff sleeps and time spent
+  waiting for admission;
+* a retry policy with full-jitter exponential backoff that honours `Retry-After` on 429/503
+  responses and only retries errors that can succeed on a second try (429, 5xx, connection errors
+  and timeouts);
+* a circuit breaker per provider and endpoint that opens after consecutive upstream failures and
+  rejects calls immediately while open, letting a single probe through once the recovery timeout
+  has passed. A timeout only counts as a failure if the try was admitted (see `admission`);
+  running out of time while still queued for admission says nothing about the upstream. Only an
+  upstream answer (a success or a 4xx) closes the breaker; local errors leave it as it is.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+from .admission import track_admission
+from .exceptions import UpstreamUnavailableError
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+DEFAULT_DEADLINES = {
+    "chat/completions": 60.0,
+    "chat/completions:stream": 30.0,
+    "images/generations": 120.0,
+}
+
+_retries = registry.counter("llm_retries_total", "Retried upstream attempts by provider, endpoint and reason")
+_deadlines_exceeded = registry.counter("llm_deadline_exceeded_total", "Upstream calls abandoned at their deadline")
+_breaker_state = registry.gauge("llm_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)")
+_breaker_rejections = registry.counter("llm_circuit_rejections_total", "Calls rejected while a circuit was open")
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    pass
+
+
+def _openai():
+    # An openai error can only exist once openai was imported, so there is no need to import it here
+    return sys.modules.get("openai")
+
+
+def status_of(error: BaseException) -> Optional[int]:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status
+    openai = _openai()
+    if openai is not None and isinstance(error, openai.APIStatusError):
+        return error.status_code
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)):
+        return True
+    openai = _openai()
+    # APIConnectionError includes APITimeoutError
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """Seconds requested by a Retry-After header on the failed response, if any."""
+    headers = None
+    if isinstance(error, aiohttp.ClientResponseError):
+        headers = error.headers
+    elif _openai() is not None and isinstance(error, _openai().APIStatusError):
+        headers = error.response.headers
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Args:
+        max_attempts (int): Total tries, including the first one.
+        base_delay (float): Backoff ceiling of the first retry; doubles on every further retry.
+        max_delay (float): Upper bound of the jittered backoff.
+        max_retry_after (float): Longest Retry-After the policy is willing to wait for.
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0, max_retry_after: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Seconds to sleep before retry number `attempt` (1-based), or None to give up."""
+        if attempt >= self.max_attempts or not is_retryable(error):
+            return None
+        retry_after = retry_after_of(error)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            # A little jitter keeps clients told the same Retry-After from returning in lockstep
+            return retry_after + random.uniform(0, self.base_delay)
+        # Full jitter: uniform between zero and the exponential ceiling
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        _breaker_state.set(0, breaker=name)
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the call may go upstream."""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if remaining > 0:
+                _breaker_rejections.inc(breaker=self.name)
+                raise CircuitOpenError(f"Circuit for {self.name} is open", retry_after=remaining)
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # Only one probe at a time decides whether the upstream has recovered
+            if self._probing:
+                _breaker_rejections.inc(breaker=self.name)
+                raise CircuitOpenError(f"Circuit for {self.name} is half-open", retry_after=1.0)
+            self._probing = True
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def record_abandoned(self):
+        """The call ended without telling anything about upstream health, e.g. it was cancelled."""
+        self._probing = False
+
+    def _transition(self, state: str):
+        logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        _breaker_state.set(self._STATE_VALUES[state], breaker=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+# Breakers are shared by every client of the same provider in the process
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+class Resilience:
+    """
+    Per-provider retry, deadline and circuit breaker settings.
+
+    Args:
+        provider (str): Provider name, used in breaker names and metric labels.
+        policy (Optional[RetryPolicy]): Retry policy. Defaults to `RetryPolicy()`.
+        deadlines (Optional[Dict[str, float]]): Seconds per endpoint, merged over DEFAULT_DEADLINES.
+        failure_threshold (int): Consecutive upstream failures that open a breaker.
+        recovery_timeout (float): Seconds a breaker stays open before letting a probe through.
+    """
+    def __init__(self, provider: str, policy: Optional[RetryPolicy] = None, deadlines: Optional[Dict[str, float]] = None,
+                 failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.provider = provider
+        self.policy = policy or RetryPolicy()
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+    @classmethod
+    def from_env(cls, provider: str) -> "Resilience":
+        raw_deadlines = os.getenv("LLM_DEADLINES")
+        policy = RetryPolicy(
+            max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "8")),
+            max_retry_after=float(os.getenv("LLM_RETRY_MAX_RETRY_AFTER", "30")),
+        )
+        return cls(
+            provider,
+            policy=policy,
+            deadlines=json.loads(raw_deadlines) if raw_deadlines else None,
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            recovery_timeout=float(os.getenv("LLM_BREAKER_RECOVERY", "30")),
+        )
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        name = f"{self.provider}/{endpoint}"
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, self.failure_threshold, self.recovery_timeout)
+        return breaker
+
+    async def call(self, endpoint: str, attempt: Callable[[], Awaitable[Any]], deadline_key: Optional[str] = None) -> Any:
+        deadline_key = deadline_key or endpoint
+        breaker = self.breaker(endpoint)
+        budget = self.deadlines.get(deadline_key, DEFAULT_DEADLINES["chat/completions"])
+        deadline = time.monotonic() + budget
+        tries = 0
+        while True:
+            breaker.before_call()
+            tries += 1
+            remaining = deadline - time.monotonic()
+            try:
+                with track_admission() as ticket:
+                    result = await asyncio.wait_for(attempt(), remaining)
+            except UpstreamUnavailableError:
+                # Refused locally (e.g. by admission control); says nothing about upstream health
+                breaker.record_abandoned()
+                raise
+            except asyncio.TimeoutError as e:
+                if ticket.admitted:
+                    breaker.record_failure()
+                else:
+                    breaker.record_abandoned()
+                if time.monotonic() >= deadline:
+                    _deadlines_exceeded.inc(provider=self.provider, endpoint=deadline_key)
+                    raise DeadlineExceededError(f"{self.provider} {deadline_key} exceeded its {budget:.0f}s deadline") from e
+                error = e
+            except asyncio.CancelledError:
+                breaker.record_abandoned()
+                raise
+            except Exception as e:
+                if is_retryable(e):
+                    breaker.record_failure()
+                elif status_of(e) is not None:
+                    # The upstream answered, it just rejected this request
+                    breaker.record_success()
+                else:
+                    # A local error (e.g. parsing the response) says nothing about the upstream
+                    breaker.record_abandoned()
+                error = e
+            else:
+                breaker.record_success()
+                return result
+
+            delay = self.policy.backoff(tries, error)
+            if delay is None or time.monotonic() + delay >= deadline:
+                raise error
+            reason = status_of(error) or type(error).__name__
+            _retries.inc(provider=self.provider, endpoint=endpoint, reason=str(reason))
+            logger.warning(f"{self.provider} {endpoint} attempt {tries} failed ({reason}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def breaker_stats() -> Dict[str, Any]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+registry.gauge("llm_circuit_breakers", "Circuit breaker state per provider and endpoint", callback=breaker_stats)
@@ -0,0 +1,65 @@
+# ai71/single_flight.py
+"""
+Coalescing of identical concurrent calls.
+
+`SingleFlight.do(key, fn)` runs `fn` once per key at a time. Callers arriving while a call for the
+same key is in flight wait for that call and receive its result or exception instead of starting
+their own. The call runs in its own task, so a cancelled or timed-out waiter never cancels the work
+the other waiters depend on.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Args:
+        name (str): Label used for the metrics of this group.
+        wait_timeout (Optional[float]): Default seconds a caller waits for the shared call before
+            raising `asyncio.TimeoutError`. None waits indefinitely.
+    """
+    def __init__(self, name: str, wait_timeout: Optional[float] = None):
+        self.name = name
+        self.wait_timeout = wait_timeout
+        self._in_flight: Dict[str, "asyncio.Task[Any]"] = {}
+        self._calls = registry.counter("single_flight_calls_total", "Coalescable calls by role (leader runs upstream, follower shares it)")
+        self._active = registry.gauge("single_flight_in_flight", "Distinct calls currently in flight")
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], wait_timeout: Optional[float] = None) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+            self._calls.inc(group=self.name, role="leader")
+            self._active.inc(group=self.name)
+        else:
+            self._calls.inc(group=self.name, role="follower")
+
+        timeout = wait_timeout if wait_timeout is not None else self.wait_timeout
+        # shield() keeps the shared task alive when an individual waiter is cancelled or times out
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    @classmethod
+    def from_env(cls, name: str) -> "SingleFlight":
+        timeout = os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "120")
+        return cls(name, wait_timeout=float(timeout) if timeout else None)
+
+    def _finish(self, key: str, task: "asyncio.Task[Any]"):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._active.dec(group=self.name)
+        # Mark the exception as retrieved in case every waiter has already given up
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Shared {self.name} call for {key[:12]} failed: {task.exception()!r}")
+
+    def saved_calls(self) -> float:
+        return self._calls.value(group=self.name, role="follower")
+
@@ -0,0 +1,115 @@
+# ai71/sse.py
+"""
+Server-sent events helpers.
+
+`SSEParser` is an incremental parser for `text/event-stream` bodies as specified by the HTML living
+standard: it accepts arbitrary byte chunks (frames and even UTF-8 sequences may be split across
+network reads), understands CRLF, LF and CR line endings, multi-line `data:` fields, comments used
+as keep-alives, and the `event`, `id` and `retry` fields. `format_sse` encodes outgoing events.
+"""
+
+import codecs
+from typing import List, Optional
+
+
+class SSEEvent:
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, data: str, event: str = "message", id: Optional[str] = None, retry: Optional[int] = None):
+        self.data = data
+        self.event = event
+        self.id = id
+        self.retry = retry
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data!r}, id={self.id!r}, retry={self.retry!r})"
+
+
+class SSEParser:
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = ""
+        self._data: List[str] = []
+        self._event = ""
+        self._id: Optional[str] = None
+        self._retry: Optional[int] = None
+        self._first_chunk = True
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        text = self._decoder.decode(chunk)
+        if self._first_chunk and text:
+            # A leading byte order mark is ignored
+            text = text.lstrip("\ufeff")
+            self._first_chunk = False
+        self._buffer += text
+        return self._drain()
+
+    def close(self) -> List[SSEEvent]:
+        """Flushes the stream at EOF, dispatching a final event whose blank line never arrived."""
+        self._buffer += self._decoder.decode(b"", final=True)
+        events = self._drain(final=True)
+        if self._buffer:
+            self._process_line(self._buffer, events)
+            self._buffer = ""
+        if self._data:
+            self._dispatch(events)
+        return events
+
+    def _drain(self, final: bool = False) -> List[SSEEvent]:
+        events: List[SSEEvent] = []
+        buffer = self._buffer
+        start = 0
+        length = len(buffer)
+        while start < length:
+            cr = buffer.find("\r", start)
+            lf = buffer.find("\n", start)
+            if cr == -1 and lf == -1:
+                break
+            if cr != -1 and (lf == -1 or cr < lf):
+                if cr == length - 1 and not final:
+                    # A trailing CR may be the first half of a CRLF split across chunks
+                    break
+                end, next_start = cr, cr + 2 if buffer.startswith("\n", cr + 1) else cr + 1
+            else:
+                end, next_start = lf, lf + 1
+            self._process_line(buffer[start:end], events)
+            start = next_start
+        self._buffer = buffer[start:]
+        return events
+
+    def _process_line(self, line: str, events: List[SSEEvent]):
+        if not line:
+            self._dispatch(events)
+            return
+        if line.startswith(":"):
+            return  # Comment, typically a keep-alive
+        field, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self._id = value
+        elif field == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if self._data:
+            events.append(SSEEvent("\n".join(self._data), self._event or "message", self._id, self._retry))
+        self._data = []
+        self._event = ""
+        self._retry = None
+
+
+def format_sse(data: str, event: Optional[str] = None, id: Optional[str] = None) -> bytes:
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
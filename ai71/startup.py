@@ -0,0 +1,198 @@
+# ai71/startup.py
+"""
+Startup helpers: lazily constructed service components and a startup profiler.
+
+Service singletons (LLM clients, the dialogue manager, generators) are registered with a
+`ComponentRegistry` instead of being built at import time. `register` returns a proxy that builds
+its component, including importing its module, on first attribute access; `start` builds a set of
+components in parallel worker threads, e.g. from the application lifespan. Building, or waiting for
+a warm-up thread that is building, blocks the calling thread, so async code awaits `ready` for the
+components it uses before touching their proxies.
+
+`StartupProfiler` records named startup phases. With KODA_PROFILE_IMPORTS=true it also times every
+module imported after `ai71` itself (see `ai71/__init__.py`), so `/api/debug/startup` and the
+startup log show where cold-start time goes. This module only uses the standard library so that it
+can be loaded before anything heavy.
+"""
+
+import asyncio
+import builtins
+import importlib
+import importlib.util
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfiler:
+    def __init__(self, import_threshold: float = 0.001):
+        self.import_threshold = import_threshold
+        self.phases: Dict[str, float] = {}
+        self.imports: Dict[str, Dict[str, float]] = {}
+        self._original_import: Optional[Callable[..., Any]] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def profiling_imports(self) -> bool:
+        return self._original_import is not None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def install_import_timer(self):
+        if self._original_import is None:
+            self._original_import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def uninstall_import_timer(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original_import
+        try:
+            module_name = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__")) if level else name
+        except (ImportError, ValueError):
+            module_name = name
+        if module_name in sys.modules:
+            return original(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if elapsed >= self.import_threshold:
+                with self._lock:
+                    self.imports[module_name] = {"cumulative": elapsed, "self": elapsed - nested}
+
+    def report(self, top: int = 25) -> Dict[str, Any]:
+        with self._lock:
+            phases = dict(self.phases)
+            imports = sorted(self.imports.items(), key=lambda item: item[1]["cumulative"], reverse=True)
+        return {
+            "phases": {name: round(seconds, 4) for name, seconds in phases.items()},
+            "imports_profiled": self.profiling_imports,
+            "slowest_imports": [
+                {"module": module, "cumulative": round(times["cumulative"], 4), "self": round(times["self"], 4)}
+                for module, times in imports[:top]
+            ],
+        }
+
+    def log_report(self, top: int = 25):
+        report = self.report(top)
+        lines = [f"  phase {name}: {seconds:.3f}s" for name, seconds in report["phases"].items()]
+        lines += [f"  import {entry['module']}: {entry['cumulative']:.3f}s (self {entry['self']:.3f}s)" for entry in report["slowest_imports"]]
+        logger.info("Startup profile:\n" + "\n".join(lines))
+
+
+startup_profiler = StartupProfiler()
+
+
+class LazyComponent:
+    """Proxy that builds its component on first attribute access and then delegates to it."""
+
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry: "ComponentRegistry", name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self._registry.get(self._name), attribute)
+
+    def __repr__(self) -> str:
+        return f"LazyComponent({self._name!r}, started={self._registry.is_started(self._name)})"
+
+
+class ComponentRegistry:
+    """
+    Args:
+        package (str): Package that relative targets such as ".api:AI71API" are resolved against.
+        profiler (StartupProfiler): Records how long each component took to build.
+    """
+    def __init__(self, package: str, profiler: StartupProfiler = startup_profiler):
+        self.package = package
+        self.profiler = profiler
+        self._targets: Dict[str, str] = {}
+        self._instances: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+
+    def register(self, name: str, target: str) -> LazyComponent:
+        """Registers `target` ("module:ClassName") under `name` without importing or building it."""
+        self._targets[name] = target
+        self._locks[name] = threading.Lock()
+        return LazyComponent(self, name)
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        # Per-component lock: a request may need a component that a warm-up thread is still building
+        with self._locks[name]:
+            instance = self._instances.get(name)
+            if instance is None:
+                module_name, _, attribute = self._targets[name].partition(":")
+                with self.profiler.phase(f"component:{name}"):
+                    factory = getattr(importlib.import_module(module_name, self.package), attribute)
+                    instance = factory()
+                self._instances[name] = instance
+        return instance
+
+    def is_started(self, name: str) -> bool:
+        return name in self._instances
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._targets)
+
+    async def ready(self, *names: str):
+        """Returns once the given components are built, building them or waiting for them in worker threads."""
+        missing = [name for name in names if name not in self._instances]
+        if missing:
+            await asyncio.gather(*(asyncio.to_thread(self.get, name) for name in missing))
+
+    async def start(self, names: Optional[Iterable[str]] = None):
+        """Builds the given components (all by default) concurrently in worker threads."""
+        await self.ready(*(names if names is not None else self.names))
+
+    async def close(self):
+        for name, instance in list(self._instances.items()):
+            close = getattr(instance, "close", None)
+            if close is None:
+                continue
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error closing component {name}: {str(e)}")
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
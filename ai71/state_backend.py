@@ -0,0 +1,278 @@
+# ai71/state_backend.py
+"""
+Pluggable storage for state that has to be consistent across workers.
+
+Conversation memory, the dialogue manager's recent-turn cache and the gamification caches keep
+their state in a `StateBackend`. `InMemoryStateBackend` keeps it in the process, which is correct
+for a single worker. `RedisStateBackend` keeps it in Redis, so every uvicorn worker and every node
+sees the same conversations and caches.
+
+Components hold the module-level `state_backend`, which starts in memory and switches to Redis once
+the application attaches its `redis.asyncio` client (see `init_rate_limiting` in `main.py`) when
+STATE_BACKEND=redis. Values must be JSON-serializable and must not be mutated after being stored or
+returned, since the in-memory backend hands out the stored objects themselves.
+"""
+
+import abc
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_operations = registry.counter("state_backend_operations_total", "State backend operations by backend and operation")
+
+
+class StateBackend(abc.ABC):
+    """Interface of the state backends. Keys are strings; `ttl` is in seconds, None keeps the key."""
+
+    name = "abstract"
+    # True when other processes see the same state
+    shared = False
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, *keys: str):
+        ...
+
+    @abc.abstractmethod
+    async def set_add(self, key: str, member: str, ttl: Optional[float] = None):
+        ...
+
+    @abc.abstractmethod
+    async def set_members(self, key: str) -> Set[str]:
+        ...
+
+    @abc.abstractmethod
+    async def list_replace(self, key: str, items: List[Any], max_len: int, ttl: Optional[float] = None):
+        """Stores the last `max_len` of `items` as the list at `key`; an empty list deletes the key."""
+
+    @abc.abstractmethod
+    async def list_append(self, key: str, item: Any, max_len: int, ttl: Optional[float] = None) -> bool:
+        """Appends to an existing list, keeping its last `max_len` items. Returns False if there is no list."""
+
+    @abc.abstractmethod
+    async def list_tail(self, key: str, count: int) -> Optional[List[Any]]:
+        """The last `count` items of the list at `key`, oldest first, or None if there is no list."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    Args:
+        max_keys (int): Keys kept in the process; least recently used are evicted first.
+    """
+    name = "memory"
+
+    def __init__(self, max_keys: int = 50000):
+        self.max_keys = max_keys
+        self._data: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+
+    def _read(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _write(self, key: str, value: Any, ttl: Optional[float]):
+        self._data[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self._read(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._write(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def set_add(self, key: str, member: str, ttl: Optional[float] = None):
+        members = self._read(key) or set()
+        members.add(member)
+        self._write(key, members, ttl)
+
+    async def set_members(self, key: str) -> Set[str]:
+        return set(self._read(key) or ())
+
+    async def list_replace(self, key: str, items: List[Any], max_len: int, ttl: Optional[float] = None):
+        if items:
+            self._write(key, list(items[-max_len:]), ttl)
+        else:
+            self._data.pop(key, None)
+
+    async def list_append(self, key: str, item: Any, max_len: int, ttl: Optional[float] = None) -> bool:
+        items = self._read(key)
+        if items is None:
+            return False
+        items.append(item)
+        del items[:-max_len]
+        self._write(key, items, ttl)
+        return True
+
+    async def list_tail(self, key: str, count: int) -> Optional[List[Any]]:
+        items = self._read(key)
+        return list(items[-count:]) if items is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "keys": len(self._data)}
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Args:
+        client: A `redis.asyncio` client created with `decode_responses=True`.
+        namespace (str): Prefix of every key.
+    """
+    name = "redis"
+    shared = True
+
+    def __init__(self, client, namespace: str = "koda:state"):
+        self.redis = client
+        self.namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    @staticmethod
+    def _ms(ttl: Optional[float]) -> Optional[int]:
+        return max(int(ttl * 1000), 1) if ttl is not None else None
+
+    async def get(self, key: str) -> Optional[Any]:
+        _operations.inc(backend=self.name, operation="get")
+        raw = await self.redis.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        _operations.inc(backend=self.name, operation="set")
+        await self.redis.set(self._key(key), json.dumps(value, default=str), px=self._ms(ttl))
+
+    async def delete(self, *keys: str):
+        if keys:
+            _operations.inc(backend=self.name, operation="delete")
+            await self.redis.delete(*(self._key(key) for key in keys))
+
+    async def set_add(self, key: str, member: str, ttl: Optional[float] = None):
+        _operations.inc(backend=self.name, operation="set_add")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.sadd(self._key(key), member)
+            if ttl is not None:
+                pipe.pexpire(self._key(key), self._ms(ttl))
+            await pipe.execute()
+
+    async def set_members(self, key: str) -> Set[str]:
+        _operations.inc(backend=self.name, operation="set_members")
+        return set(await self.redis.smembers(self._key(key)))
+
+    async def list_replace(self, key: str, items: List[Any], max_len: int, ttl: Optional[float] = None):
+        _operations.inc(backend=self.name, operation="list_replace")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(key))
+            if items:
+                pipe.rpush(self._key(key), *(json.dumps(item, default=str) for item in items[-max_len:]))
+                if ttl is not None:
+                    pipe.pexpire(self._key(key), self._ms(ttl))
+            await pipe.execute()
+
+    async def list_append(self, key: str, item: Any, max_len: int, ttl: Optional[float] = None) -> bool:
+        _operations.inc(backend=self.name, operation="list_append")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            # RPUSHX only appends to an existing list, so a missing entry is never recreated partially
+            pipe.rpushx(self._key(key), json.dumps(item, default=str))
+            pipe.ltrim(self._key(key), -max_len, -1)
+            if ttl is not None:
+                pipe.pexpire(self._key(key), self._ms(ttl))
+            length, *_ = await pipe.execute()
+        return bool(length)
+
+    async def list_tail(self, key: str, count: int) -> Optional[List[Any]]:
+        _operations.inc(backend=self.name, operation="list_tail")
+        items = await self.redis.lrange(self._key(key), -count, -1)
+        # A missing key and an empty list look the same; list_replace never stores an empty list
+        return [json.loads(item) for item in items] if items else None
+
+
+class ConfiguredStateBackend(StateBackend):
+    """
+    Delegates to the backend selected by STATE_BACKEND ("memory" or "redis"). Until a Redis client
+    is attached, and whenever STATE_BACKEND=memory, the in-memory backend is used.
+    """
+    def __init__(self, kind: str = "memory", max_keys: int = 50000, namespace: str = "koda:state"):
+        self.kind = kind
+        self.namespace = namespace
+        self.target: StateBackend = InMemoryStateBackend(max_keys)
+        registry.gauge("state_backend", "State backend in use", callback=self.stats)
+
+    @classmethod
+    def from_env(cls) -> "ConfiguredStateBackend":
+        return cls(
+            kind=os.getenv("STATE_BACKEND", "memory").lower(),
+            max_keys=int(os.getenv("STATE_MEMORY_MAX_KEYS", "50000")),
+            namespace=os.getenv("STATE_REDIS_NAMESPACE", "koda:state"),
+        )
+
+    def attach_redis(self, client):
+        """Switches to Redis if STATE_BACKEND=redis; state held in memory until then is not carried over."""
+        if self.kind == "redis":
+            self.target = RedisStateBackend(client, self.namespace)
+            logger.info("State backend: redis")
+
+    @property
+    def name(self) -> str:
+        return self.target.name
+
+    @property
+    def shared(self) -> bool:
+        return self.target.shared
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await self.target.get(key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self.target.set(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        await self.target.delete(*keys)
+
+    async def set_add(self, key: str, member: str, ttl: Optional[float] = None):
+        await self.target.set_add(key, member, ttl)
+
+    async def set_members(self, key: str) -> Set[str]:
+        return await self.target.set_members(key)
+
+    async def list_replace(self, key: str, items: List[Any], max_len: int, ttl: Optional[float] = None):
+        await self.target.list_replace(key, items, max_len, ttl)
+
+    async def list_append(self, key: str, item: Any, max_len: int, ttl: Optional[float] = None) -> bool:
+        return await self.target.list_append(key, item, max_len, ttl)
+
+    async def list_tail(self, key: str, count: int) -> Optional[List[Any]]:
+        return await self.target.list_tail(key, count)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.target.stats()
+
+
+state_backend = ConfiguredStateBackend.from_env()
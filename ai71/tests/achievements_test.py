@@ -0,0 +1,65 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from ai71.database import Achievement, Base, UserAchievement
+from ai71.pagination import fetch_page, stream_ndjson
+from ai71.queries import user_achievement_response, user_achievements_query
+from ai71.tests.query_counter import assert_max_queries, count_queries
+
+
+async def make_db(achievements_per_user):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with sessions() as db:
+        for user_id, count in achievements_per_user.items():
+            for i in range(count):
+                achievement = Achievement(name=f"a{i}", description="d", criteria="c", points=i)
+                db.add(achievement)
+                db.add(UserAchievement(user_id=user_id, achievement=achievement, unlocked_at=datetime(2024, 1, 1) + timedelta(minutes=i)))
+        await db.commit()
+    return engine, sessions
+
+
+async def read_page(engine, sessions, user_id, limit):
+    async with sessions() as db:
+        with count_queries(engine) as counter:
+            rows, cursor = await fetch_page(db, user_achievements_query(user_id), UserAchievement.unlocked_at,
+                                            UserAchievement.id, limit, scalars=False)
+            responses = [user_achievement_response(row) for row in rows]
+    return responses, cursor, counter.count
+
+
+def test_achievement_page_costs_one_query_regardless_of_size():
+    async def run():
+        engine, sessions = await make_db({1: 5, 2: 500})
+        small, _, small_queries = await read_page(engine, sessions, 1, 1000)
+        large, cursor, large_queries = await read_page(engine, sessions, 2, 1000)
+        assert len(small) == 5 and len(large) == 500 and cursor is None
+        assert small_queries == large_queries == 1
+        assert large[0].achievement.name == "a499" and large[0].achievement.points == 499
+        await engine.dispose()
+    asyncio.run(run())
+
+
+def test_streamed_achievements_cost_constant_queries():
+    async def run():
+        engine, sessions = await make_db({2: 500})
+        query = user_achievements_query(2).order_by(UserAchievement.id)
+        serialize = lambda row: user_achievement_response(row).model_dump_json()
+        with assert_max_queries(engine, 1):
+            chunks = [chunk async for chunk in stream_ndjson(sessions, query, serialize, yield_per=100, scalars=False)]
+        assert len(b"".join(chunks).splitlines()) == 500
+        await engine.dispose()
+    asyncio.run(run())
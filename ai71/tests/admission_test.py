@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from ai71 import admission
+from ai71.admission import AdmissionController, AdmissionRejected
+
+
+def controller(**limits):
+    return AdmissionController({"test": {"max_concurrency": 1, "rpm": 100, "tpm": 1000, "max_queue": 10, "max_wait": 5.0, **limits}})
+
+
+def test_waiters_are_admitted_in_arrival_order_and_never_overtaken():
+    order = []
+
+    async def request(limits, name, tokens):
+        async with limits.slot("test", "model", tokens):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def run():
+        limits = controller(max_concurrency=1, tpm=1000)
+        async with limits.slot("test", "model", 100):
+            # "large" only fits once the first 100 tokens leave the window, but "small" still waits behind it
+            tasks = [asyncio.create_task(request(limits, name, tokens)) for name, tokens in
+                     [("first", 100), ("second", 100), ("large", 900), ("small", 1)]]
+            await asyncio.sleep(0.01)
+            assert order == [] and limits.limiter("test", "model").stats()["queued"] == 4
+        await asyncio.sleep(0.05)
+        assert order == ["first", "second"]
+        limiter = limits.limiter("test", "model")
+        assert limiter.stats()["queued"] == 2 and limiter.retry_after(900) >= 1
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert limiter.stats()["in_flight"] == 0 and limiter.stats()["queued"] == 0
+
+    asyncio.run(run())
+
+
+def test_token_window_admits_again_as_entries_expire(monkeypatch):
+    monkeypatch.setattr(admission, "WINDOW_SECONDS", 0.2)
+
+    async def run():
+        limits = controller(max_concurrency=4, tpm=100)
+        async with limits.slot("test", "model", 60):
+            pass
+        started = asyncio.get_running_loop().time()
+        async with limits.slot("test", "model", 60):
+            waited = asyncio.get_running_loop().time() - started
+        assert 0.1 < waited < 1.0
+        # A request above the whole budget is capped to it rather than never admitted
+        async with limits.slot("test", "model", 10_000):
+            pass
+
+    asyncio.run(run())
+
+
+def test_full_queue_and_long_waits_are_rejected_without_leaking_slots():
+    async def run():
+        limits = controller(max_queue=1, max_wait=0.05)
+        limiter = limits.limiter("test", "model")
+        async with limits.slot("test", "model"):
+            queued = asyncio.create_task(limiter.acquire(0))
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected) as rejected:
+                await limiter.acquire(0)
+            assert rejected.value.retry_after >= 1
+            with pytest.raises(AdmissionRejected):
+                await queued
+        assert limiter.stats()["in_flight"] == 0 and limiter.stats()["queued"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from ai71.bulk_ingest import BulkIngester
+from ai71.database import Base, User, UserAchievement
+from ai71.tests.query_counter import count_queries
+
+
+async def make_db():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def items(values):
+    for value in values:
+        yield value
+
+
+def user(user_id, username=None):
+    return {"id": user_id, "username": username or user_id, "email": f"{user_id}@example.com"}
+
+
+def test_clean_chunks_cost_one_insert_each():
+    async def run():
+        engine, sessions = await make_db()
+        async with sessions() as db:
+            with count_queries(engine) as counter:
+                report = await BulkIngester(chunk_size=5).ingest("users", items([user(f"u{i}") for i in range(10)]), db)
+            inserts = [statement for statement in counter.statements if statement.startswith("INSERT")]
+            assert report["received"] == 10 and report["created"] == 10
+            assert len(inserts) == 2
+            assert (await db.execute(select(User.id))).scalars().all() == [f"u{i}" for i in range(10)]
+        await engine.dispose()
+    asyncio.run(run())
+
+
+def test_failing_chunk_is_retried_row_by_row():
+    async def run():
+        engine, sessions = await make_db()
+        async with sessions() as db:
+            db.add(User(id="u0", username="taken", email="u0@example.com"))
+            await db.commit()
+            values = [user("u1"), user("u2", username="taken"), {"id": "u3"}, user("u4"), user("u4", username="four"), user("u0", username="zero")]
+            report = await BulkIngester(chunk_size=2).ingest("users", items(values), db)
+            statuses = [(result["index"], result["status"]) for result in report["results"]]
+            assert statuses == [(0, "created"), (1, "failed"), (2, "invalid"), (3, "duplicate"), (4, "created"), (5, "updated")]
+            assert "email" in report["results"][2]["error"]
+            users = dict((await db.execute(select(User.id, User.username))).all())
+            assert users == {"u0": "zero", "u1": "u1", "u4": "four"}
+        await engine.dispose()
+    asyncio.run(run())
+
+
+def test_reimported_achievements_keep_their_first_unlock():
+    async def run():
+        engine, sessions = await make_db()
+        async with sessions() as db:
+            first = [{"user_id": 1, "achievement_id": 1, "unlocked_at": "2024-01-01T00:00:00"}]
+            again = [{"user_id": 1, "achievement_id": 1, "unlocked_at": "2024-06-01T00:00:00"}, {"user_id": 1, "achievement_id": 2}]
+            await BulkIngester().ingest("user-achievements", items(first), db)
+            report = await BulkIngester().ingest("user-achievements", items(again), db)
+            assert [result["status"] for result in report["results"]] == ["exists", "created"]
+            unlocks = (await db.execute(select(UserAchievement.achievement_id, UserAchievement.unlocked_at))).all()
+            assert len(unlocks) == 2 and dict(unlocks)[1].month == 1
+        await engine.dispose()
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+
+from ai71.api import ConversationMemoryMixin
+from ai71.conversation_memory import ConversationMemoryStore
+from ai71.user_provisioning import UserConflictError
+
+
+class Client(ConversationMemoryMixin):
+    def __init__(self, memory):
+        self.memory = memory
+
+
+class ObservedMemory(ConversationMemoryStore):
+    """Signals when a read starts and holds it until `release` is set."""
+    def __init__(self):
+        super().__init__(backend=None)
+        self.reading, self.release = asyncio.Event(), asyncio.Event()
+
+    async def get_messages(self, student_id, character):
+        self.reading.set()
+        await self.release.wait()
+        return await super().get_messages(student_id, character)
+
+
+def test_provisioning_overlaps_the_memory_read_and_precedes_the_persona_write():
+    async def run():
+        memory = ObservedMemory()
+        await memory.add_turns("s1", "koda", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+
+        async def provision():
+            # Only completes if the read is already running
+            await asyncio.wait_for(memory.reading.wait(), 1)
+            assert (await ConversationMemoryStore.get_messages(memory, "s1", "koda"))[0]["role"] == "user"
+            memory.release.set()
+
+        messages = await Client(memory).memory_messages("s1", "koda", "You are Koda.", alongside=provision())
+        assert [message["role"] for message in messages] == ["system", "user", "assistant"]
+        assert (await ConversationMemoryStore.get_messages(memory, "s1", "koda"))[0] == {"role": "system", "content": "You are Koda."}
+
+    asyncio.run(run())
+
+
+def test_conflicting_request_leaves_memory_untouched():
+    async def run():
+        memory = ObservedMemory()
+        memory.release.set()
+
+        async def conflict():
+            raise UserConflictError("username taken")
+
+        with pytest.raises(UserConflictError):
+            await Client(memory).memory_messages("s2", "koda", "You are Koda.", alongside=conflict())
+        assert await memory.get_messages("s2", "koda") == []
+        assert memory.stats()["conversations"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from ai71.curriculum.cache import CurriculumCache, not_modified
+from ai71.database import Base, Curriculum
+
+
+async def make_cache():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    return engine, sessions, CurriculumCache(session_factory=sessions)
+
+
+async def write(sessions, title):
+    async with sessions() as db:
+        row = Curriculum(curriculum=json.dumps({"title": title}), created_at=datetime(2024, 1, 1, 12, 0, 0, 500),
+                         updated_at=datetime(2024, 1, 1, 12, 0, 0, 500))
+        db.add(row)
+        await db.commit()
+        return row.id
+
+
+def test_conditional_headers_answer_304_only_for_the_cached_version():
+    async def run():
+        engine, sessions, cache = await make_cache()
+        cached = await cache.get(await write(sessions, "fractions"))
+        await engine.dispose()
+        assert cached.headers["Last-Modified"] == "Mon, 01 Jan 2024 12:00:00 GMT"
+
+        assert not_modified(cached, cached.etag, None)
+        assert not_modified(cached, f'"other", W/{cached.etag}', None)
+        assert not_modified(cached, "*", None)
+        assert not not_modified(cached, '"other"', None)
+        # If-None-Match takes precedence over If-Modified-Since
+        assert not not_modified(cached, '"other"', "Tue, 02 Jan 2024 00:00:00 GMT")
+
+        assert not_modified(cached, None, "Mon, 01 Jan 2024 12:00:00 GMT")
+        assert not not_modified(cached, None, "Mon, 01 Jan 2024 11:59:59 GMT")
+        assert not not_modified(cached, None, "not a date")
+        assert not not_modified(cached, None, None)
+    asyncio.run(run())
+
+
+def test_latest_read_after_a_write_never_joins_an_older_load():
+    async def run():
+        engine, sessions, cache = await make_cache()
+        first = await write(sessions, "first")
+        started, release = asyncio.Event(), asyncio.Event()
+
+        class StalledSession:
+            """Answers with the newest id as of entering, after the test releases it."""
+            async def __aenter__(self):
+                async with sessions() as db:
+                    self.result = (await db.execute(select(Curriculum.id).order_by(Curriculum.id.desc()).limit(1))).scalar()
+                started.set()
+                await release.wait()
+                return self
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+            async def execute(self, query):
+                return SimpleNamespace(scalar=lambda: self.result)
+
+        cache.session_factory = StalledSession
+        before_write = asyncio.ensure_future(cache.latest())
+        await started.wait()
+        cache.session_factory = sessions
+        second = await write(sessions, "second")
+        cache.invalidate()
+        after_write = asyncio.ensure_future(cache.latest())
+        await asyncio.sleep(0.01)
+        release.set()
+        loaded = [(await before_write).id, (await after_write).id]
+        await engine.dispose()
+        assert loaded == [first, second]
+    asyncio.run(run())
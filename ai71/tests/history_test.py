@@ -0,0 +1,133 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("ASYNC_DATABASE_URL", "sqlite+aiosqlite://")
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from ai71.database import Base, ConversationHistory
+from ai71.dialogue_management import history
+from ai71.dialogue_management.history import ConversationHistoryStore
+from ai71.state_backend import InMemoryStateBackend
+
+
+async def make_store(**options):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    options = {"flush_interval": 60, "session_factory": sessions, "backend": InMemoryStateBackend(), **options}
+    return engine, sessions, ConversationHistoryStore(**options)
+
+
+async def stored(sessions):
+    async with sessions() as db:
+        return (await db.execute(select(ConversationHistory.content).order_by(ConversationHistory.id))).scalars().all()
+
+
+def test_a_full_batch_is_flushed_without_waiting_for_the_interval():
+    async def run():
+        engine, sessions, store = await make_store(batch_size=3)
+        await store.append("s1", "koda", "user", "one")
+        await store.append("s1", "koda", "assistant", "two")
+        await asyncio.sleep(0.05)
+        before = await stored(sessions)
+        third = await store.append("s1", "koda", "user", "three")
+        await asyncio.sleep(0.05)
+        after = await stored(sessions)
+        await store.close()
+        await engine.dispose()
+        assert before == [] and after == ["one", "two", "three"]
+        assert third["id"] == 3 and store.stats()["pending"] == 0
+    asyncio.run(run())
+
+
+def test_failed_flush_is_requeued_and_bad_rows_are_dropped_one_by_one():
+    async def run():
+        engine, sessions, store = await make_store(batch_size=2)
+
+        def unreachable():
+            raise ConnectionError("database is down")
+
+        store.session_factory = unreachable
+        for content in ["one", "two", "three"]:
+            await store.append("s1", "koda", "user", content)
+        await store.flush()
+        requeued = [turn["content"] for turn in store._pending]
+
+        store.session_factory = sessions
+        # Content is required, so this turn fails its batch and is then rejected on its own
+        await store.append("s1", "koda", "user", None)
+        await store.append("s1", "koda", "user", "four")
+        await store.close()
+        written = await stored(sessions)
+        await engine.dispose()
+        assert requeued == ["one", "two", "three"]
+        assert written == ["one", "two", "three", "four"] and store.stats()["pending"] == 0
+    asyncio.run(run())
+
+
+def test_turn_appended_while_the_cache_loads_is_not_lost():
+    async def run():
+        engine, sessions, store = await make_store()
+        await store.append("s1", "koda", "user", "earlier")
+        await store.flush()
+        await store.backend.delete(store._hot_key("s1", "koda"))
+
+        querying, release = asyncio.Event(), asyncio.Event()
+        query = store._query
+
+        async def slow_query(*args):
+            rows = await query(*args)
+            querying.set()
+            await release.wait()
+            return rows
+
+        store._query = slow_query
+        loading = asyncio.create_task(store.recent("s1", "koda"))
+        await querying.wait()
+        await store.append("s1", "koda", "assistant", "late")
+        release.set()
+        loaded = [turn["content"] for turn in await loading]
+        store._query = query
+        cached = [turn["content"] for turn in await store.recent("s1", "koda")]
+        await store.close()
+        await engine.dispose()
+        assert loaded == cached == ["earlier", "late"]
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("frozen_clock", [False, True])
+def test_page_cursors_walk_the_whole_history_once(monkeypatch, frozen_clock):
+    if frozen_clock:
+        # Turns appended within one clock tick share their timestamp
+        now = datetime(2024, 1, 1)
+        monkeypatch.setattr(history, "datetime", type("Clock", (datetime,), {"utcnow": staticmethod(lambda: now)}))
+
+    async def run():
+        engine, sessions, store = await make_store(hot_turns=4, batch_size=1000)
+        for index in range(6):
+            await store.append("s1", "koda", "user", f"written {index}")
+        await store.flush()
+        for index in range(5):
+            await store.append("s1", "koda", "user", f"buffered {index}")
+
+        pages, cursor = [], None
+        while True:
+            page = await store.page("s1", "koda", limit=3, before=cursor)
+            pages.append([turn["content"] for turn in page["history"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        await store.close()
+        await engine.dispose()
+        walked = [content for page in reversed(pages) for content in page]
+        assert walked == [f"written {index}" for index in range(6)] + [f"buffered {index}" for index in range(5)]
+    asyncio.run(run())
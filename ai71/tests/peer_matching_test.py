@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from ai71.peer_matching.blocking import HierarchicalGroupOptimizer
+from ai71.peer_matching.compatibility import CohortEncoding, compatibility_matrix
+from ai71.peer_matching.matcher import PeerMatcher, User
+from ai71.peer_matching.optimizer import SwapOptimizer, _Partition, greedy_groups, partition_score
+from ai71.peer_matching.pairing import max_weight_matching, optimal_pairs
+from ai71.peer_matching.parallel import ParallelGroupOptimizer, best_result, restart_seeds
+
+SKILLS = ["math", "programming", "writing", "biology", "art"]
+STYLES = ["visual", "auditory", "kinesthetic", "reading"]
+INTERESTS = ["AI", "robotics", "music", "history", "space", "games", "ecology", "chess", "film"]
+TRAITS = ["creative", "analytical", "outgoing", "curious", "organized", "empathetic", "practical"]
+
+
+def make_cohort(size, seed=0):
+    rng = random.Random(seed)
+    return [
+        User(
+            id=i,
+            name=f"student{i}",
+            skills={skill: rng.random() for skill in rng.sample(SKILLS, rng.randint(0, 4))},
+            learning_style=rng.choice(STYLES),
+            interests=rng.sample(INTERESTS, rng.randint(0, 4)),
+            personality_traits=rng.sample(TRAITS, rng.randint(0, 3)),
+        )
+        for i in range(size)
+    ]
+
+
+def test_compatibility_matrix_matches_scalar_scores_exactly():
+    matcher = PeerMatcher()
+    users = make_cohort(60)
+    matrix = matcher.compatibility_matrix(users)
+    for i in range(len(users)):
+        for j in range(len(users)):
+            if i != j:
+                assert matrix[i, j] == matcher.calculate_pair_compatibility(users[i], users[j])
+    groups = [list(range(k, min(k + 4, len(users)))) for k in range(0, len(users), 4)]
+    for group in groups + [[5], [7, 3, 11]]:
+        assert matcher.evaluate_group_indices(matrix, group) == matcher.evaluate_group([users[i] for i in group])
+
+
+def test_monte_carlo_returns_every_user_once():
+    np.random.seed(1)
+    users = make_cohort(23)
+    groups, score = PeerMatcher().monte_carlo_group_formation(users, group_size=3, iterations=50)
+    assert sorted(user.id for group in groups for user in group) == list(range(23))
+    assert 0 <= score <= 1
+
+
+def test_swap_deltas_match_rescoring_and_annealing_beats_the_greedy_seed():
+    matcher = PeerMatcher()
+    matrix = matcher.compatibility_matrix(make_cohort(41))
+    seed = greedy_groups(matrix, 4)
+    state = _Partition(matrix, seed)
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        a, b = state.random_swap(rng)
+        before = state.score()
+        delta = state.swap_delta(a, b)
+        state.swap(a, b)
+        assert abs(state.score() - before - delta) < 1e-12
+
+    result = SwapOptimizer(max_iterations=3000, time_budget=None).optimize(matrix, 4, seed=3)
+    assert sorted(i for group in result.groups for i in group) == list(range(41))
+    assert [len(group) for group in result.groups] == [4] * 10 + [1]
+    assert result.score >= partition_score(matrix, seed)
+    assert result.score == pytest.approx(result.trace[-1])
+    assert result.groups == SwapOptimizer(max_iterations=3000, time_budget=None).optimize(matrix, 4, seed=3).groups
+
+
+def test_parallel_restarts_are_reproducible_and_match_sequential_runs():
+    matrix = PeerMatcher().compatibility_matrix(make_cohort(30))
+    optimizer = ParallelGroupOptimizer(workers=2, restarts=3, min_parallel_size=0, options={"max_iterations": 500, "time_budget": None})
+    try:
+        first = asyncio.run(optimizer.optimize(matrix, 3, seed=7))
+        second = asyncio.run(optimizer.optimize(matrix, 3, seed=7))
+    finally:
+        optimizer.close()
+    sequential = [SwapOptimizer(max_iterations=500, time_budget=None).optimize(matrix, 3, seed=s) for s in restart_seeds(7, 3)]
+    assert first.groups == second.groups == best_result(sequential).groups
+    assert first.score == max(result.score for result in sequential)
+
+
+def best_pairing_by_brute_force(matrix):
+    size = len(matrix)
+    best = float("-inf")
+    for order in itertools.permutations(range(size)):
+        if all(order[i] < order[i + 1] for i in range(0, size - 1, 2)):
+            best = max(best, partition_score(matrix, [list(order[i:i + 2]) for i in range(0, size, 2)]))
+    return best
+
+
+def test_optimal_pairs_match_brute_force():
+    matcher = PeerMatcher()
+    for size, seed in [(2, 0), (5, 1), (6, 2), (7, 3), (8, 4)]:
+        matrix = matcher.compatibility_matrix(make_cohort(size, seed))
+        result = optimal_pairs(matrix)
+        assert sorted(i for group in result.groups for i in group) == list(range(size))
+        assert [len(group) for group in result.groups] == [2] * (size // 2) + [1] * (size % 2)
+        assert result.score == pytest.approx(best_pairing_by_brute_force(matrix), abs=1e-8)
+        # Skill levels are not validated, so compatibilities may be far below -1
+        shifted = optimal_pairs(matrix * 1000 - 5000)
+        assert shifted.score == pytest.approx(best_pairing_by_brute_force(matrix * 1000 - 5000), abs=1e-5)
+
+    rng = np.random.default_rng(0)
+    for size in range(1, 10):
+        weights = np.triu(rng.integers(1, 4, size=(size, size)), 1)
+        weights += weights.T
+        mates, _ = max_weight_matching(weights)
+        best = best_pairing_by_brute_force(weights.astype(float)) * (size // 2 + size % 2)
+        assert sum(weights[i, mate] for i, mate in enumerate(mates) if mate > i) == pytest.approx(best)
+
+
+def test_hierarchical_grouping_keeps_buckets_bounded_and_repair_never_hurts():
+    encoding = CohortEncoding(make_cohort(101, 5))
+    optimizer = HierarchicalGroupOptimizer(bucket_size=20, repair_size=24, options={"max_iterations": 500, "time_budget": None})
+    buckets = optimizer.buckets(encoding.features(), 3, np.random.default_rng(0))
+    assert sorted(np.concatenate(buckets).tolist()) == list(range(101))
+    assert all(len(bucket) <= 20 for bucket in buckets)
+    assert all(len(bucket) % 3 == 0 for bucket in buckets[:-1])
+
+    result = optimizer.optimize(encoding, 3, seed=2)
+    assert sorted(i for group in result.groups for i in group) == list(range(101))
+    assert [len(group) for group in result.groups] == [3] * 33 + [2]
+    assert result.trace[1] >= result.trace[0]
+    assert result.score == pytest.approx(partition_score(compatibility_matrix(encoding), result.groups))
+    assert optimizer.optimize(encoding, 3, seed=2).groups == result.groups
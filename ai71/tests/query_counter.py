@@ -0,0 +1,38 @@
+# ai71/tests/query_counter.py
+"""Counts the SQL statements an engine executes, to pin down round trips in tests."""
+
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    """Records statements run on `engine` (sync or async) inside the block."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    counter = QueryCounter()
+    event.listen(sync_engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", counter)
+
+
+@contextmanager
+def assert_max_queries(engine, expected: int):
+    with count_queries(engine) as counter:
+        yield counter
+    assert counter.count <= expected, f"expected at most {expected} queries, got {counter.count}:\n" + "\n".join(counter.statements)
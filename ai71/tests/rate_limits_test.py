@@ -0,0 +1,74 @@
+import asyncio
+
+from ai71.rate_limits import RateLimiter
+
+
+class FakeRedis:
+    """Stands in for the Lua token bucket: no refill, so every grant is visible in `tokens`."""
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.tokens = {}
+        self.calls = 0
+
+    def register_script(self, script):
+        async def run(keys, args):
+            self.calls += 1
+            if self.fail:
+                raise ConnectionError("redis is down")
+            capacity, _, cost, take = args
+            tokens = self.tokens.get(keys[0], capacity)
+            granted = min(take, tokens) if tokens >= cost else 0
+            self.tokens[keys[0]] = tokens - granted
+            return [str(granted), str(tokens - granted)]
+        return run
+
+
+def test_local_bucket_denies_once_spent_and_reports_retry_after():
+    limiter = RateLimiter(capacity=3, refill_rate=0.5, client_capacity=0, costs={"/cheap": 1})
+
+    async def spend():
+        return [await limiter.check("user:a", "/cheap") for _ in range(4)]
+
+    decisions = asyncio.run(spend())
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    assert 1.9 < decisions[-1].retry_after <= 2.0
+
+
+def test_cheap_requests_are_served_from_leased_credits():
+    limiter = RateLimiter(capacity=100, client_capacity=0, lease_size=10, costs={"/cheap": 1, "/costly": 20})
+    redis = FakeRedis()
+    limiter.attach_redis(redis)
+
+    async def spend():
+        for _ in range(10):
+            assert (await limiter.check("user:a", "/cheap")).allowed
+        assert redis.calls == 1 and redis.tokens["koda:ratelimit:user:a"] == 90
+        assert (await limiter.check("user:a", "/cheap")).allowed
+        assert redis.calls == 2
+        # Costly requests are never served from the lease
+        assert (await limiter.check("user:a", "/costly")).allowed
+        assert redis.calls == 3 and redis.tokens["koda:ratelimit:user:a"] == 60
+
+    asyncio.run(spend())
+
+
+def test_client_bucket_limits_requests_spread_over_made_up_users():
+    limiter = RateLimiter(capacity=10, client_capacity=15, costs={"/route": 5})
+
+    async def spend():
+        return [await limiter.check(f"user:{index}", "/route", client="client:10.0.0.1") for index in range(4)]
+
+    decisions = asyncio.run(spend())
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    # The refused request was not charged to its user
+    assert "user:3" not in limiter._buckets
+
+
+def test_redis_failures_fall_back_to_per_process_buckets():
+    limiter = RateLimiter(capacity=2, client_capacity=0, costs={"/route": 1})
+    limiter.attach_redis(FakeRedis(fail=True))
+
+    async def spend():
+        return [await limiter.check("user:a", "/route") for _ in range(3)]
+
+    assert [decision.allowed for decision in asyncio.run(spend())] == [True, True, False]
@@ -0,0 +1,99 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from ai71.admission import AdmissionController, AdmissionRejected
+from ai71.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceededError, Resilience, RetryPolicy
+
+
+def failing_response(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+def test_breaker_opens_after_threshold_and_recovers_through_one_probe():
+    breaker = CircuitBreaker("test/open", failure_threshold=2, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    asyncio.run(asyncio.sleep(0.06))
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+
+def test_retries_retryable_errors_and_passes_client_errors_through():
+    resilience = Resilience("test-retry", policy=RetryPolicy(max_attempts=3, base_delay=0.001))
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise failing_response(503)
+        return "ok"
+
+    assert asyncio.run(resilience.call("flaky", flaky)) == "ok"
+    assert len(calls) == 3
+
+    async def rejected():
+        raise failing_response(400)
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(resilience.call("rejected", rejected))
+    assert resilience.breaker("rejected").failures == 0
+
+
+def test_local_errors_during_a_probe_leave_the_breaker_half_open():
+    resilience = Resilience("test-local", policy=RetryPolicy(max_attempts=1), failure_threshold=1, recovery_timeout=0.01)
+    breaker = resilience.breaker("parse")
+    breaker.record_failure()
+    asyncio.run(asyncio.sleep(0.02))
+
+    async def malformed_response():
+        return {}["choices"]
+
+    with pytest.raises(KeyError):
+        asyncio.run(resilience.call("parse", malformed_response))
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # The probe slot was given back, so the next call may probe
+    breaker.before_call()
+
+
+def test_timeouts_only_count_against_the_breaker_once_admitted():
+    admission = AdmissionController({"test": {"max_concurrency": 1, "max_wait": 10.0}})
+    resilience = Resilience("test-timeout", policy=RetryPolicy(max_attempts=1), deadlines={"slow": 0.05}, failure_threshold=1)
+
+    async def slow_upstream():
+        async with admission.slot("test", "model"):
+            await asyncio.sleep(1)
+
+    async def queued_behind_another_request():
+        async with admission.slot("test", "model"):
+            blocked = asyncio.create_task(resilience.call("slow", slow_upstream))
+            with pytest.raises(DeadlineExceededError):
+                await blocked
+
+    asyncio.run(queued_behind_another_request())
+    assert resilience.breaker("slow").state == CircuitBreaker.CLOSED
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(resilience.call("slow", slow_upstream))
+    assert resilience.breaker("slow").state == CircuitBreaker.OPEN
+
+
+def test_admission_rejection_leaves_the_breaker_alone():
+    resilience = Resilience("test-admission", failure_threshold=1)
+
+    async def refused():
+        raise AdmissionRejected("queue full", retry_after=1.0)
+
+    with pytest.raises(AdmissionRejected):
+        asyncio.run(resilience.call("refused", refused))
+    assert resilience.breaker("refused").state == CircuitBreaker.CLOSED
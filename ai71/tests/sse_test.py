@@ -0,0 +1,48 @@
+from ai71.sse import SSEParser, format_sse
+
+
+def feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.close())
+    return events
+
+
+def test_frames_split_across_chunks():
+    body = b'data: {"a": 1}\n\ndata: {"b": 2}\n\ndata: [DONE]\n\n'
+    chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+    events = feed_all(SSEParser(), chunks)
+    assert [e.data for e in events] == ['{"a": 1}', '{"b": 2}', "[DONE]"]
+
+
+def test_crlf_split_between_chunks_and_keepalives():
+    events = feed_all(SSEParser(), [b": keep-alive\r", b"\n\r\ndata: x\r", b"\n\r\n"])
+    assert [e.data for e in events] == ["x"]
+
+
+def test_multiline_data_event_and_id_fields():
+    events = feed_all(SSEParser(), [b"event: done\nid: 7\ndata: line1\ndata:line2\n\n"])
+    assert len(events) == 1
+    assert events[0].event == "done"
+    assert events[0].id == "7"
+    assert events[0].data == "line1\nline2"
+
+
+def test_utf8_sequence_split_across_chunks():
+    body = "data: héllo\n\n".encode("utf-8")
+    split = body.index(b"\xc3") + 1
+    events = feed_all(SSEParser(), [body[:split], body[split:]])
+    assert events[0].data == "héllo"
+
+
+def test_final_event_without_blank_line_is_flushed_on_close():
+    events = feed_all(SSEParser(), [b"data: tail"])
+    assert [e.data for e in events] == ["tail"]
+
+
+def test_format_sse_round_trip():
+    payload = format_sse("first\nsecond", event="done")
+    events = feed_all(SSEParser(), [payload])
+    assert events[0].event == "done"
+    assert events[0].data == "first\nsecond"
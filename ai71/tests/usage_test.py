@@ -0,0 +1,41 @@
+import typing
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from ai71.usage import TemplateOrder, UsageTracker
+
+
+def record(tracker, feature, prompt_tokens, completion_tokens):
+    messages = [{"role": "system", "content": f"You are the {feature} helper."}, {"role": "user", "content": "hi"}]
+    tracker.begin("ai71", "falcon", messages, feature).finish({"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+
+
+def test_templates_rank_by_the_requested_numeric_field():
+    tracker = UsageTracker()
+    record(tracker, "chatty", 10, 500)
+    record(tracker, "verbose", 400, 20)
+    record(tracker, "verbose", 200, 20)
+
+    assert [t["feature"] for t in tracker.top_templates()] == ["verbose", "chatty"]
+    assert [t["feature"] for t in tracker.top_templates(order_by="completion_tokens")] == ["chatty", "verbose"]
+    assert [t["feature"] for t in tracker.top_templates(order_by="avg_prompt_tokens")] == ["verbose", "chatty"]
+    assert [t["feature"] for t in tracker.top_templates(1, order_by="avg_completion_tokens")] == ["chatty"]
+
+    listed = tracker.top_templates()[0]
+    assert all(isinstance(listed[field], (int, float)) for field in typing.get_args(TemplateOrder))
+
+
+def test_unknown_order_is_rejected_as_a_query_parameter():
+    tracker = UsageTracker()
+    record(tracker, "chatty", 10, 500)
+    app = FastAPI()
+
+    @app.get("/prompt-costs")
+    async def prompt_costs(order_by: TemplateOrder = "total_tokens"):
+        return tracker.top_templates(order_by=order_by)
+
+    client = TestClient(app)
+    assert client.get("/prompt-costs", params={"order_by": "max_prompt_tokens"}).status_code == 200
+    assert client.get("/prompt-costs", params={"order_by": "total_token"}).status_code == 422
+    assert client.get("/prompt-costs", params={"order_by": "models"}).status_code == 422
@@ -0,0 +1,52 @@
+# ai71/tokens.py
+"""
+Token counting helpers backed by tiktoken.
+
+Encodings are resolved once per model and cached. Models tiktoken does not know (e.g. falcon)
+are counted with cl100k_base as an approximation. If no encoding can be loaded at all (the BPE
+files are fetched on first use), counts fall back to a characters-per-token estimate.
+"""
+
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead used by the chat format (role markers and separators)
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 2
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=32)
+def get_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed; token counts are estimated")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load a tiktoken encoding for {model}, token counts are estimated: {str(e)}")
+        return None
+
+
+def count_tokens(text: Optional[str], model: str = "gpt-4o-mini") -> int:
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = "gpt-4o-mini") -> int:
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + count_tokens(message.get("content"), model) + count_tokens(message.get("role"), model)
+    return total
@@ -0,0 +1,175 @@
+# ai71/transcript.py
+"""
+Background writer for LLM conversation transcripts.
+
+Callers hand records to `TranscriptWriter.record`, which only enqueues them on a bounded in-memory
+queue. A daemon thread drains the queue in batches and appends compact JSON lines to the transcript
+file, rotating it by size. When the queue fills up the writer first samples records and then drops
+them (or briefly blocks, when configured), counting every record that did not make it to disk.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptWriter:
+    """
+    Args:
+        path (str): The transcript file. Rotated files get a numeric suffix (`conversation.log.1`, ...).
+        enabled (bool): When False, `record` is a no-op.
+        max_queue (int): Maximum number of records waiting to be written.
+        batch_size (int): Maximum number of records written per flush.
+        flush_interval (float): Seconds the writer waits for more records before flushing a partial batch.
+        max_bytes (int): Size at which the transcript file is rotated.
+        backup_count (int): Number of rotated files to keep.
+        sample_threshold (float): Queue fill ratio above which records are sampled.
+        sample_rate (float): Fraction of records kept while sampling.
+        overflow (str): "drop" discards records when the queue is full; "block" waits up to `block_timeout`.
+        block_timeout (float): Seconds to wait for queue space in "block" mode before dropping.
+    """
+    def __init__(self, path: str = "conversation.log", enabled: bool = True, max_queue: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 1.0, max_bytes: int = 50_000_000,
+                 backup_count: int = 5, sample_threshold: float = 0.5, sample_rate: float = 0.1,
+                 overflow: str = "drop", block_timeout: float = 0.05):
+        if overflow not in ("drop", "block"):
+            raise ValueError("overflow must be 'drop' or 'block'")
+        self.path = path
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.sample_threshold = sample_threshold
+        self.sample_rate = sample_rate
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._records = registry.counter("transcript_records_total", "Transcript records by outcome")
+        self._rotations = registry.counter("transcript_rotations_total", "Size-based rotations of the transcript file")
+        registry.gauge("transcript_queue_depth", "Transcript records waiting to be written", callback=self._queue.qsize)
+
+    @classmethod
+    def from_env(cls) -> "TranscriptWriter":
+        return cls(
+            path=os.getenv("TRANSCRIPT_PATH", "conversation.log"),
+            enabled=os.getenv("DEV_MODE", "false").lower() in ("1", "true", "yes"),
+            max_queue=int(os.getenv("TRANSCRIPT_MAX_QUEUE", "10000")),
+            batch_size=int(os.getenv("TRANSCRIPT_BATCH_SIZE", "500")),
+            flush_interval=float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "1.0")),
+            max_bytes=int(os.getenv("TRANSCRIPT_MAX_BYTES", "50000000")),
+            backup_count=int(os.getenv("TRANSCRIPT_BACKUP_COUNT", "5")),
+            sample_threshold=float(os.getenv("TRANSCRIPT_SAMPLE_THRESHOLD", "0.5")),
+            sample_rate=float(os.getenv("TRANSCRIPT_SAMPLE_RATE", "0.1")),
+            overflow=os.getenv("TRANSCRIPT_OVERFLOW", "drop"),
+        )
+
+    def record(self, api_name: str, action: str, data: Any):
+        if not self.enabled:
+            return
+        self._ensure_started()
+
+        fill = self._queue.qsize() / self._queue.maxsize
+        if fill >= self.sample_threshold and random.random() >= self.sample_rate:
+            self._records.inc(outcome="sampled_out")
+            return
+
+        # The entry is serialized on the writer thread, so callers must not mutate `data` afterwards
+        entry = {"ts": datetime.now().isoformat(timespec="milliseconds"), "api": api_name, "action": action, "data": data}
+        try:
+            if self.overflow == "block":
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+            self._records.inc(outcome="enqueued")
+        except queue.Full:
+            self._records.inc(outcome="dropped")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self._queue.qsize(),
+            **{outcome: self._records.value(outcome=outcome)
+               for outcome in ("enqueued", "written", "sampled_out", "dropped", "failed")},
+            "rotations": self._rotations.value(),
+        }
+
+    def close(self, timeout: float = 5.0):
+        """Flushes pending records and stops the writer thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Transcript queue still full at shutdown; pending records are dropped")
+            return
+        thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(entry, separators=(",", ":"), default=str) + "\n" for entry in batch)
+        try:
+            self._rotate_if_needed()
+            with open(self.path, "a", encoding="utf-8") as log_file:
+                log_file.write(lines)
+            self._records.inc(len(batch), outcome="written")
+        except OSError as e:
+            logger.error(f"Failed to write {len(batch)} transcript records: {str(e)}")
+            self._records.inc(len(batch), outcome="failed")
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._rotations.inc()
+
+
+transcript_writer = TranscriptWriter.from_env()
@@ -0,0 +1,150 @@
+# ai71/usage.py
+"""
+Token accounting for upstream LLM calls.
+
+Each call is attributed to the HTTP endpoint that triggered it (`llm_endpoint`, set per request by
+the API's route class) and to a feature name passed by the calling component, e.g.
+`gamification.update_achievements`. Prompt tokens are counted with tiktoken before the request is
+sent; once the provider answers, its reported usage is recorded next to the estimate. Per-template
+aggregates (a template is a feature plus the fingerprint of its system prompt) back the
+`/api/debug/prompt-costs` endpoint.
+"""
+
+import hashlib
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Literal, Optional
+
+from .metrics import registry
+from .tokens import count_message_tokens, count_tokens
+
+llm_endpoint: ContextVar[str] = ContextVar("llm_endpoint", default="background")
+
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+UNATTRIBUTED = "unattributed"
+
+_prompt_tokens = registry.histogram("llm_prompt_tokens", "Provider-reported prompt tokens per call", TOKEN_BUCKETS)
+_completion_tokens = registry.histogram("llm_completion_tokens", "Provider-reported completion tokens per call", TOKEN_BUCKETS)
+_call_seconds = registry.histogram("llm_call_seconds", "Upstream LLM call latency including retries")
+_tokens_total = registry.counter("llm_tokens_total", "Tokens by provider, model, endpoint, feature and kind")
+_calls_total = registry.counter("llm_calls_total", "Upstream LLM calls by provider, model, endpoint, feature and outcome")
+
+
+def _fingerprint(messages: List[Dict[str, str]]) -> str:
+    system = next((message.get("content") or "" for message in messages if message.get("role") == "system"), "")
+    return hashlib.sha256(" ".join(system.split()).encode("utf-8")).hexdigest()[:12]
+
+
+def _preview(messages: List[Dict[str, str]], length: int = 120) -> str:
+    text = next((message.get("content") or "" for message in messages if message.get("role") == "system"), None)
+    if text is None and messages:
+        text = messages[0].get("content") or ""
+    return re.sub(r"\s+", " ", text or "").strip()[:length]
+
+
+class UsageRecord:
+    """One upstream call, created by `UsageTracker.begin` and completed by `finish` or `fail`."""
+
+    def __init__(self, tracker: "UsageTracker", provider: str, model: str, feature: str, messages: List[Dict[str, str]]):
+        self.tracker = tracker
+        self.provider = provider
+        self.model = model
+        self.labels = {"provider": provider, "model": model, "endpoint": llm_endpoint.get(), "feature": feature}
+        self.template = f"{feature}:{_fingerprint(messages)}"
+        self.preview = _preview(messages)
+        self.prompt_estimate = count_message_tokens(messages, model)
+        self.started = time.monotonic()
+        _tokens_total.inc(self.prompt_estimate, kind="prompt_estimated", **self.labels)
+
+    def finish(self, usage: Optional[Dict[str, Any]] = None, completion_text: Optional[str] = None):
+        """Records the provider-reported usage, falling back to local counts when none was reported."""
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or self.prompt_estimate
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = count_tokens(completion_text, self.model)
+        seconds = time.monotonic() - self.started
+        _prompt_tokens.observe(prompt_tokens, **self.labels)
+        _completion_tokens.observe(completion_tokens, **self.labels)
+        _call_seconds.observe(seconds, **self.labels)
+        _tokens_total.inc(prompt_tokens, kind="prompt", **self.labels)
+        _tokens_total.inc(completion_tokens, kind="completion", **self.labels)
+        _calls_total.inc(outcome="ok", **self.labels)
+        self.tracker._update_template(self, prompt_tokens, completion_tokens, seconds, reported="prompt_tokens" in usage)
+
+    def fail(self):
+        _call_seconds.observe(time.monotonic() - self.started, **self.labels)
+        _calls_total.inc(outcome="error", **self.labels)
+
+
+# The numeric per-template fields a listing can be ranked by.
+TemplateOrder = Literal[
+    "total_tokens", "prompt_tokens", "completion_tokens", "max_prompt_tokens", "estimated_prompt_tokens",
+    "calls", "reported_calls", "seconds", "avg_prompt_tokens", "avg_completion_tokens", "avg_seconds",
+]
+
+
+class UsageTracker:
+    """
+    Args:
+        max_templates (int): Distinct templates kept for the debug listing; the cheapest is evicted first.
+    """
+    def __init__(self, max_templates: int = 500):
+        self.max_templates = max_templates
+        self._templates: Dict[str, Dict[str, Any]] = {}
+
+    def begin(self, provider: str, model: str, messages: List[Dict[str, str]], feature: Optional[str] = None) -> UsageRecord:
+        return UsageRecord(self, provider, model, feature or UNATTRIBUTED, messages)
+
+    def _update_template(self, record: UsageRecord, prompt_tokens: int, completion_tokens: int, seconds: float, reported: bool):
+        stats = self._templates.get(record.template)
+        if stats is None:
+            if len(self._templates) >= self.max_templates:
+                cheapest = min(self._templates, key=lambda name: self._templates[name]["total_tokens"])
+                del self._templates[cheapest]
+            stats = self._templates[record.template] = {
+                "template": record.template,
+                "feature": record.labels["feature"],
+                "preview": record.preview,
+                "endpoints": set(),
+                "models": set(),
+                "calls": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_tokens": 0,
+                "max_prompt_tokens": 0,
+                "estimated_prompt_tokens": 0,
+                "reported_calls": 0,
+                "seconds": 0.0,
+            }
+        stats["endpoints"].add(record.labels["endpoint"])
+        stats["models"].add(f"{record.provider}/{record.model}")
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["total_tokens"] += prompt_tokens + completion_tokens
+        stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+        stats["estimated_prompt_tokens"] += record.prompt_estimate
+        stats["reported_calls"] += int(reported)
+        stats["seconds"] += seconds
+
+    def top_templates(self, limit: int = 20, order_by: TemplateOrder = "total_tokens") -> List[Dict[str, Any]]:
+        templates = [
+            {
+                **stats,
+                "endpoints": sorted(stats["endpoints"]),
+                "models": sorted(stats["models"]),
+                "avg_prompt_tokens": stats["prompt_tokens"] / stats["calls"],
+                "avg_completion_tokens": stats["completion_tokens"] / stats["calls"],
+                "avg_seconds": stats["seconds"] / stats["calls"],
+            }
+            for stats in self._templates.values()
+        ]
+        return sorted(templates, key=lambda stats: stats[order_by], reverse=True)[:limit]
+
+    def clear(self):
+        self._templates.clear()
+
+
+usage_tracker = UsageTracker()
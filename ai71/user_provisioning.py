@@ -0,0 +1,100 @@
+# ai71/user_provisioning.py
+"""
+Creation of tutor users on their first message.
+
+The tutor endpoints must make sure the student exists in `users` before their turns are stored.
+`ensure` does that with a single `INSERT ... ON CONFLICT DO NOTHING RETURNING id`, so two concurrent
+first messages of the same student cannot race into a unique constraint violation; at most one of
+them inserts. Ids known to exist are remembered in process, so later turns skip the database
+entirely, and concurrent calls for one id in this process share a single insert.
+
+Deleting a user must call `forget`; other workers may still treat the id as known for up to
+`known_ttl` seconds.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+
+from .database import AsyncSessionLocal, User, dialect_insert
+from .metrics import registry
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_provisioned = registry.counter("user_provisioning_total", "Tutor user lookups by outcome (known, created, existing, conflict)")
+
+
+class UserConflictError(Exception):
+    """The username or email of a new user already belongs to a different user id."""
+
+
+class UserProvisioner:
+    """
+    Args:
+        max_known (int): User ids remembered as existing, least recently used evicted first.
+        known_ttl (float): Seconds an id is trusted to exist without asking the database again.
+    """
+    def __init__(self, max_known: int = 100000, known_ttl: float = 600, session_factory=AsyncSessionLocal):
+        self.max_known = max_known
+        self.known_ttl = known_ttl
+        self.session_factory = session_factory
+        self._known: "OrderedDict[str, float]" = OrderedDict()
+        self._inserts = SingleFlight("user_provisioning")
+        registry.gauge("user_provisioning_known_ids", "User ids known to exist in this process", callback=lambda: len(self._known))
+
+    @classmethod
+    def from_env(cls) -> "UserProvisioner":
+        return cls(
+            max_known=int(os.getenv("USER_PROVISIONING_MAX_KNOWN", "100000")),
+            known_ttl=float(os.getenv("USER_PROVISIONING_KNOWN_TTL", "600")),
+        )
+
+    async def ensure(self, user_id: str, username: Optional[str], email: str) -> bool:
+        """Makes sure `user_id` exists; returns True if it had to be created. Raises `UserConflictError`."""
+        expires_at = self._known.get(user_id)
+        if expires_at is not None and expires_at > time.monotonic():
+            self._known.move_to_end(user_id)
+            _provisioned.inc(outcome="known")
+            return False
+        return await self._inserts.do(user_id, lambda: self._insert(user_id, username, email))
+
+    def forget(self, user_id: str):
+        self._known.pop(user_id, None)
+
+    async def _insert(self, user_id: str, username: Optional[str], email: str) -> bool:
+        async with self.session_factory() as db:
+            stmt = dialect_insert(User.__table__, db.bind.dialect.name).values(
+                id=user_id,
+                # Usernames are required and unique; students who did not pick one are named by their id
+                username=username or user_id,
+                email=email,
+                created_at=datetime.utcnow(),
+            ).on_conflict_do_nothing().returning(User.id)
+            created = (await db.execute(stmt)).scalar() is not None
+            if not created:
+                # The conflict was on the id (the user exists) or on the username or email of another user
+                exists = (await db.execute(select(User.id).where(User.id == user_id))).scalar() is not None
+            await db.commit()
+        if not created and not exists:
+            _provisioned.inc(outcome="conflict")
+            raise UserConflictError(f"The username or email of user {user_id} already belongs to another user")
+        _provisioned.inc(outcome="created" if created else "existing")
+        if created:
+            logger.info(f"Created user {user_id}")
+        self._remember(user_id)
+        return created
+
+    def _remember(self, user_id: str):
+        self._known[user_id] = time.monotonic() + self.known_ttl
+        self._known.move_to_end(user_id)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+
+user_provisioner = UserProvisioner.from_env()
@@ -0,0 +1,39 @@
+"""Persist dialogue conversations: role column and (user_id, character, timestamp) index
+
+Revision ID: b3c1e5a7d9f2
+Revises: 7f3bd4339298
+Create Date: 2026-10-17 10:12:41.205913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3c1e5a7d9f2'
+down_revision: Union[str, None] = '7f3bd4339298'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Student ids are the string ids of users.id
+    op.alter_column('conversation_history', 'user_id',
+               existing_type=sa.Integer(),
+               type_=sa.String(),
+               existing_nullable=True)
+    op.add_column('conversation_history', sa.Column('role', sa.String(), nullable=True))
+    op.create_index('ix_conversation_history_user_character_ts', 'conversation_history',
+                    ['user_id', 'character', 'timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversation_history_user_character_ts', table_name='conversation_history')
+    op.drop_column('conversation_history', 'role')
+    op.alter_column('conversation_history', 'user_id',
+               existing_type=sa.String(),
+               type_=sa.Integer(),
+               existing_nullable=True,
+               postgresql_using='user_id::integer')
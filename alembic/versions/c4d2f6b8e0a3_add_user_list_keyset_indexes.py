@@ -0,0 +1,30 @@
+"""Add (user_id, time) indexes backing keyset pagination of per-user lists
+
+Revision ID: c4d2f6b8e0a3
+Revises: b3c1e5a7d9f2
+Create Date: 2026-10-17 11:02:15.774120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d2f6b8e0a3'
+down_revision: Union[str, None] = 'b3c1e5a7d9f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_user_engagements_user_timestamp', 'user_engagements', ['user_id', 'timestamp'], unique=False)
+    op.create_index('ix_user_achievements_user_unlocked', 'user_achievements', ['user_id', 'unlocked_at'], unique=False)
+    op.create_index('ix_recommendations_user_recommended', 'recommendations', ['user_id', 'recommended_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recommendations_user_recommended', table_name='recommendations')
+    op.drop_index('ix_user_achievements_user_unlocked', table_name='user_achievements')
+    op.drop_index('ix_user_engagements_user_timestamp', table_name='user_engagements')
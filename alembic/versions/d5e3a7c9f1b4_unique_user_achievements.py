@@ -0,0 +1,53 @@
+"""Unique (user_id, achievement_id) on user_achievements for bulk upserts
+
+Revision ID: d5e3a7c9f1b4
+Revises: c4d2f6b8e0a3
+Create Date: 2026-10-18 09:41:07.318264
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e3a7c9f1b4'
+down_revision: Union[str, None] = 'c4d2f6b8e0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+DUPLICATES = "user_achievements_duplicates"
+
+
+def upgrade() -> None:
+    # Repeated unlocks of an achievement by a user are moved aside, not deleted, before enforcing
+    # uniqueness; the first unlock stays. Review them in user_achievements_duplicates and drop it.
+    op.create_table(
+        DUPLICATES,
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer()),
+        sa.Column('achievement_id', sa.Integer()),
+        sa.Column('unlocked_at', sa.DateTime()),
+    )
+    duplicates = (
+        "FROM user_achievements WHERE id NOT IN "
+        "(SELECT MIN(id) FROM user_achievements GROUP BY user_id, achievement_id)"
+    )
+    op.execute(f"INSERT INTO {DUPLICATES} (id, user_id, achievement_id, unlocked_at) SELECT id, user_id, achievement_id, unlocked_at {duplicates}")
+    if not context.is_offline_mode():
+        moved = op.get_bind().execute(sa.text(f"SELECT COUNT(*) FROM {DUPLICATES}")).scalar()
+        if moved:
+            logger.warning(f"Moved {moved} duplicate user achievements to {DUPLICATES}")
+    op.execute(f"DELETE {duplicates}")
+    op.create_index('uq_user_achievements_user_achievement', 'user_achievements', ['user_id', 'achievement_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('uq_user_achievements_user_achievement', table_name='user_achievements')
+    op.execute(f"INSERT INTO user_achievements (id, user_id, achievement_id, unlocked_at) SELECT id, user_id, achievement_id, unlocked_at FROM {DUPLICATES}")
+    op.drop_table(DUPLICATES)